@@ -1,7 +1,18 @@
+import logging
+import re
+import time
+import uuid
+
 import streamlit as st
-from transformers import pipeline
-from PIL import Image, ImageDraw, ImageFont
-import io
+
+from ia import config
+from ia.metriques import METRIQUES
+from ia.moteur import moteur_partage
+
+logging.basicConfig(level=config.NIVEAU_LOG)
+logger = logging.getLogger(__name__)
+
+_début_rendu = time.perf_counter()
 
 # ---------------------------
 # CONFIGURATION DE LA PAGE
@@ -20,138 +31,115 @@ st.divider()
 # ---------------------------
 @st.cache_resource
 def load_model():
-    try:
-        generator = pipeline("text-generation", model="distilgpt2")
-        return generator
-    except Exception as e:
-        st.error(f"Erreur de chargement du modèle : {e}")
-        return None
+    # Le modèle se charge en arrière-plan : la page s'affiche sans l'attendre.
+    # Le moteur est partagé avec l'API HTTP du même processus.
+    return moteur_partage()
 
-generator = load_model()
+@st.cache_resource
+def load_api(_moteur):
+    from ia import api
 
-# ---------------------------
-# GÉNÉRATION D’IMAGE SIMULÉE
-# ---------------------------
-def generer_image(prompt_image: str):
-    img = Image.new('RGB', (512, 512), color=(40, 40, 65))
-    draw = ImageDraw.Draw(img)
-    try:
-        font = ImageFont.truetype("arial.ttf", 24)
-    except IOError:
-        font = ImageFont.load_default()
-    texte = f"Simulation :\n{prompt_image[:90]}..."
-    draw.text((20, 230), texte, fill=(255, 255, 100), font=font)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    img_bytes.seek(0)
-    return img_bytes
+    return api.demarrer_en_arriere_plan(_moteur, config.API_HOTE, config.API_PORT)
+
+moteur = load_model()
+if config.API_PORT:
+    load_api(moteur)
 
 # ---------------------------
 # HISTORIQUE DU CHAT
 # ---------------------------
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    st.session_state.memory = []
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": "Bonjour ! Je suis un assistant IA léger basé sur distilGPT-2.\n"
-                   "Utilisez '!image <description>' pour générer une image simulée."
-    })
+_CARACTÈRES_DE_CONTRÔLE = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
 
-def afficher_historique():
-    for msg in st.session_state.messages:
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
+def preparer_markdown(contenu: str) -> str:
+    # Retire les caractères de contrôle émis par le modèle et garde les retours à la ligne
+    with METRIQUES.chronometrer("ia_etape_secondes", etape="markdown"):
+        return _CARACTÈRES_DE_CONTRÔLE.sub("", contenu).replace("\n", "  \n")
 
-afficher_historique()
+MESSAGE_ACCUEIL = (
+    "Bonjour ! Je suis un assistant IA léger basé sur distilGPT-2.\n"
+    "Utilisez '!image <description>' pour générer une image simulée, '!aide' pour les autres commandes."
+)
 
-# ---------------------------
-# ENTRÉE UTILISATEUR
-# ---------------------------
-if prompt := st.chat_input("Entrez votre message ici..."):
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    with st.chat_message("user"):
-        st.markdown(prompt)
-    
-    with st.chat_message("assistant"):
-        with st.spinner("L'IA réfléchit..."):
-            réponse_finale = ""
-
-            # Commande !image
-            if prompt.lower().startswith("!image"):
-                prompt_image = prompt[6:].strip() or "Aucune description"
-                st.info(f"Simulation d'image pour : {prompt_image}")
-                img_bytes = generer_image(prompt_image)
-                st.image(img_bytes, caption=f"Image simulée : {prompt_image}")
-                réponse_finale = "Voici une image simulée (version CPU)."
-
-            # Commande !mémoire
-            elif prompt.lower().startswith("!mémoire"):
-                mémoire_text = "\n".join(
-                    [f"- {m}" for m in st.session_state.memory[-5:]]
-                ) or "Mémoire vide."
-                réponse_finale = f"Derniers sujets :\n{mémoire_text}"
-
-            # Réponse textuelle via distilGPT-2
-            elif generator:
-                try:
-                    contexte = " ".join(st.session_state.memory[-2:]) + " " + prompt
-                    result = generator(
-                        contexte,
-                        max_length=100,
-                        num_return_sequences=1,
-                        temperature=0.8,
-                        top_k=50,
-                        top_p=0.9,
-                        do_sample=True
-                    )[0]['generated_text']
-
-                    if result.startswith(prompt):
-                        result = result[len(prompt):].strip()
-
-                    réponse_finale = result
-                    st.session_state.memory.append(prompt)
-                except Exception as e:
-                    réponse_finale = f"Erreur pendant la génération : {e}"
-            else:
-                réponse_finale = "Le modèle n’a pas pu être chargé."
-
-        st.session_state.messages.append({"role": "assistant", "content": réponse_finale})
-        st.markdown(réponse_finale)
+if "id_session" not in st.session_state:
+    # L'identifiant est aussi dans l'URL : un rechargement restaure la conversation
+    st.session_state.id_session = st.query_params.get("session") or uuid.uuid4().hex
+    st.query_params["session"] = st.session_state.id_session
+    st.session_state.rendus = {}
+    st.session_state.fenetre_historique = config.HISTORIQUE_FENETRE
+    st.session_state.durees_rendu = []
 
-st.divider()
-st.markdown("""
-<div style='text-align:center; color:gray; font-size:0.9em;'>
-Propulsé par distilGPT-2 | Compatible Streamlit Cloud | CPU uniquement
-</div>
-""", unsafe_allow_html=True)    draw = ImageDraw.Draw(img)
-    try:
-        font = ImageFont.truetype("arial.ttf", 24)
-    except IOError:
-        font = ImageFont.load_default()
-    texte = f"Simulation :\n{prompt_image[:90]}..."
-    draw.text((20, 230), texte, fill=(255, 255, 100), font=font)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    img_bytes.seek(0)
-    return img_bytes
+# La session vit dans le magasin partagé (et non dans session_state) pour
+# pouvoir être déchargée sur disque quand l'utilisateur est inactif.
+session = moteur.sessions.obtenir(st.session_state.id_session)
+if not session.historique and not session.resume.messages_archives:
+    session.ajouter_tour("assistant", MESSAGE_ACCUEIL)
 
 # ---------------------------
-# HISTORIQUE DU CHAT
+# CHOIX DU MODÈLE
 # ---------------------------
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    st.session_state.memory = []
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": "Bonjour ! Je suis un assistant IA léger basé sur distilGPT-2.\n"
-                   "Utilisez '!image <description>' pour générer une image simulée."
-    })
-
+registre = moteur.registre
+modèles = list(registre.modeles)
+modèle_actuel = session.modele if session.modele in registre.modeles else registre.defaut
+modèle = st.sidebar.selectbox(
+    "Modèle",
+    modèles,
+    index=modèles.index(modèle_actuel),
+    format_func=lambda alias: alias if alias == registre.modeles[alias] else f"{alias} ({registre.modeles[alias]})",
+)
+if modèle != modèle_actuel:
+    moteur.choisir_modele(session, modèle)
+    moteur.sessions.sauver(st.session_state.id_session, session)
+
+chargeur = moteur.chargeur_pour(session)
+
+@st.fragment(run_every=1.0)
+def afficher_chargement():
+    if chargeur.pret:
+        st.rerun()
+    st.info("Chargement du modèle en cours… Vous pouvez déjà écrire votre message.")
+
+if not chargeur.pret:
+    afficher_chargement()
+elif chargeur.erreur:
+    st.error(f"Erreur de chargement du modèle : {chargeur.erreur}")
+
+def rendu_markdown(tour) -> str:
+    # Le markdown préparé est mis en cache par identifiant de message
+    rendus = st.session_state.rendus
+    texte = rendus.get(tour.id)
+    if texte is None:
+        if len(rendus) > 2 * session.max_messages:
+            rendus.clear()
+        texte = rendus[tour.id] = preparer_markdown(tour.contenu)
+    return texte
+
+def afficher_variantes(variantes):
+    with st.expander(f"Autres propositions ({len(variantes)})"):
+        for variante in variantes:
+            st.markdown(preparer_markdown(variante))
+
+def élargir_historique():
+    st.session_state.fenetre_historique += config.HISTORIQUE_FENETRE
+
+@st.fragment
 def afficher_historique():
-    for msg in st.session_state.messages:
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
+    # Seuls les derniers messages sont rendus : le coût d'un rerun ne dépend
+    # plus de la longueur de la conversation.
+    messages = session.historique
+    fenêtre = st.session_state.fenetre_historique
+    masqués = max(0, len(messages) - fenêtre)
+    if session.resume.texte():
+        st.caption(session.resume.texte())
+    if masqués:
+        st.button(
+            f"Afficher les messages précédents ({masqués} masqués)",
+            on_click=élargir_historique,
+        )
+    for tour in messages[masqués:]:
+        with st.chat_message(tour.role):
+            st.markdown(rendu_markdown(tour))
+            if tour.variantes:
+                afficher_variantes(tour.variantes)
 
 afficher_historique()
 
@@ -159,470 +147,114 @@ afficher_historique()
 # ENTRÉE UTILISATEUR
 # ---------------------------
 if prompt := st.chat_input("Entrez votre message ici..."):
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    session.ajouter_tour("user", prompt)
     with st.chat_message("user"):
-        st.markdown(prompt)
-    
-    with st.chat_message("assistant"):
-        with st.spinner("L'IA réfléchit..."):
-            réponse_finale = ""
-
-            # Commande !image
-            if prompt.lower().startswith("!image"):
-                prompt_image = prompt[6:].strip() or "Aucune description"
-                st.info(f"Simulation d'image pour : {prompt_image}")
-                img_bytes = generer_image(prompt_image)
-                st.image(img_bytes, caption=f"Image simulée : {prompt_image}")
-                réponse_finale = "Voici une image simulée (version CPU)."
-
-            # Commande !mémoire
-            elif prompt.lower().startswith("!mémoire"):
-                mémoire_text = "\n".join(
-                    [f"- {m}" for m in st.session_state.memory[-5:]]
-                ) or "Mémoire vide."
-                réponse_finale = f"Derniers sujets :\n{mémoire_text}"
-
-            # Réponse textuelle via distilGPT-2
-            elif generator:
-                try:
-                    contexte = " ".join(st.session_state.memory[-2:]) + " " + prompt
-                    result = generator(
-                        contexte,
-                        max_length=100,
-                        num_return_sequences=1,
-                        temperature=0.8,
-                        top_k=50,
-                        top_p=0.9,
-                        do_sample=True
-                    )[0]['generated_text']
-
-                    if result.startswith(prompt):
-                        result = result[len(prompt):].strip()
-
-                    réponse_finale = result
-                    st.session_state.memory.append(prompt)
-                except Exception as e:
-                    réponse_finale = f"Erreur pendant la génération : {e}"
-            else:
-                réponse_finale = "Le modèle n’a pas pu être chargé."
-
-        st.session_state.messages.append({"role": "assistant", "content": réponse_finale})
-        st.markdown(réponse_finale)
-
-st.divider()
-st.markdown("""
-<div style='text-align:center; color:gray; font-size:0.9em;'>
-Propulsé par distilGPT-2 | Compatible Streamlit Cloud | CPU uniquement
-</div>
-""", unsafe_allow_html=True)# -----------------------------------------------------
-def generer_image(prompt_image: str):
-    """Crée une image simulée directement en mémoire."""
-    img = Image.new('RGB', (512, 512), color=(40, 40, 65))
-    draw = ImageDraw.Draw(img)
-
-    try:
-        font = ImageFont.truetype("arial.ttf", 24)
-    except IOError:
-        font = ImageFont.load_default()
-
-    texte = f"Simulation :\n{prompt_image[:90]}..."
-    draw.text((20, 230), texte, fill=(255, 255, 100), font=font)
-
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    img_bytes.seek(0)
-    return img_bytes
-
-# -----------------------------------------------------
-# INITIALISATION DU CHAT
-# -----------------------------------------------------
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    st.session_state.memory = []
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": "Bonjour ! Je suis un assistant IA léger basé sur distilGPT-2.\n"
-                   "Utilisez '!image <description>' pour générer une image simulée."
-    })
-
-# -----------------------------------------------------
-# AFFICHAGE DE L’HISTORIQUE
-# -----------------------------------------------------
-def afficher_historique():
-    for msg in st.session_state.messages:
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
-
-afficher_historique()
-
-# -----------------------------------------------------
-# ENTRÉE UTILISATEUR
-# -----------------------------------------------------
-if prompt := st.chat_input("Entrez votre message ici..."):
-    # Ajouter le message utilisateur
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    
-    # Afficher immédiatement le message
-    with st.chat_message("user"):
-        st.markdown(prompt)
-    
-    # Générer la réponse du bot
-    with st.chat_message("assistant"):
-        with st.spinner("L'IA réfléchit..."):
-            réponse_finale = ""
-
-            # Commande : !image
-            if prompt.lower().startswith("!image"):
-                prompt_image = prompt[6:].strip() or "Aucune description"
-                st.info(f"Simulation d'image pour : {prompt_image}")
-                img_bytes = generer_image(prompt_image)
-                st.image(img_bytes, caption=f"Image simulée : {prompt_image}")
-                réponse_finale = "Voici une image simulée (version CPU)."
-
-            # Commande : !mémoire
-            elif prompt.lower().startswith("!mémoire"):
-                mémoire_text = "\n".join(
-                    [f"- {m}" for m in st.session_state.memory[-5:]]
-                ) or "Mémoire vide."
-                réponse_finale = f"Derniers sujets :\n{mémoire_text}"
-
-            # Réponse textuelle via distilGPT-2
-            elif generator:
-                try:
-                    contexte = " ".join(st.session_state.memory[-2:]) + " " + prompt
-                    result = generator(
-                        contexte,
-                        max_length=100,
-                        num_return_sequences=1,
-                        temperature=0.8,
-                        top_k=50,
-                        top_p=0.9,
-                        do_sample=True
-                    )[0]['generated_text']
-
-                    # Nettoyer l’écho du prompt
-                    if result.startswith(prompt):
-                        result = result[len(prompt):].strip()
-
-                    réponse_finale = result
-                    st.session_state.memory.append(prompt)
-                except Exception as e:
-                    réponse_finale = f"Erreur pendant la génération : {e}"
-            else:
-                réponse_finale = "Le modèle n’a pas pu être chargé."
-
-        # Ajouter la réponse à l'historique et l'afficher
-        st.session_state.messages.append({"role": "assistant", "content": réponse_finale})
-        st.markdown(réponse_finale)
-
-# -----------------------------------------------------
-# PIED DE PAGE
-# -----------------------------------------------------
-st.divider()
-st.markdown("""
-<div style='text-align:center; color:gray; font-size:0.9em;'>
-Propulsé par distilGPT-2 | Compatible Streamlit Cloud | CPU uniquement
-</div>
-""", unsafe_allow_html=True)# GÉNÉRATION D’IMAGE SIMULÉE
-# -----------------------------------------------------
-def generer_image(prompt_image: str):
-    """Crée une image simulée directement en mémoire."""
-    img = Image.new('RGB', (512, 512), color=(40, 40, 65))
-    draw = ImageDraw.Draw(img)
-
-    try:
-        font = ImageFont.truetype("arial.ttf", 24)
-    except IOError:
-        font = ImageFont.load_default()
-
-    texte = f"Simulation :\n{prompt_image[:90]}..."
-    draw.text((20, 230), texte, fill=(255, 255, 100), font=font)
-
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    img_bytes.seek(0)
-    return img_bytes
-
-# -----------------------------------------------------
-# INITIALISATION DU CHAT
-# -----------------------------------------------------
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    st.session_state.memory = []
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": "Bonjour ! Je suis un assistant IA léger basé sur distilGPT-2.\n"
-                   "Utilisez '!image <description>' pour générer une image simulée."
-    })
-
-# -----------------------------------------------------
-# AFFICHAGE DE L’HISTORIQUE
-# -----------------------------------------------------
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-
-# -----------------------------------------------------
-# ENTRÉE UTILISATEUR
-# -----------------------------------------------------
-if prompt := st.chat_input("Entrez votre message ici..."):
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    with st.chat_message("user"):
-        st.markdown(prompt)
+        st.markdown(preparer_markdown(prompt))
 
     with st.chat_message("assistant"):
-        with st.spinner("L'IA réfléchit..."):
-            réponse_finale = ""
-
-            # Commande : !image
-            if prompt.lower().startswith("!image"):
-                prompt_image = prompt[6:].strip() or "Aucune description"
-                st.info(f"Simulation d'image pour : {prompt_image}")
-                img_bytes = generer_image(prompt_image)
-                st.image(img_bytes, caption=f"Image simulée : {prompt_image}")
-                réponse_finale = "Voici une image simulée (version CPU)."
-
-            # Commande : !mémoire
-            elif prompt.lower().startswith("!mémoire"):
-                mémoire_text = "\n".join(
-                    [f"- {m}" for m in st.session_state.memory[-5:]]
-                ) or "Mémoire vide."
-                réponse_finale = f"Derniers sujets :\n{mémoire_text}"
-
-            # Réponse textuelle
-            elif generator:
-                try:
-                    contexte = " ".join(st.session_state.memory[-2:]) + " " + prompt
-                    result = generator(
-                        contexte,
-                        max_length=100,
-                        num_return_sequences=1,
-                        temperature=0.8,
-                        top_k=50,
-                        top_p=0.9,
-                        do_sample=True
-                    )[0]['generated_text']
-
-                    if result.startswith(prompt):
-                        result = result[len(prompt):].strip()
-
-                    réponse_finale = result
-                    st.session_state.memory.append(prompt)
-                except Exception as e:
-                    réponse_finale = f"Erreur pendant la génération : {e}"
-            else:
-                réponse_finale = "Le modèle n’a pas pu être chargé."
-
-        st.markdown(réponse_finale)
-        st.session_state.messages.append({"role": "assistant", "content": réponse_finale})
-
-# -----------------------------------------------------
-# PIED DE PAGE
-# -----------------------------------------------------
-st.divider()
-st.markdown("""
-<div style='text-align:center; color:gray; font-size:0.9em;'>
-Propulsé par distilGPT-2 | Compatible Streamlit Cloud | CPU uniquement
-</div>
-""", unsafe_allow_html=True)    """Crée une image simulée (sans écriture disque, purement en mémoire)."""
-    img = Image.new('RGB', (512, 512), color=(45, 45, 65))
-    d = ImageDraw.Draw(img)
-
-    try:
-        font = ImageFont.truetype("arial.ttf", 26)
-    except IOError:
-        font = ImageFont.load_default()
-
-    texte = f"Simulation d'image :\n{prompt_image[:100]}..."
-    d.text((20, 230), texte, fill=(255, 255, 120), font=font)
-
-    # Conversion en mémoire (BytesIO)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    img_bytes.seek(0)
-    return img_bytes
-
-# -----------------------------------------------------
-# 💬 INITIALISATION DU CHAT
-# -----------------------------------------------------
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    st.session_state.memory = []  # mémoire courte
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": "👋 Bonjour ! Je suis un assistant IA léger propulsé par **GPT-2**. "
-                   "Demandez-moi de générer du texte, du code, ou tapez `!image votre prompt`."
-    })
-
-# -----------------------------------------------------
-# 🔄 AFFICHAGE DES MESSAGES
-# -----------------------------------------------------
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-
-# -----------------------------------------------------
-# 🧠 SAISIE UTILISATEUR
-# -----------------------------------------------------
-if prompt := st.chat_input("💬 Écrivez ici pour discuter..."):
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    with st.chat_message("user"):
-        st.markdown(prompt)
+        # Les commandes rapides (voir ia.commandes) n'attendent pas le modèle
+        if not chargeur.pret and not moteur.commandes.rapide(prompt):
+            with st.spinner("Chargement du modèle..."):
+                chargeur.attendre()
+
+        if config.STREAMING:
+            réponse = moteur.traiter(session, prompt, flux=True)
+        else:
+            with st.spinner("L'IA réfléchit..."):
+                # Chaque appel rend la main à Streamlit : une relance interrompt l'attente
+                attente = st.empty()
+                réponse = moteur.traiter(session, prompt, veille=attente.empty)
+
+        début_affichage = time.perf_counter()
+        if réponse.info:
+            st.info(preparer_markdown(réponse.info))
+        if réponse.image is not None:
+            st.image(réponse.image, caption=réponse.legende)
+        if réponse.morceaux is not None:
+            # Les tokens s'affichent dans la bulle au fur et à mesure
+            try:
+                st.write_stream(réponse.morceaux)
+            finally:
+                # Session relancée pendant le flux : la génération est annulée
+                réponse.morceaux.close()
+            if réponse.type == "erreur":
+                st.markdown(preparer_markdown(réponse.texte))
+        else:
+            st.markdown(preparer_markdown(réponse.texte))
+        if réponse.autres_candidats:
+            afficher_variantes(réponse.autres_candidats)
+        if réponse.stats is not None and réponse.stats.premier_token is not None:
+            st.caption(réponse.stats.resume())
+        if réponse.profil is not None:
+            # Dernière étape d'un tour profilé : l'affichage par Streamlit (voir ia.profilage)
+            durée_affichage = time.perf_counter() - début_affichage
+            réponse.profil.noter_rendu(durée_affichage)
+            st.caption(f"Rendu Streamlit : {durée_affichage * 1000:.1f} ms")
+
+        session.ajouter_tour("assistant", réponse.texte, réponse.autres_candidats)
+        moteur.sessions.sauver(st.session_state.id_session, session)
 
-    with st.chat_message("assistant"):
-        with st.spinner("💭 L’IA réfléchit..."):
-            réponse_finale = ""
-
-            # 🖼️ Commande : !image
-            if prompt.lower().startswith("!image"):
-                prompt_image = prompt[6:].strip() or "Aucune description"
-                st.info(f"🎨 Simulation d'image pour : **{prompt_image}**")
-
-                img_bytes = generer_image(prompt_image)
-                st.image(img_bytes, caption=f"Image simulée : {prompt_image}")
-                réponse_finale = "Voici votre image simulée 🖼️ (CPU friendly)."
-
-            # 🧠 Commande : !mémoire
-            elif prompt.lower().startswith("!mémoire"):
-                mémoire_text = "\n".join(
-                    [f"- {m}" for m in st.session_state.memory[-5:]]
-                ) or "Mémoire vide."
-                réponse_finale = f"🧠 **Derniers sujets :**\n{mémoire_text}"
-
-            # 💬 Réponse textuelle classique
-            else:
-                try:
-                    contexte = " ".join(st.session_state.memory[-3:]) + " " + prompt
-                    result = generator(
-                        contexte,
-                        max_length=180,
-                        num_return_sequences=1,
-                        temperature=0.8,
-                        top_k=50,
-                        top_p=0.9,
-                        do_sample=True
-                    )[0]['generated_text']
-
-                    # Nettoyer la sortie
-                    if result.startswith(prompt):
-                        result = result[len(prompt):].strip()
-
-                    réponse_finale = result
-                    st.session_state.memory.append(prompt)
-                except Exception as e:
-                    réponse_finale = f"⚠️ Erreur : {e}"
-
-        st.markdown(réponse_finale)
-        st.session_state.messages.append({"role": "assistant", "content": réponse_finale})
-
-# -----------------------------------------------------
-# 🧾 PIED DE PAGE
-# -----------------------------------------------------
-st.divider()
-st.markdown("""
-<div style='text-align:center; color:gray; font-size:0.9em;'>
-🚀 Propulsé par GPT-2 via 🤗 Transformers | 100 % compatible Streamlit Cloud 🌐 | Interface améliorée 💬
-</div>
-""", unsafe_allow_html=True)    """Simule la génération d'image (placeholder)."""
-    try:
-        img = Image.new('RGB', (512, 512), color=(40, 40, 60))
-        d = ImageDraw.Draw(img)
-        try:
-            font = ImageFont.truetype("arial.ttf", 28)
-        except IOError:
-            font = ImageFont.load_default()
-        d.text((20, 230), f"Simulation d'image :\n{prompt_image}", fill=(255, 255, 100), font=font)
-        img.save(output_filename)
-        return True
-    except Exception as e:
-        st.error(f"Erreur d'image : {e}")
-        return False
-
-# -----------------------------------------------------
-# 💬 INITIALISATION DE LA CONVERSATION
-# -----------------------------------------------------
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    st.session_state.memory = []  # mémoire courte
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": "👋 Bonjour ! Je suis un assistant IA léger. "
-                   "Tapez une question, une commande `!image`, ou du code à générer."
-    })
-
-# -----------------------------------------------------
-# 🔄 AFFICHAGE DES MESSAGES
-# -----------------------------------------------------
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-
-# -----------------------------------------------------
-# 💡 ENTRÉE UTILISATEUR
-# -----------------------------------------------------
-if prompt := st.chat_input("💬 Écrivez votre message ici..."):
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    with st.chat_message("user"):
-        st.markdown(prompt)
+# ---------------------------
+# BARRE LATÉRALE
+# ---------------------------
+if moteur.cache:
+    st.sidebar.subheader("Cache des réponses")
+    col_succès, col_échecs = st.sidebar.columns(2)
+    col_succès.metric("Succès", moteur.cache.succes)
+    col_échecs.metric("Échecs", moteur.cache.echecs)
+
+chargés = [m for m in registre.etat() if m["charge"]]
+if chargés:
+    st.sidebar.caption(
+        "Modèles chargés : "
+        + ", ".join(f"{m['alias']} ({m['empreinte_mo']:.0f} Mo)" for m in chargés)
+        + f" · budget {registre.budget_mo:.0f} Mo"
+    )
+
+durées = st.session_state.durees_rendu
+if durées:
+    st.sidebar.subheader("Rendu")
+    st.sidebar.caption(
+        f"Dernier rerun : {durées[-1] * 1000:.0f} ms · "
+        f"moyenne sur {len(durées)} : {sum(durées) / len(durées) * 1000:.0f} ms · "
+        f"{len(session.historique)} messages"
+    )
+
+if config.DEBUG or st.query_params.get("debug") == "1":
+    session.profil = st.sidebar.toggle(
+        "Profiler les réponses",
+        value=session.profil,
+        help=f"Trace torch, dump cProfile et chronologie par token dans {config.DOSSIER_PROFILS} (comme `!profil`).",
+    )
+    st.sidebar.subheader("Latence par étape")
+    st.sidebar.table([
+        {
+            "étape": dict(étiquettes).get("etape", ""),
+            "n": histo.nombre,
+            "p50 (ms)": f"{histo.centile(0.5) * 1000:.1f}",
+            "p95 (ms)": f"{histo.centile(0.95) * 1000:.1f}",
+        }
+        for étiquettes, histo in METRIQUES.histogrammes_de("ia_etape_secondes").items()
+    ])
+    st.sidebar.subheader("Compteurs")
+    compteurs = {**METRIQUES.compteurs, **METRIQUES.jauges()}
+    st.sidebar.table([
+        {"métrique": nom + "".join(f" {v}" for _, v in étiquettes), "valeur": f"{valeur:g}"}
+        for nom, série in sorted(compteurs.items())
+        for étiquettes, valeur in série.copy().items()
+    ])
+    if config.API_PORT:
+        st.sidebar.caption(f"Export Prometheus : http://{config.API_HOTE}:{config.API_PORT}/metriques")
 
-    # -------------------------------------------------
-    # 🧩 GÉNÉRATION DE RÉPONSE
-    # -------------------------------------------------
-    with st.chat_message("assistant"):
-        with st.spinner("L’IA réfléchit..."):
-            réponse_finale = ""
-
-            # 🖼️ Commande spéciale : génération d'image simulée
-            if prompt.lower().startswith("!image"):
-                prompt_image = prompt[6:].strip() or "Aucune description fournie"
-                filename = f"image_{datetime.datetime.now().strftime('%H%M%S')}.png"
-                st.info(f"🎨 Simulation d'image pour : **{prompt_image}**")
-
-                if generer_image(prompt_image, filename):
-                    st.image(filename, caption=f"Image simulée : {prompt_image}")
-                    réponse_finale = "Voici votre image simulée. (💡 La vraie génération nécessite un GPU)"
-                    os.remove(filename)
-                else:
-                    réponse_finale = "⚠️ Impossible de générer l'image simulée."
-
-            # 🧠 Commande spéciale : mémoire
-            elif prompt.lower().startswith("!mémoire"):
-                mémoire_text = "\n".join([f"- {m}" for m in st.session_state.memory[-5:]]) or "Mémoire vide."
-                réponse_finale = f"🧠 **Mémoire récente :**\n{mémoire_text}"
-
-            # 💬 Réponse GPT-2 (texte / code / discussion)
-            else:
-                try:
-                    input_text = " ".join(st.session_state.memory[-3:]) + " " + prompt
-                    response = generator(
-                        input_text,
-                        max_length=200,
-                        num_return_sequences=1,
-                        do_sample=True,
-                        temperature=0.8,
-                        top_k=50,
-                        top_p=0.95
-                    )[0]['generated_text']
-
-                    # Nettoyage
-                    if response.startswith(prompt):
-                        response = response[len(prompt):].strip()
-
-                    réponse_finale = response
-                    st.session_state.memory.append(prompt)  # stocke la mémoire courte
-                except Exception as e:
-                    st.error(f"Erreur du modèle : {e}")
-                    réponse_finale = "❌ Erreur de génération de texte."
-
-        st.markdown(réponse_finale)
-        st.session_state.messages.append({"role": "assistant", "content": réponse_finale})
-
-# -----------------------------------------------------
-# 🎛️ PIED DE PAGE
-# -----------------------------------------------------
 st.divider()
 st.markdown("""
 <div style='text-align:center; color:gray; font-size:0.9em;'>
-Propulsé par 🤗 Hugging Face | Conçu pour CPU | Interface Streamlit améliorée ✨
+Propulsé par distilGPT-2 | Compatible Streamlit Cloud | CPU uniquement
 </div>
 """, unsafe_allow_html=True)
+
+# Durée du rerun (hors génération, mesurée pour les reruns sans nouveau message)
+if not prompt:
+    durées.append(time.perf_counter() - _début_rendu)
+    del durées[:-50]
+    logger.debug("Rerun en %.1f ms", durées[-1] * 1000)
@@ -0,0 +1 @@
+"""Briques internes de l'assistant IA léger (génération, caches, serveurs)."""
@@ -0,0 +1,281 @@
+"""API HTTP asynchrone (asyncio, sans dépendance) devant le moteur de conversation.
+
+    POST /v1/messages   {"session": "abc", "message": "Bonjour", "flux": false, "modele": "gpt2"}
+    GET  /v1/modeles    modèles déclarés et chargés
+    POST /v1/modeles    {"defaut": "gpt2"} ou {"recharger": "gpt2"} (sans redémarrage)
+    GET  /sante
+    GET  /metriques     (format texte Prometheus)
+
+La réponse est en JSON, ou en server-sent events si `"flux": true` ou si
+l'en-tête `Accept: text/event-stream` est présent. Au-delà de
+`concurrence_max` générations en cours et `file_max` en attente, l'API
+répond 429 ; les commandes rapides (voir ia.commandes) ne passent ni par
+cette file ni par cette limite, mais une commande dont la limite de débit
+est atteinte reçoit aussi 429. Un client qui se déconnecte avant la réponse
+annule sa génération, avec ou sans flux.
+
+Usage autonome : python -m ia.api [--hote 127.0.0.1] [--port 8000]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from ia import config
+from ia.images import TYPES_MIME
+from ia.metriques import METRIQUES
+from ia.moteur import Moteur, moteur_partage
+from ia.taches import GenerationAnnulee
+
+logger = logging.getLogger(__name__)
+
+_STATUTS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 429: "Too Many Requests", 503: "Service Unavailable",
+}
+TAILLE_MAX_CORPS = 64 * 1024
+_FIN = object()
+
+
+class ErreurHTTP(Exception):
+    def __init__(self, statut: int, message: str):
+        super().__init__(message)
+        self.statut = statut
+
+
+class ServeurAPI:
+    def __init__(self, moteur: Moteur, concurrence_max: int = 4, file_max: int = 16):
+        self.moteur = moteur
+        self.concurrence_max = concurrence_max
+        self.file_max = file_max
+        self.admis = 0
+        self.rejetes = 0
+        self._executeur = ThreadPoolExecutor(max_workers=concurrence_max, thread_name_prefix="api")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def servir(self, hote: str, port: int):
+        self._semaphore = asyncio.Semaphore(self.concurrence_max)
+        METRIQUES.ajouter_collecteur(self.jauges)
+        serveur = await asyncio.start_server(self._connexion, hote, port)
+        logger.info("API HTTP à l'écoute sur http://%s:%d", hote, port)
+        async with serveur:
+            await serveur.serve_forever()
+
+    # ---------------------------
+    # HTTP
+    # ---------------------------
+    async def _connexion(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            methode, chemin, entetes, corps = await self._lire_requete(reader)
+            if chemin == "/sante":
+                await self._envoyer_json(writer, 200, {
+                    "pret": self.moteur.chargeur.pret,
+                    "modele_charge": self.moteur.chargeur.generator is not None,
+                    "en_cours": self.admis,
+                    "rejetes": self.rejetes,
+                })
+            elif chemin == "/metriques":
+                await self._envoyer(
+                    writer, 200, "text/plain; version=0.0.4; charset=utf-8",
+                    METRIQUES.exposer().encode("utf-8"),
+                )
+            elif chemin == "/v1/modeles":
+                await self._modeles(writer, methode, corps)
+            elif chemin == "/v1/messages":
+                if methode != "POST":
+                    raise ErreurHTTP(405, "Utilisez POST.")
+                await self._messages(reader, writer, entetes, corps)
+            else:
+                raise ErreurHTTP(404, f"Chemin inconnu : {chemin}")
+        except ErreurHTTP as e:
+            METRIQUES.incrementer("ia_erreurs_total", etape="api", exception=f"HTTP {e.statut}")
+            await self._envoyer_json(writer, e.statut, {"erreur": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.exception("Erreur de l'API HTTP")
+            METRIQUES.incrementer("ia_erreurs_total", etape="api", exception=type(e).__name__)
+        finally:
+            writer.close()
+
+    async def _lire_requete(self, reader: asyncio.StreamReader):
+        ligne = (await reader.readline()).decode("latin-1").strip()
+        try:
+            methode, cible, _ = ligne.split(" ", 2)
+        except ValueError:
+            raise ErreurHTTP(400, "Ligne de requête invalide.")
+        entetes = {}
+        while True:
+            ligne = (await reader.readline()).decode("latin-1")
+            if ligne in ("\r\n", "\n", ""):
+                break
+            nom, _, valeur = ligne.partition(":")
+            entetes[nom.strip().lower()] = valeur.strip()
+        longueur = int(entetes.get("content-length", 0) or 0)
+        if longueur > TAILLE_MAX_CORPS:
+            raise ErreurHTTP(413, "Corps de requête trop volumineux.")
+        corps = await reader.readexactly(longueur) if longueur else b""
+        return methode.upper(), cible.split("?", 1)[0], entetes, corps
+
+    def jauges(self):
+        yield "ia_api_en_cours", {}, self.admis
+        yield "ia_api_rejetees", {}, self.rejetes
+
+    async def _envoyer(self, writer: asyncio.StreamWriter, statut: int, type_contenu: str, corps: bytes):
+        writer.write(
+            f"HTTP/1.1 {statut} {_STATUTS.get(statut, '')}\r\n"
+            f"Content-Type: {type_contenu}\r\n"
+            f"Content-Length: {len(corps)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + corps
+        )
+        await writer.drain()
+
+    async def _envoyer_json(self, writer: asyncio.StreamWriter, statut: int, donnees: dict):
+        corps = json.dumps(donnees, ensure_ascii=False).encode("utf-8")
+        await self._envoyer(writer, statut, "application/json; charset=utf-8", corps)
+
+    @staticmethod
+    def _entete_flux(writer: asyncio.StreamWriter):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n"
+        )
+
+    async def _envoyer_evenement(self, writer: asyncio.StreamWriter, evenement: str, donnees: dict):
+        writer.write(
+            f"event: {evenement}\ndata: {json.dumps(donnees, ensure_ascii=False)}\n\n".encode("utf-8")
+        )
+        await writer.drain()
+
+    # ---------------------------
+    # GÉNÉRATION
+    # ---------------------------
+    async def _messages(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        entetes: dict, corps: bytes):
+        try:
+            requete = json.loads(corps or b"{}")
+            message = requete["message"]
+        except (ValueError, KeyError, TypeError):
+            raise ErreurHTTP(400, 'Corps JSON attendu : {"session": "...", "message": "..."}')
+        if not isinstance(message, str) or not message.strip():
+            raise ErreurHTTP(400, "Le champ `message` doit être une chaîne non vide.")
+        flux = bool(requete.get("flux")) or "text/event-stream" in entetes.get("accept", "")
+        identifiant = str(requete.get("session", "defaut"))
+        session = self.moteur.sessions.obtenir(identifiant)
+        if "modele" in requete:
+            try:
+                self.moteur.choisir_modele(session, requete["modele"])
+            except ValueError as e:
+                raise ErreurHTTP(400, str(e))
+
+        boucle = asyncio.get_running_loop()
+        if self.moteur.commandes.rapide(message):
+            # Sans modèle : rien à attendre derrière les générations en cours
+            reponse = await boucle.run_in_executor(None, self.moteur.traiter, session, message)
+            if reponse.type == "limite":
+                raise ErreurHTTP(429, reponse.texte)
+            self.moteur.sessions.sauver(identifiant, session)
+            if flux:
+                self._entete_flux(writer)
+                await self._envoyer_evenement(writer, "fin", self._corps_reponse(reponse))
+            else:
+                await self._envoyer_json(writer, 200, self._corps_reponse(reponse))
+            return
+
+        # Contre-pression : on refuse plutôt que de laisser la file grossir sans fin
+        if self.admis >= self.concurrence_max + self.file_max:
+            self.rejetes += 1
+            raise ErreurHTTP(429, "Trop de requêtes en attente, réessayez plus tard.")
+        def veille():
+            # Client parti pendant l'attente d'une réponse sans flux : la génération est annulée
+            if reader.at_eof() or writer.is_closing():
+                raise GenerationAnnulee("Client déconnecté.")
+
+        self.admis += 1
+        try:
+            async with self._semaphore:
+                reponse = await boucle.run_in_executor(
+                    self._executeur, self.moteur.traiter, session, message, flux,
+                    None if flux else veille,
+                )
+                if reponse.type == "surcharge":
+                    raise ErreurHTTP(503, reponse.texte)
+                if reponse.type == "limite":
+                    raise ErreurHTTP(429, reponse.texte)
+                if not flux:
+                    self.moteur.sessions.sauver(identifiant, session)
+                    await self._envoyer_json(writer, 200, self._corps_reponse(reponse))
+                    return
+                self._entete_flux(writer)
+                if reponse.morceaux is not None:
+                    morceaux = reponse.morceaux
+                    try:
+                        while True:
+                            morceau = await boucle.run_in_executor(self._executeur, next, morceaux, _FIN)
+                            if morceau is _FIN:
+                                break
+                            await self._envoyer_evenement(writer, "morceau", {"texte": morceau})
+                    finally:
+                        await boucle.run_in_executor(self._executeur, morceaux.close)
+                        self.moteur.sessions.sauver(identifiant, session)
+                await self._envoyer_evenement(writer, "fin", self._corps_reponse(reponse))
+        finally:
+            self.admis -= 1
+
+    # ---------------------------
+    # MODÈLES
+    # ---------------------------
+    async def _modeles(self, writer: asyncio.StreamWriter, methode: str, corps: bytes):
+        registre = self.moteur.registre
+        if methode == "POST":
+            try:
+                requete = json.loads(corps or b"{}")
+                if "defaut" in requete:
+                    registre.definir_defaut(requete["defaut"])
+                    registre.obtenir()
+                if "recharger" in requete:
+                    registre.recharger(requete["recharger"])
+            except (ValueError, TypeError) as e:
+                raise ErreurHTTP(400, str(e))
+        elif methode != "GET":
+            raise ErreurHTTP(405, "Utilisez GET ou POST.")
+        await self._envoyer_json(writer, 200, {
+            "modeles": registre.etat(),
+            "budget_mo": registre.budget_mo,
+            "evictions": registre.evictions,
+        })
+
+    @staticmethod
+    def _corps_reponse(reponse) -> dict:
+        donnees = reponse.en_dict()
+        if reponse.image is not None:
+            donnees["image_type"] = TYPES_MIME[config.IMAGE_FORMAT]
+            donnees["image_base64"] = base64.b64encode(reponse.image.getvalue()).decode("ascii")
+        return donnees
+
+
+def demarrer_en_arriere_plan(moteur: Moteur, hote: str, port: int) -> ServeurAPI:
+    """Lance l'API dans un fil dédié (boucle asyncio propre) à côté de Streamlit."""
+    api = ServeurAPI(moteur, config.API_CONCURRENCE_MAX, config.API_FILE_MAX)
+    threading.Thread(
+        target=asyncio.run, args=(api.servir(hote, port),), name="api-http", daemon=True
+    ).start()
+    return api
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API HTTP de l'assistant IA léger")
+    parser.add_argument("--hote", default=config.API_HOTE)
+    parser.add_argument("--port", type=int, default=config.API_PORT or 8000)
+    args = parser.parse_args()
+    logging.basicConfig(level=config.NIVEAU_LOG)
+    api = ServeurAPI(moteur_partage(), config.API_CONCURRENCE_MAX, config.API_FILE_MAX)
+    asyncio.run(api.servir(args.hote, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Arrêt anticipé du décodage et nettoyage de la réponse.
+
+distilGPT-2 va souvent jusqu'à `max_new_tokens` en se répétant : chaque token
+jamais affiché est du CPU perdu. La génération s'arrête donc dès que :
+- la réponse compte `IA_ARRET_PHRASES` phrases complètes ;
+- un n-gramme de `IA_ARRET_NGRAMME` tokens se répète ;
+- le modèle écrit une des chaînes d'arrêt de `IA_ARRET_CHAINES` ou, si
+  `IA_ARRET_TOURS` est activé, ouvre un nouveau tour de dialogue
+  (« \\nUtilisateur : »).
+
+`nettoyer()` retire ensuite le marqueur ou la chaîne d'arrêt et la phrase
+inachevée de fin ; `filtrer_flux()` n'affiche du flux que ce texte nettoyé,
+si bien que la réponse diffusée est celle gardée en mémoire. Une demande annulée (voir ia.taches) arrête aussi sa
+génération au pas de décodage suivant.
+"""
+import re
+import threading
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from ia import config
+
+# Début d'un nouveau tour : un rôle de dialogue en début de ligne, sans indentation.
+# Les autres lignes terminées par « : » (« else: », « Étape : ») ne sont pas des tours.
+MARQUEUR_TOUR = re.compile(r"\n(?:Utilisateur|User|IA|Assistant)[ \t]?:")
+_FIN_PHRASE = re.compile(r"[.!?…](?:[\"'»)\]]*)(?=\s|$)")
+# Token terminé par une ponctuation de fin : fin de phrase si le suivant commence par un blanc
+_FIN_TOKEN = re.compile(r"[.!?…](?:[\"'»)\]]*)$")
+# Tokens décodés en fin de séquence pour chercher une chaîne d'arrêt
+_FENETRE_TOKENS = 32
+
+
+class CritereArret(StoppingCriteria):
+    """Critères d'arrêt d'une génération (une instance par appel à `generate()`).
+
+    `longueur_prompt` est celle des `input_ids` passés à `generate()` (paddés
+    en batch) : le premier pas du décodage assisté peut déjà ajouter plusieurs
+    tokens, elle ne se déduit donc pas du premier appel. Les tokens générés
+    sont examinés une seule fois chacun.
+    """
+
+    def __init__(self, tokenizer, longueur_prompt: int, phrases: int = 0, ngramme: int = 0,
+                 chaines: Sequence[str] = (), marqueurs_tour: bool = False):
+        self.tokenizer = tokenizer
+        self.phrases = phrases
+        self.ngramme = ngramme
+        self.chaines = list(chaines)
+        self.marqueurs_tour = marqueurs_tour
+        self._longueur_prompt = longueur_prompt
+        self._vus = longueur_prompt
+        self._nb_phrases: Dict[int, int] = {}
+        self._ngrammes: Dict[int, set] = {}
+        self._arretes: Dict[int, bool] = {}
+        self._textes: Dict[int, str] = {}
+
+    def _texte_token(self, token: int) -> str:
+        texte = self._textes.get(token)
+        if texte is None:
+            texte = self._textes[token] = self.tokenizer.decode([token])
+        return texte
+
+    def __call__(self, input_ids: torch.LongTensor, scores, **kwargs) -> torch.BoolTensor:
+        longueur = input_ids.shape[1]
+        nouveaux = range(self._vus, longueur)
+        self._vus = longueur
+        lignes = input_ids.tolist()
+        arrets = [self._examiner(i, ligne, nouveaux) for i, ligne in enumerate(lignes)]
+        return torch.tensor(arrets, dtype=torch.bool, device=input_ids.device)
+
+    def _fins_phrase(self, ligne: List[int], position: int) -> int:
+        """Fins de phrase confirmées par le token `position`, selon la règle de `nettoyer()`.
+
+        Une ponctuation ne compte que suivie d'un blanc : « os.path » ou « 3.14 »
+        ne finissent pas de phrase. Celle qui termine le token précédent est
+        donc comptée ici, si ce token-ci commence par un blanc.
+        """
+        texte = self._texte_token(ligne[position])
+        fins = sum(1 for fin in _FIN_PHRASE.finditer(texte) if fin.end() < len(texte))
+        if (position > self._longueur_prompt and texte[:1].isspace()
+                and _FIN_TOKEN.search(self._texte_token(ligne[position - 1]))):
+            fins += 1
+        return fins
+
+    def _examiner(self, rangee: int, ligne: List[int], nouveaux: range) -> bool:
+        if self._arretes.get(rangee):
+            return True
+        generes = ligne[self._longueur_prompt:]
+        arret = False
+        for position in nouveaux:
+            token = ligne[position]
+            if self.phrases:
+                fins = self._fins_phrase(ligne, position)
+                if fins:
+                    self._nb_phrases[rangee] = self._nb_phrases.get(rangee, 0) + fins
+                    arret |= self._nb_phrases[rangee] >= self.phrases
+            if self.ngramme:
+                fin = position - self._longueur_prompt + 1
+                if fin >= self.ngramme:
+                    ngramme = tuple(generes[fin - self.ngramme:fin])
+                    vus = self._ngrammes.setdefault(rangee, set())
+                    arret |= ngramme in vus
+                    vus.add(ngramme)
+        if not arret and (self.chaines or self.marqueurs_tour):
+            queue = self.tokenizer.decode(generes[-_FENETRE_TOKENS:])
+            arret = any(c in queue for c in self.chaines) or bool(
+                self.marqueurs_tour and MARQUEUR_TOUR.search(queue)
+            )
+        self._arretes[rangee] = arret
+        return arret
+
+
+class CritereAnnulation(StoppingCriteria):
+    """Arrête les séquences dont la demande est annulée (un drapeau par prompt du batch)."""
+
+    def __init__(self, annulations: Sequence[threading.Event]):
+        self.annulations = list(annulations)
+
+    def __call__(self, input_ids: torch.LongTensor, scores, **kwargs) -> torch.BoolTensor:
+        annulees = torch.tensor([a.is_set() for a in self.annulations], dtype=torch.bool)
+        # Plusieurs séquences par prompt (candidats) : chaque drapeau vaut pour les siennes
+        return annulees.repeat_interleave(input_ids.shape[0] // len(annulees)).to(input_ids.device)
+
+
+def criteres(tokenizer, longueur_prompt: int,
+             annulations: Sequence[threading.Event] = ()) -> StoppingCriteriaList:
+    """Critères configurés par l'environnement, neufs pour chaque `generate()`."""
+    liste = StoppingCriteriaList([CritereArret(
+        tokenizer,
+        longueur_prompt,
+        phrases=config.ARRET_PHRASES,
+        ngramme=config.ARRET_NGRAMME,
+        chaines=config.ARRET_CHAINES,
+        marqueurs_tour=config.ARRET_TOURS,
+    )])
+    if annulations:
+        liste.append(CritereAnnulation(annulations))
+    return liste
+
+
+def signature() -> dict:
+    """Réglages d'arrêt, à inclure dans la clé du cache de réponses."""
+    return {
+        "phrases": config.ARRET_PHRASES,
+        "ngramme": config.ARRET_NGRAMME,
+        "chaines": config.ARRET_CHAINES,
+        "tours": config.ARRET_TOURS,
+    }
+
+
+def _coupure(texte: str) -> int:
+    """Position de la première chaîne d'arrêt ou du premier marqueur de tour (sinon la fin)."""
+    coupure = len(texte)
+    for chaine in config.ARRET_CHAINES:
+        position = texte.find(chaine)
+        if position != -1:
+            coupure = min(coupure, position)
+    if config.ARRET_TOURS:
+        marqueur = MARQUEUR_TOUR.search(texte)
+        if marqueur:
+            coupure = min(coupure, marqueur.start())
+    return coupure
+
+
+def nettoyer(texte: str) -> str:
+    """Retire ce qui suit un arrêt et, s'il reste une phrase complète, la phrase inachevée de fin."""
+    texte = texte[:_coupure(texte)]
+    if config.ARRET_PHRASES:
+        fins = list(_FIN_PHRASE.finditer(texte))
+        if fins:
+            texte = texte[:fins[min(len(fins), config.ARRET_PHRASES) - 1].end()]
+    return texte.strip()
+
+
+def _garde(texte: str, sur: int) -> Tuple[str, bool]:
+    """Début de `texte` que `nettoyer()` gardera quelle qu'en soit la suite, et s'il est complet.
+
+    Seuls les `sur` premiers caractères sont sûrs vis-à-vis des chaînes d'arrêt.
+    Une fin de phrase n'est confirmée que suivie d'un blanc ; au-delà de la
+    dernière, la phrase en cours peut encore être retirée comme inachevée.
+    """
+    limite = sur
+    if config.ARRET_PHRASES:
+        fins = [fin.end() for fin in _FIN_PHRASE.finditer(texte) if fin.end() < len(texte)]
+        if len(fins) >= config.ARRET_PHRASES:
+            return texte[:fins[config.ARRET_PHRASES - 1]].strip(), True
+        if fins:
+            limite = min(limite, fins[-1])
+    return texte[:max(0, limite)].strip(), False
+
+
+def filtrer_flux(morceaux: Iterator[str]) -> Iterator[str]:
+    """Laisse passer du flux exactement le texte que garde `nettoyer()`.
+
+    Les derniers caractères sont retenus tant qu'ils peuvent être le début d'un
+    marqueur, et la phrase en cours tant qu'elle peut être retirée.
+    """
+    retenue = max([len(c) for c in config.ARRET_CHAINES] + [24 if config.ARRET_TOURS else 0])
+    texte = sortie = ""
+    for morceau in morceaux:
+        texte += morceau
+        arrete = _coupure(texte) < len(texte)
+        if not arrete:
+            garde, arrete = _garde(texte, len(texte) - retenue)
+            if len(garde) > len(sortie):
+                yield garde[len(sortie):]
+                sortie = garde
+        if arrete:
+            # Le décodage s'arrête de lui-même : on consomme la fin sans l'afficher
+            for _ in morceaux:
+                pass
+            break
+    final = nettoyer(texte)
+    if len(final) > len(sortie):
+        yield final[len(sortie):]
@@ -0,0 +1,104 @@
+"""Décodage assisté : un petit modèle brouillon propose plusieurs tokens, le modèle principal
+les vérifie en une seule passe.
+
+Avec `do_sample=True`, transformers applique l'échantillonnage spéculatif : la
+distribution des tokens reste celle du modèle principal (température, top-k,
+top-p compris). Le brouillon doit partager le tokenizer du modèle principal.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+import torch
+from transformers import AutoModelForCausalLM, GPT2Config, GPT2LMHeadModel
+
+from ia import magasin
+from ia.streaming import StatsGeneration
+
+logger = logging.getLogger(__name__)
+
+# Brouillon aléatoire à 2 couches, pour tester la mécanique sans modèle distillé
+FACTICE = "factice"
+
+
+def _brouillon_factice(model) -> GPT2LMHeadModel:
+    config = GPT2Config(
+        vocab_size=model.config.vocab_size,
+        n_positions=model.config.n_positions,
+        n_embd=128,
+        n_layer=2,
+        n_head=2,
+        bos_token_id=model.config.bos_token_id,
+        eos_token_id=model.config.eos_token_id,
+    )
+    # Poids reproductibles sans toucher au générateur global, que les autres générations tirent
+    with torch.random.fork_rng():
+        torch.manual_seed(0)
+        return GPT2LMHeadModel(config)
+
+
+class Assistant:
+    """Modèle brouillon et comptage, par requête, des passes des deux modèles."""
+
+    def __init__(self, model, nom_brouillon: str, nb_tokens_proposes: int = 5):
+        if nom_brouillon == FACTICE:
+            brouillon = _brouillon_factice(model)
+        else:
+            brouillon = AutoModelForCausalLM.from_pretrained(magasin.source(nom_brouillon))
+        if brouillon.config.vocab_size != model.config.vocab_size:
+            raise ValueError(
+                f"Le brouillon {nom_brouillon!r} n'a pas le vocabulaire du modèle principal."
+            )
+        self.modele = brouillon.eval()
+        self.modele.generation_config.num_assistant_tokens = nb_tokens_proposes
+        # Débit du modèle principal seul, mesuré au chargement (tokens/s)
+        self.reference_tps = 0.0
+        self._suivies: Dict[int, StatsGeneration] = {}
+        model.register_forward_hook(self._passe_principale)
+        self.modele.register_forward_hook(self._passe_brouillon)
+
+    def params(self) -> dict:
+        return {"assistant_model": self.modele}
+
+    def mesurer_reference(self, generator, prompt: str, nb_tokens: int = 16):
+        """Chronomètre une génération non assistée de `nb_tokens` tokens."""
+        debut = time.perf_counter()
+        generator(
+            prompt,
+            max_new_tokens=nb_tokens,
+            min_new_tokens=nb_tokens,
+            do_sample=False,
+            pad_token_id=generator.tokenizer.eos_token_id,
+        )
+        self.reference_tps = nb_tokens / (time.perf_counter() - debut)
+
+    # Les hooks voient toutes les générations : seules celles du fil suivi comptent
+    def _passe_principale(self, module, args, sortie):
+        stats = self._suivies.get(threading.get_ident())
+        if stats is not None:
+            stats.passes_principales += 1
+
+    def _passe_brouillon(self, module, args, sortie):
+        stats = self._suivies.get(threading.get_ident())
+        if stats is not None:
+            stats.tokens_proposes += 1
+
+    @contextmanager
+    def suivre(self, stats: StatsGeneration):
+        """Compte les passes de la génération exécutée dans le fil courant."""
+        ident = threading.get_ident()
+        self._suivies[ident] = stats
+        try:
+            yield
+        finally:
+            del self._suivies[ident]
+            if stats.fin is None:
+                stats.fin = time.perf_counter()
+            # Chaque passe principale valide les tokens acceptés plus un token à elle
+            stats.tokens_acceptes = max(0, stats.nb_tokens - stats.passes_principales)
+            duree = stats.fin - stats.debut
+            if self.reference_tps and duree > 0 and stats.nb_tokens:
+                stats.acceleration = stats.nb_tokens / duree / self.reference_tps
+            logger.info("Décodage assisté : %s", stats.resume_assistance())
@@ -0,0 +1,90 @@
+"""Backends CPU interchangeables : PyTorch FP32, PyTorch INT8 dynamique et ONNX Runtime.
+
+Chaque backend renvoie un `pipeline("text-generation")` : la structure
+`[{"generated_text": ...}]` et les attributs `.model` / `.tokenizer` restent identiques.
+Un modèle empaqueté dans le magasin hors ligne (ia.magasin) est lu depuis
+celui-ci, sans accès au Hub.
+"""
+import logging
+import os
+import re
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+from transformers.pytorch_utils import Conv1D
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("fp32", "int8", "onnx")
+
+
+def _modele_et_tokenizer(nom_modele: str):
+    from ia import magasin
+
+    if magasin.disponible(nom_modele):
+        return magasin.charger(nom_modele)
+    logger.info("%s absent du magasin hors ligne : chargement via transformers", nom_modele)
+    return AutoModelForCausalLM.from_pretrained(nom_modele).eval(), AutoTokenizer.from_pretrained(nom_modele)
+
+
+def _fp32(nom_modele: str):
+    model, tokenizer = _modele_et_tokenizer(nom_modele)
+    return pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+
+def _conv1d_en_linear(module: torch.nn.Module):
+    """GPT-2 utilise des `Conv1D` que `quantize_dynamic` ignore : on les convertit en `Linear`."""
+    for nom, enfant in module.named_children():
+        if isinstance(enfant, Conv1D):
+            entree, sortie = enfant.weight.shape
+            linear = torch.nn.Linear(entree, sortie)
+            linear.weight.data = enfant.weight.data.t().contiguous()
+            linear.bias.data = enfant.bias.data
+            setattr(module, nom, linear)
+        else:
+            _conv1d_en_linear(enfant)
+
+
+def _int8(nom_modele: str):
+    model, tokenizer = _modele_et_tokenizer(nom_modele)
+    _conv1d_en_linear(model)
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+
+def _onnx(nom_modele: str, dossier: str):
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM
+    except ImportError as e:
+        raise ImportError(
+            "Le backend ONNX nécessite `optimum[onnxruntime]` (pip install optimum[onnxruntime])."
+        ) from e
+
+    # L'export est long : il est fait une fois puis relu depuis le disque
+    chemin = os.path.join(dossier, re.sub(r"[^\w.-]", "_", nom_modele))
+    if os.path.isfile(os.path.join(chemin, "model.onnx")):
+        model = ORTModelForCausalLM.from_pretrained(chemin)
+        tokenizer = AutoTokenizer.from_pretrained(chemin)
+    else:
+        logger.info("Export ONNX de %s vers %s", nom_modele, chemin)
+        model = ORTModelForCausalLM.from_pretrained(nom_modele, export=True, use_cache=True)
+        tokenizer = AutoTokenizer.from_pretrained(nom_modele)
+        model.save_pretrained(chemin)
+        tokenizer.save_pretrained(chemin)
+    return pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+
+def charger(backend: str, nom_modele: str, dossier_onnx: str = os.path.join(".cache", "onnx")):
+    """Construit le pipeline de génération pour le backend demandé."""
+    debut = time.perf_counter()
+    if backend == "fp32":
+        generator = _fp32(nom_modele)
+    elif backend == "int8":
+        generator = _int8(nom_modele)
+    elif backend == "onnx":
+        generator = _onnx(nom_modele, dossier_onnx)
+    else:
+        raise ValueError(f"Backend inconnu : {backend!r} (attendu : {', '.join(BACKENDS)})")
+    logger.info("Backend %s chargé en %.2f s", backend, time.perf_counter() - debut)
+    return generator
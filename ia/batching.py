@@ -0,0 +1,242 @@
+"""Serveur d'inférence partagé : regroupe les prompts de plusieurs sessions en micro-batchs."""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional
+
+from transformers.generation.streamers import BaseStreamer
+
+from ia import arret, kv_cache, runtime
+from ia.streaming import StatsGeneration
+
+logger = logging.getLogger(__name__)
+
+_FIN = object()
+
+
+@dataclass
+class _Requete:
+    contexte: str
+    params: dict
+    stats: StatsGeneration
+    resultat: Future = field(default_factory=Future)
+    flux: Optional[queue.Queue] = None
+    tokens: List[int] = field(default_factory=list)
+    texte_emis: str = ""
+    termine: bool = False
+    # Levé par le demandeur : sa ligne du batch s'arrête au pas de décodage suivant
+    annulation: threading.Event = field(default_factory=threading.Event)
+
+    def cle_params(self):
+        return tuple(sorted(self.params.items()))
+
+
+class _StreamerBatch(BaseStreamer):
+    """Répartit les tokens d'un batch entre les requêtes qui l'ont composé."""
+
+    def __init__(self, tokenizer, requetes: List[_Requete]):
+        self.tokenizer = tokenizer
+        self.requetes = requetes
+        self._prompt_vu = False
+
+    def put(self, value):
+        if not self._prompt_vu:
+            # Premier appel de generate() : les prompts (paddés) du batch
+            self._prompt_vu = True
+            return
+        maintenant = time.perf_counter()
+        # Un token par requête, ou plusieurs d'un coup en décodage assisté (batch de 1)
+        for req, tokens in zip(self.requetes, value.view(len(self.requetes), -1).tolist()):
+            for token in tokens:
+                if req.termine:
+                    break
+                if token == self.tokenizer.eos_token_id:
+                    req.termine = True
+                    break
+                if req.stats.premier_token is None:
+                    req.stats.premier_token = maintenant
+                req.stats.nb_tokens += 1
+                req.tokens.append(token)
+            self._emettre(req)
+
+    def end(self):
+        for req in self.requetes:
+            if req.flux is not None:
+                self._emettre(req, final=True)
+                req.flux.put(_FIN)
+
+    def _emettre(self, req: _Requete, final: bool = False):
+        if req.flux is None:
+            return
+        texte = self.tokenizer.decode(req.tokens, skip_special_tokens=True)
+        # Un caractère multi-octets incomplet attend le token suivant
+        if texte.endswith("�") and not final:
+            return
+        if len(texte) > len(req.texte_emis):
+            req.flux.put(texte[len(req.texte_emis):])
+            req.texte_emis = texte
+
+
+class ServeurBatch:
+    """File d'attente partagée devant le modèle, s'appelle comme le `pipeline` d'origine.
+
+    Un fil d'ordonnancement attend au plus `attente_max_ms` après la première
+    requête pour remplir un micro-batch de `taille_max` prompts, lance une seule
+    génération paddée à gauche puis rend chaque résultat à la session demandeuse.
+    Une requête seule passe par le cache KV (`cache_kv`) quand il est fourni.
+    """
+
+    def __init__(self, generator, taille_max: int = 8, attente_max_ms: float = 10.0,
+                 cache_kv: Optional[kv_cache.CacheKV] = None, assistant=None):
+        self.model = generator.model
+        self.cache_kv = cache_kv
+        # Le décodage assisté de transformers ne traite qu'un prompt à la fois
+        self.assistant = assistant
+        self.tokenizer = generator.tokenizer
+        # Les modèles décodeurs se paddent à gauche pour générer en batch
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.taille_max = max(1, taille_max)
+        self.attente_max = max(0.0, attente_max_ms) / 1000
+        self._file: "queue.Queue" = queue.Queue()
+        self.nb_batchs = 0
+        self.nb_requetes = 0
+        self._fil = threading.Thread(target=self._boucle, name="serveur-batch", daemon=True)
+        self._fil.start()
+
+    # ---------------------------
+    # API CLIENT
+    # ---------------------------
+    def soumettre(self, contexte: str, stats: Optional[StatsGeneration] = None,
+                  flux: bool = False, annulation: Optional[threading.Event] = None,
+                  **params) -> _Requete:
+        req = _Requete(contexte, params, stats or StatsGeneration())
+        if flux:
+            req.flux = queue.Queue()
+        if annulation is not None:
+            req.annulation = annulation
+        self._file.put(req)
+        return req
+
+    def __call__(self, contexte: str, num_return_sequences: int = 1,
+                 stats: Optional[StatsGeneration] = None,
+                 annulation: Optional[threading.Event] = None, **params):
+        if num_return_sequences != 1:
+            raise ValueError("Le serveur de batch ne génère qu'une séquence par requête.")
+        return self.soumettre(contexte, stats, annulation=annulation, **params).resultat.result()
+
+    def generer_en_flux(self, contexte: str, stats: Optional[StatsGeneration] = None,
+                        annulation: Optional[threading.Event] = None, **params) -> Iterator[str]:
+        """Équivalent de `ia.streaming.generer_en_flux` passant par le batch partagé."""
+        req = self.soumettre(contexte, stats, flux=True, annulation=annulation, **params)
+        while True:
+            morceau = req.flux.get()
+            if morceau is _FIN:
+                break
+            yield morceau
+        req.resultat.result()
+
+    def arreter(self):
+        self._file.put(None)
+        self._fil.join()
+
+    # ---------------------------
+    # ORDONNANCEMENT
+    # ---------------------------
+    def _boucle(self):
+        while True:
+            premiere = self._file.get()
+            if premiere is None:
+                return
+            lot = [premiere]
+            echeance = time.perf_counter() + self.attente_max
+            arret = False
+            while len(lot) < self.taille_max:
+                restant = echeance - time.perf_counter()
+                try:
+                    req = self._file.get(timeout=restant) if restant > 0 else self._file.get_nowait()
+                except queue.Empty:
+                    break
+                if req is None:
+                    arret = True
+                    break
+                lot.append(req)
+
+            # Seules les requêtes aux paramètres identiques partagent un generate()
+            groupes = {}
+            for req in lot:
+                if req.annulation.is_set():
+                    # Annulée pendant l'attente : rendue vide sans rien générer
+                    self._abandonner(req)
+                    continue
+                groupes.setdefault(req.cle_params(), []).append(req)
+            for cle_params, groupe in groupes.items():
+                # Une graine ne vaut que pour une génération : chaque requête à graine est tirée seule
+                if self.assistant is not None or any(nom == "seed" for nom, _ in cle_params):
+                    for req in groupe:
+                        self._executer([req])
+                else:
+                    self._executer(groupe)
+            if arret:
+                return
+
+    def _abandonner(self, req: _Requete):
+        req.stats.fin = time.perf_counter()
+        if req.flux is not None:
+            req.flux.put(_FIN)
+        req.resultat.set_result([{"generated_text": req.contexte}])
+
+    def _executer(self, groupe: List[_Requete]):
+        tokenizer = self.tokenizer
+        streamer = _StreamerBatch(tokenizer, groupe)
+        annulations = [req.annulation for req in groupe]
+        debut = time.perf_counter()
+        for req in groupe:
+            req.stats.debut = debut
+        try:
+            entrees = tokenizer([r.contexte for r in groupe], return_tensors="pt", padding=True)
+            longueur_prompt = entrees["input_ids"].shape[1]
+            # Des préfixes différents ne peuvent pas partager un même cache KV paddé
+            cache = self.cache_kv if len(groupe) == 1 else None
+            with runtime.contexte_inference():
+                if self.assistant is None:
+                    sorties = kv_cache.generer(
+                        self.model,
+                        entrees,
+                        cache,
+                        streamer=streamer,
+                        pad_token_id=tokenizer.pad_token_id,
+                        stopping_criteria=arret.criteres(tokenizer, longueur_prompt, annulations),
+                        **groupe[0].params,
+                    )
+                else:
+                    with self.assistant.suivre(groupe[0].stats):
+                        sorties = kv_cache.generer(
+                            self.model,
+                            entrees,
+                            streamer=streamer,
+                            pad_token_id=tokenizer.pad_token_id,
+                            stopping_criteria=arret.criteres(tokenizer, longueur_prompt, annulations),
+                            **groupe[0].params,
+                            **self.assistant.params(),
+                        )
+        except Exception as e:
+            logger.exception("Échec de la génération d'un batch de %d requêtes", len(groupe))
+            streamer.end()
+            for req in groupe:
+                req.stats.fin = time.perf_counter()
+                req.resultat.set_exception(e)
+            return
+
+        fin = time.perf_counter()
+        self.nb_batchs += 1
+        self.nb_requetes += len(groupe)
+        for req, sequence in zip(groupe, sorties):
+            req.stats.fin = fin
+            suite = tokenizer.decode(sequence[longueur_prompt:], skip_special_tokens=True)
+            req.resultat.set_result([{"generated_text": req.contexte + suite}])
+        logger.info("Batch de %d requêtes traité en %.2f s", len(groupe), fin - debut)
@@ -0,0 +1,109 @@
+"""Cache des réponses générées : LRU en mémoire et niveau SQLite optionnel sur disque."""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normaliser(contexte: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", contexte).split())
+
+
+def cle(contexte: str, nom_modele: str, params: dict) -> str:
+    """Clé stable dérivée du contexte normalisé, du modèle et des paramètres de génération."""
+    brut = json.dumps(
+        {"contexte": normaliser(contexte), "modele": nom_modele, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(brut.encode("utf-8")).hexdigest()
+
+
+def appliquer_graine(params: dict) -> dict:
+    """Fixe la graine torch si `seed` est demandé et renvoie les paramètres pour generate()."""
+    if "seed" not in params:
+        return params
+    import torch
+
+    params = dict(params)
+    torch.manual_seed(params.pop("seed"))
+    return params
+
+
+class CacheReponses:
+    """LRU en mémoire devant une table SQLite facultative, avec expiration (TTL)."""
+
+    def __init__(self, taille_max: int = 256, chemin_sqlite: Optional[str] = None,
+                 ttl_s: float = 86400):
+        self.taille_max = taille_max
+        self.ttl_s = ttl_s
+        self.succes = 0
+        self.echecs = 0
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()
+        self._verrou = threading.Lock()
+        self._db = None
+        if chemin_sqlite:
+            self._db = sqlite3.connect(chemin_sqlite, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS reponses "
+                "(cle TEXT PRIMARY KEY, reponse TEXT NOT NULL, cree REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _expire(self, cree: float) -> bool:
+        return self.ttl_s > 0 and time.time() - cree > self.ttl_s
+
+    def lire(self, cle: str) -> Optional[str]:
+        with self._verrou:
+            entree = self._lru.get(cle)
+            if entree is not None and self._expire(entree[1]):
+                del self._lru[cle]
+                entree = None
+            if entree is None and self._db is not None:
+                ligne = self._db.execute(
+                    "SELECT reponse, cree FROM reponses WHERE cle = ?", (cle,)
+                ).fetchone()
+                if ligne is not None and self._expire(ligne[1]):
+                    self._db.execute("DELETE FROM reponses WHERE cle = ?", (cle,))
+                    self._db.commit()
+                    ligne = None
+                if ligne is not None:
+                    entree = tuple(ligne)
+                    self._inserer_lru(cle, entree)
+            if entree is None:
+                self.echecs += 1
+                return None
+            self._lru.move_to_end(cle)
+            self.succes += 1
+            return entree[0]
+
+    def ecrire(self, cle: str, reponse: str):
+        entree = (reponse, time.time())
+        with self._verrou:
+            self._inserer_lru(cle, entree)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO reponses (cle, reponse, cree) VALUES (?, ?, ?)",
+                    (cle, *entree),
+                )
+                self._db.commit()
+
+    def vider(self):
+        with self._verrou:
+            self._lru.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM reponses")
+                self._db.commit()
+
+    def _inserer_lru(self, cle: str, entree: tuple):
+        self._lru[cle] = entree
+        self._lru.move_to_end(cle)
+        while len(self._lru) > self.taille_max:
+            self._lru.popitem(last=False)
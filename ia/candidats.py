@@ -0,0 +1,115 @@
+"""Plusieurs réponses candidates en un seul `generate()`, classées par un score peu coûteux.
+
+Le score d'un candidat est la log-probabilité moyenne de ses tokens sous le
+modèle (logits bruts, avant température et top-k/top-p), moins une pénalité
+proportionnelle à la part de bigrammes répétés.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import torch
+
+from ia import arret, kv_cache, runtime
+from ia.cache_reponses import appliquer_graine
+from ia.streaming import CompteurTokens, StatsGeneration
+
+
+@dataclass
+class Candidat:
+    texte: str
+    score: float
+    logprob_moyenne: float
+    repetition: float
+    nb_tokens: int
+
+
+def taux_repetition(ids: Sequence[int]) -> float:
+    """Part des bigrammes de `ids` déjà vus plus tôt dans la séquence."""
+    bigrammes = list(zip(ids, ids[1:]))
+    if not bigrammes:
+        return 0.0
+    return 1 - len(set(bigrammes)) / len(bigrammes)
+
+
+def classer(tokenizer, generes: torch.Tensor, logits: Sequence[torch.Tensor], n: int,
+            penalite_repetition: float = 1.0) -> List[List[Candidat]]:
+    """Classe les séquences générées par groupes de `n` (un groupe par prompt), meilleur d'abord.
+
+    `generes` : tokens générés seulement, `(B*n, T)` ; `logits` : un tenseur `(B*n, V)` par pas.
+    """
+    logprobs = torch.stack(
+        [torch.log_softmax(pas.float(), dim=-1).gather(1, generes[:, i:i + 1]).squeeze(1)
+         for i, pas in enumerate(logits)],
+        dim=1,
+    )
+    # Après le premier EOS, les tokens ne sont que du remplissage
+    fini = (generes == tokenizer.eos_token_id).long().cumsum(dim=1)
+    valides = (fini == 0) | ((fini == 1) & (generes == tokenizer.eos_token_id))
+    groupes: List[List[Candidat]] = []
+    for debut in range(0, generes.shape[0], n):
+        groupe = []
+        for i in range(debut, debut + n):
+            masque = valides[i]
+            nb = int(masque.sum())
+            moyenne = float(logprobs[i][masque].mean()) if nb else float("-inf")
+            ids = generes[i][masque].tolist()
+            repetition = taux_repetition(ids)
+            groupe.append(Candidat(
+                texte=arret.nettoyer(tokenizer.decode(ids, skip_special_tokens=True)),
+                score=moyenne - penalite_repetition * repetition,
+                logprob_moyenne=moyenne,
+                repetition=repetition,
+                nb_tokens=nb,
+            ))
+        groupe.sort(key=lambda c: c.score, reverse=True)
+        groupes.append(groupe)
+    return groupes
+
+
+def generer_candidats(model, tokenizer, contexte: str, n: int,
+                      cache: Optional[kv_cache.CacheKV] = None,
+                      stats: Optional[StatsGeneration] = None,
+                      penalite_repetition: float = 1.0,
+                      annulation: Optional[threading.Event] = None, **params) -> List[Candidat]:
+    """`n` suites de `contexte`, meilleure d'abord.
+
+    Le prefill du contexte n'est calculé qu'une fois (ou repris du cache KV),
+    puis son cache est dupliqué pour les `n` séquences.
+    """
+    params = appliquer_graine(params)
+    stats = stats or StatsGeneration()
+    ids = tokenizer(contexte)["input_ids"]
+    with runtime.contexte_inference():
+        longueur, past = cache.chercher(ids) if cache is not None else (0, None)
+        reste = ids[longueur:-1]
+        if reste:
+            sortie = model(torch.tensor([reste]), past_key_values=past, use_cache=True)
+            past = sortie.past_key_values
+            if cache is not None:
+                cache.ajouter(ids[:-1], past)
+        if past is not None:
+            # Vues sans copie : generate() concatène les nouveaux tokens dans de nouveaux tenseurs
+            params["past_key_values"] = tuple(
+                (k.expand(n, -1, -1, -1), v.expand(n, -1, -1, -1)) for k, v in past
+            )
+        input_ids = torch.tensor([ids]).expand(n, -1)
+        sortie = model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            return_dict_in_generate=True,
+            output_logits=True,
+            streamer=CompteurTokens(stats),
+            pad_token_id=tokenizer.eos_token_id,
+            stopping_criteria=arret.criteres(
+                tokenizer, len(ids), [annulation] if annulation is not None else ()
+            ),
+            **params,
+        )
+    candidats = classer(
+        tokenizer, sortie.sequences[:, len(ids):], sortie.logits, n, penalite_repetition
+    )[0]
+    stats.fin = time.perf_counter()
+    stats.nb_tokens = sum(c.nb_tokens for c in candidats)
+    return candidats
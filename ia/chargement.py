@@ -0,0 +1,180 @@
+"""Chargement du modèle en arrière-plan, avec préchauffage et mesure des temps de démarrage.
+
+Les imports lourds (torch, transformers) sont faits dans le fil de chargement :
+la première page s'affiche sans les attendre.
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+from ia import config
+
+logger = logging.getLogger(__name__)
+
+PROMPT_PRECHAUFFAGE = "Bonjour, ceci est un préchauffage."
+
+
+class ChargeurModele:
+    """Charge un modèle et ses objets (cache KV, serveur de batch) dans un fil dédié.
+
+    Les requêtes en cours tiennent le modèle par `acquerir()` / `relacher()` :
+    un modèle retiré du registre (ia.registre) n'est libéré qu'après la dernière.
+    """
+
+    def __init__(self, nom_modele: Optional[str] = None, backend: Optional[str] = None):
+        self.nom_modele = nom_modele or config.NOM_MODELE
+        self.backend = backend or config.BACKEND
+        # Mémoire occupée par les poids, connue une fois le modèle chargé
+        self.empreinte_mo = 0.0
+        self.en_cours = 0
+        self.retire = False
+        self._verrou = threading.Lock()
+        self.generator = None
+        self.cache_kv = None
+        self.serveur = None
+        self.assistant = None
+        self.erreur: Optional[Exception] = None
+        self.durees = {}
+        self._pret = threading.Event()
+        self._fil = threading.Thread(target=self._charger, name="chargement-modele", daemon=True)
+        self._fil.start()
+
+    @property
+    def pret(self) -> bool:
+        return self._pret.is_set()
+
+    def attendre(self, timeout: Optional[float] = None) -> bool:
+        return self._pret.wait(timeout)
+
+    def acquerir(self):
+        with self._verrou:
+            self.en_cours += 1
+
+    def relacher(self):
+        with self._verrou:
+            self.en_cours -= 1
+            liberer = self.retire and self.en_cours == 0
+        if liberer:
+            self._liberer()
+
+    def retirer(self):
+        """Le modèle ne reçoit plus de requêtes ; il est libéré dès qu'aucune n'est en cours."""
+        with self._verrou:
+            self.retire = True
+            liberer = self.en_cours == 0
+        if liberer:
+            self._liberer()
+
+    def _liberer(self):
+        # Le chargement doit être terminé pour que le serveur existe et puisse être arrêté
+        self.attendre()
+        if self.serveur is not None:
+            self.serveur.arreter()
+        if self.cache_kv is not None:
+            self.cache_kv.vider()
+        self.generator = self.serveur = self.assistant = None
+        logger.info("Modèle %s libéré (%.0f Mo)", self.nom_modele, self.empreinte_mo)
+
+    def _charger(self):
+        try:
+            debut = time.perf_counter()
+            from ia import backends, runtime
+            from ia.batching import ServeurBatch
+            from ia.kv_cache import CacheKV
+            self.durees["import"] = time.perf_counter() - debut
+
+            # Threads, affinité et allocateur : une fois par processus, avant le premier modèle
+            reglages = runtime.reglages_depuis_config()
+            runtime.appliquer(reglages)
+            debut = time.perf_counter()
+            generator = backends.charger(self.backend, self.nom_modele, config.DOSSIER_ONNX)
+            runtime.preparer_modele(generator.model, reglages.mode_inference)
+            self.durees["poids"] = time.perf_counter() - debut
+            self.empreinte_mo = _empreinte_mo(generator.model)
+
+            # Une génération synthétique paie le coût du premier appel
+            # (tokenizer, allocations, noyaux) avant le premier vrai message.
+            debut = time.perf_counter()
+            generator(
+                PROMPT_PRECHAUFFAGE,
+                max_new_tokens=8,
+                do_sample=False,
+                pad_token_id=generator.tokenizer.eos_token_id,
+            )
+            self.durees["prechauffage"] = time.perf_counter() - debut
+
+            self.cache_kv = CacheKV(config.CACHE_KV_CAPACITE_MO) if config.CACHE_KV else None
+            if config.ASSISTANT and config.WORKERS > 0:
+                logger.warning("IA_ASSISTANT ignoré : le brouillon n'est pas chargé dans les processus du pool.")
+            elif config.ASSISTANT:
+                from ia.assistant import Assistant
+
+                try:
+                    self.assistant = Assistant(generator.model, config.ASSISTANT, config.ASSISTANT_TOKENS)
+                except ValueError as e:
+                    logger.warning("Décodage assisté désactivé pour %s : %s", self.nom_modele, e)
+            if self.assistant is not None:
+                # Référence pour l'accélération par requête, puis préchauffage du brouillon
+                self.assistant.mesurer_reference(generator, PROMPT_PRECHAUFFAGE)
+                generator(
+                    PROMPT_PRECHAUFFAGE,
+                    max_new_tokens=8,
+                    do_sample=False,
+                    pad_token_id=generator.tokenizer.eos_token_id,
+                    **self.assistant.params(),
+                )
+                logger.info(
+                    "Décodage assisté par %s (référence : %.1f tokens/s)",
+                    config.ASSISTANT, self.assistant.reference_tps,
+                )
+            if config.WORKERS > 0 and self.backend != "fp32":
+                logger.warning("IA_WORKERS ignoré : le pool de processus ne partage que les poids FP32.")
+            if config.WORKERS > 0 and self.backend == "fp32":
+                from ia.pool import PoolWorkers
+
+                # Les processus reçoivent les poids FP32 du processus principal
+                # en mémoire partagée ; chacun a son propre cache KV.
+                self.serveur = PoolWorkers(
+                    generator,
+                    self.nom_modele,
+                    config.WORKERS,
+                    coeurs_par_worker=config.COEURS_PAR_WORKER,
+                    cache_kv_mo=config.CACHE_KV_CAPACITE_MO if config.CACHE_KV else 0,
+                    intervalle_sante_s=config.SANTE_INTERVALLE_S,
+                )
+            elif config.BATCHING:
+                # Un seul serveur de batch pour toutes les sessions Streamlit
+                self.serveur = ServeurBatch(
+                    generator,
+                    taille_max=config.TAILLE_MAX_BATCH,
+                    attente_max_ms=config.ATTENTE_MAX_BATCH_MS,
+                    cache_kv=self.cache_kv,
+                    assistant=self.assistant,
+                )
+            self.generator = generator
+            logger.info(
+                "Démarrage de %s : import %.2f s, poids %.2f s (%.0f Mo), préchauffage %.2f s",
+                self.nom_modele, self.durees["import"], self.durees["poids"], self.empreinte_mo,
+                self.durees["prechauffage"],
+            )
+        except Exception as e:
+            logger.exception("Échec du chargement du modèle %s", self.nom_modele)
+            self.erreur = e
+        finally:
+            self._pret.set()
+
+
+def _empreinte_mo(model) -> float:
+    """Taille des poids et buffers du modèle (0 pour un modèle ONNX, hors PyTorch)."""
+    if not hasattr(model, "state_dict"):
+        return 0.0
+    import torch
+
+    vus = {}
+    for valeur in model.state_dict().values():
+        # Les couches quantifiées exposent leurs poids en tuples
+        for tenseur in valeur if isinstance(valeur, tuple) else (valeur,):
+            if isinstance(tenseur, torch.Tensor):
+                vus[tenseur.data_ptr()] = tenseur.numel() * tenseur.element_size()
+    return sum(vus.values()) / (1024 * 1024)
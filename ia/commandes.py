@@ -0,0 +1,141 @@
+"""Routeur des commandes `!nom argument` : registre, analyse en une passe et limites de débit.
+
+Seul le nom de la commande est lu (expression précompilée ancrée sur le `!`
+initial) puis cherché dans un dictionnaire : le coût de l'aiguillage ne
+dépend ni du nombre de commandes enregistrées ni de la longueur du message,
+et un message ordinaire n'est même pas parcouru. Un `!mot` qui ne nomme
+aucune commande (« !important ») reste un message ordinaire, envoyé au
+modèle. Chaque commande déclare si elle est rapide (elle ne touche jamais au
+modèle : pas d'attente de son chargement ni de file derrière les
+générations) et peut limiter son débit par session (`IA_LIMITES_COMMANDES`, ex. « image=10/60,cache=2/60 »).
+"""
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from ia.sessions import Session
+
+_COMMANDE = re.compile(r"!(\w+)")
+
+
+@dataclass(frozen=True)
+class Limite:
+    """Au plus `nombre` appels par session sur une fenêtre glissante de `fenetre_s`."""
+    nombre: int
+    fenetre_s: float
+
+    def texte(self) -> str:
+        return f"{self.nombre} par {self.fenetre_s:g} s"
+
+
+@dataclass
+class Demande:
+    """Appel d'une commande : `argument` est le texte qui suit son nom."""
+    session: Session
+    argument: str
+    flux: bool = False
+    veille: Optional[Callable[[], None]] = None
+
+
+@dataclass
+class Commande:
+    nom: str
+    # Reçoit la `Demande`, renvoie une `ia.moteur.Reponse`
+    gestionnaire: Callable[[Demande], Any]
+    aide: str
+    alias: Tuple[str, ...] = ()
+    # Ne touche jamais au modèle
+    rapide: bool = True
+    limite: Optional[Limite] = None
+
+
+def limites_declarees(declaration: str) -> Dict[str, Limite]:
+    """`"image=10/60,cache=2/60"` → `{nom: Limite}` ; la fenêtre vaut 60 s si elle est omise."""
+    limites = {}
+    for entree in declaration.split(","):
+        entree = entree.strip()
+        if not entree:
+            continue
+        nom, _, regle = entree.partition("=")
+        nombre, _, fenetre = regle.partition("/")
+        try:
+            limites[nom.strip().lower()] = Limite(int(nombre), float(fenetre or 60))
+        except ValueError:
+            raise ValueError(f"Limite de commande invalide : {entree!r} (attendu : nom=nombre/secondes)")
+    return limites
+
+
+class Routeur:
+    """Commandes enregistrées par nom et alias ; les limites déclarées priment sur celles du code."""
+
+    def __init__(self, limites: Optional[Dict[str, Limite]] = None):
+        self._commandes: Dict[str, Commande] = {}
+        self._limites = limites or {}
+        self._verrou = threading.Lock()
+
+    def enregistrer(self, nom: str, gestionnaire: Callable[[Demande], Any], aide: str,
+                    alias: Sequence[str] = (), rapide: bool = True,
+                    limite: Optional[Limite] = None) -> Commande:
+        """Ajoute (ou remplace) la commande `!nom`, aussi accessible par ses alias."""
+        nom = nom.lower()
+        commande = Commande(
+            nom, gestionnaire, aide, tuple(a.lower() for a in alias), rapide,
+            self._limites.get(nom, limite),
+        )
+        for cle in (nom, *commande.alias):
+            self._commandes[cle] = commande
+        return commande
+
+    def commandes(self) -> List[Commande]:
+        """Commandes enregistrées, une fois chacune, dans l'ordre d'enregistrement."""
+        return list({id(c): c for c in self._commandes.values()}.values())
+
+    def analyser(self, prompt: str) -> Tuple[Optional[str], str]:
+        """`(nom en minuscules, argument)` si `prompt` est une commande, sinon `(None, prompt)`."""
+        if not prompt.startswith("!"):
+            return None, prompt
+        trouve = _COMMANDE.match(prompt)
+        if trouve is None:
+            return None, prompt
+        return trouve.group(1).lower(), prompt[trouve.end():].strip()
+
+    def trouver(self, nom: str) -> Optional[Commande]:
+        return self._commandes.get(nom)
+
+    def rapide(self, prompt: str) -> bool:
+        """Vrai si `prompt` est une commande rapide, traitée sans le modèle.
+
+        Un `!mot` qui n'est pas une commande enregistrée va au modèle comme le texte ordinaire.
+        """
+        nom, _ = self.analyser(prompt)
+        if nom is None:
+            return False
+        commande = self._commandes.get(nom)
+        return commande is not None and commande.rapide
+
+    def limiter(self, session: Session, commande: Commande) -> float:
+        """0 si l'appel est permis (et compté), sinon les secondes à attendre avant le prochain."""
+        limite = commande.limite
+        if limite is None:
+            return 0.0
+        maintenant = time.monotonic()
+        with self._verrou:
+            appels = session.appels_commandes.setdefault(commande.nom, deque())
+            while appels and appels[0] <= maintenant - limite.fenetre_s:
+                appels.popleft()
+            if len(appels) >= limite.nombre:
+                return appels[0] + limite.fenetre_s - maintenant
+            appels.append(maintenant)
+        return 0.0
+
+    def aide(self) -> str:
+        lignes = []
+        for commande in self.commandes():
+            ligne = f"- {commande.aide}"
+            if commande.limite is not None:
+                ligne += f" ({commande.limite.texte()})"
+            lignes.append(ligne)
+        return "\n".join(lignes)
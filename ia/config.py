@@ -0,0 +1,224 @@
+"""Configuration de l'application, lue depuis les variables d'environnement."""
+import os
+
+
+def _env_bool(nom: str, defaut: bool) -> bool:
+    valeur = os.environ.get(nom)
+    if valeur is None:
+        return defaut
+    return valeur.strip().lower() in ("1", "true", "oui", "yes", "on")
+
+
+# ---------------------------
+# GÉNÉRATION
+# ---------------------------
+NOM_MODELE = os.environ.get("IA_MODELE", "distilgpt2")
+# Modèles proposés par session : noms du Hub ou dossiers, « alias=chemin » possible
+MODELES = os.environ.get("IA_MODELES", "distilgpt2,gpt2")
+# Mémoire maximale des modèles chargés ensemble ; au-delà, les moins récents sont retirés
+MODELES_BUDGET_MO = float(os.environ.get("IA_MODELES_BUDGET_MO", "1500"))
+
+PARAMS_GENERATION = {
+    # Borne sur les tokens produits seulement : la latence ne dépend plus de l'historique
+    "max_new_tokens": int(os.environ.get("IA_MAX_NOUVEAUX_TOKENS", "80")),
+    "temperature": 0.8,
+    "top_k": 50,
+    "top_p": 0.9,
+    "do_sample": True,
+}
+
+# Décodage : "echantillonnage" (par défaut), "glouton" ou "graine" (échantillonnage à graine fixe)
+DECODAGE = os.environ.get("IA_DECODAGE", "echantillonnage")
+GRAINE = int(os.environ.get("IA_GRAINE", "0"))
+if DECODAGE == "glouton":
+    PARAMS_GENERATION = {"max_new_tokens": PARAMS_GENERATION["max_new_tokens"], "do_sample": False}
+elif DECODAGE == "graine":
+    PARAMS_GENERATION["seed"] = GRAINE
+# La graine fixe le générateur global de torch, que les générations simultanées (batch, API,
+# candidats) se partagent : seul le décodage glouton donne toujours la même réponse
+DETERMINISTE = DECODAGE == "glouton"
+
+# Nombre maximal de tokens de contexte (historique + message) envoyés au modèle
+BUDGET_CONTEXTE_TOKENS = int(os.environ.get("IA_BUDGET_CONTEXTE", "192"))
+
+# Affichage des tokens au fil de l'eau dans la bulle de l'assistant
+STREAMING = _env_bool("IA_STREAMING", True)
+
+# ---------------------------
+# ARRÊT ANTICIPÉ (voir ia.arret)
+# ---------------------------
+# Phrases complètes après lesquelles la réponse s'arrête (0 : pas de limite)
+ARRET_PHRASES = int(os.environ.get("IA_ARRET_PHRASES", "3"))
+# Taille des n-grammes de tokens dont la répétition arrête la génération (0 : désactivé)
+ARRET_NGRAMME = int(os.environ.get("IA_ARRET_NGRAMME", "4"))
+# Arrêt quand le modèle entame un nouveau tour de dialogue (« \nUtilisateur : », « \nIA : »…) ;
+# désactivé par défaut, le modèle ne voyant pas ces marqueurs dans son contexte
+ARRET_TOURS = _env_bool("IA_ARRET_TOURS", False)
+# Chaînes d'arrêt supplémentaires, séparées par « | »
+ARRET_CHAINES = [c for c in os.environ.get("IA_ARRET_CHAINES", "").split("|") if c]
+
+# ---------------------------
+# CANDIDATS MULTIPLES
+# ---------------------------
+# Réponses générées en parallèle par message (1 : une seule) ; la mieux notée est affichée
+CANDIDATS = int(os.environ.get("IA_CANDIDATS", "1"))
+# Poids de la part de bigrammes répétés dans le score d'un candidat
+PENALITE_REPETITION = float(os.environ.get("IA_PENALITE_REPETITION", "1.0"))
+
+# ---------------------------
+# DÉCODAGE ASSISTÉ
+# ---------------------------
+# Modèle brouillon (nom, dossier local, ou "factice" pour un GPT-2 aléatoire à 2 couches) ;
+# vide : décodage classique
+ASSISTANT = os.environ.get("IA_ASSISTANT", "")
+# Tokens proposés par passe du brouillon (ajusté ensuite par transformers)
+ASSISTANT_TOKENS = int(os.environ.get("IA_ASSISTANT_TOKENS", "5"))
+
+# ---------------------------
+# SERVEUR DE BATCH PARTAGÉ
+# ---------------------------
+# Les prompts des différentes sessions sont regroupés en micro-batchs
+BATCHING = _env_bool("IA_BATCHING", True)
+TAILLE_MAX_BATCH = int(os.environ.get("IA_BATCH_TAILLE_MAX", "8"))
+ATTENTE_MAX_BATCH_MS = float(os.environ.get("IA_BATCH_ATTENTE_MS", "10"))
+
+# ---------------------------
+# TÂCHES DE GÉNÉRATION (voir ia.taches)
+# ---------------------------
+# Générations exécutées en même temps (de quoi remplir un micro-batch) ; les suivantes attendent
+GENERATIONS_SIMULTANEES = int(os.environ.get("IA_GENERATIONS_SIMULTANEES", str(TAILLE_MAX_BATCH)))
+
+# ---------------------------
+# CACHE KV ENTRE LES TOURS
+# ---------------------------
+CACHE_KV = _env_bool("IA_CACHE_KV", True)
+CACHE_KV_CAPACITE_MO = float(os.environ.get("IA_CACHE_KV_MO", "256"))
+
+# ---------------------------
+# CACHE DES RÉPONSES
+# ---------------------------
+# N'est utilisé qu'en décodage glouton (IA_DECODAGE=glouton)
+CACHE_REPONSES = _env_bool("IA_CACHE_REPONSES", False)
+CACHE_REPONSES_TAILLE = int(os.environ.get("IA_CACHE_REPONSES_TAILLE", "256"))
+CACHE_REPONSES_SQLITE = os.environ.get("IA_CACHE_REPONSES_SQLITE") or None
+CACHE_REPONSES_TTL_S = float(os.environ.get("IA_CACHE_REPONSES_TTL_S", "86400"))
+
+# ---------------------------
+# BACKEND D'INFÉRENCE
+# ---------------------------
+# "fp32" (PyTorch), "int8" (quantification dynamique PyTorch) ou "onnx" (ONNX Runtime)
+BACKEND = os.environ.get("IA_BACKEND", "fp32")
+DOSSIER_ONNX = os.environ.get("IA_DOSSIER_ONNX", os.path.join(".cache", "onnx"))
+# Magasin hors ligne (python -m ia.magasin empaqueter …) : un modèle empaqueté
+# est chargé depuis ce dossier, sans accès au Hub
+MAGASIN = os.environ.get("IA_MAGASIN", os.path.join(".cache", "modeles"))
+# "complete" (SHA-256 de chaque fichier), "taille" (tailles seulement) ou "aucune"
+MAGASIN_VERIFICATION = os.environ.get("IA_MAGASIN_VERIFICATION", "complete")
+
+# ---------------------------
+# JOURNALISATION
+# ---------------------------
+NIVEAU_LOG = os.environ.get("IA_LOG", "INFO").upper()
+# Barre latérale de débogage (métriques par étape) ; aussi via `?debug=1` dans l'URL
+DEBUG = _env_bool("IA_DEBUG", False)
+# Sorties des tours profilés (commande !profil, voir ia.profilage)
+DOSSIER_PROFILS = os.environ.get("IA_DOSSIER_PROFILS", os.path.join(".cache", "profils"))
+
+# ---------------------------
+# COMMANDES (voir ia.commandes)
+# ---------------------------
+# Appels permis par session et par commande, ex. « image=10/60 » (10 par fenêtre de 60 s)
+LIMITES_COMMANDES = os.environ.get("IA_LIMITES_COMMANDES", "image=10/60,profil=5/60,cache=2/60")
+
+# ---------------------------
+# API HTTP
+# ---------------------------
+# L'API est démarrée avec Streamlit si IA_API_PORT est défini (ou via `python -m ia.api`)
+API_HOTE = os.environ.get("IA_API_HOTE", "127.0.0.1")
+API_PORT = int(os.environ["IA_API_PORT"]) if os.environ.get("IA_API_PORT") else None
+# Générations simultanées, puis requêtes en attente au-delà desquelles on répond 429
+API_CONCURRENCE_MAX = int(os.environ.get("IA_API_CONCURRENCE_MAX", "4"))
+API_FILE_MAX = int(os.environ.get("IA_API_FILE_MAX", "16"))
+
+# ---------------------------
+# IMAGES SIMULÉES
+# ---------------------------
+# "png", "webp" ou "jpeg"
+IMAGE_FORMAT = os.environ.get("IA_IMAGE_FORMAT", "png").lower()
+IMAGE_PNG_COMPRESSION = int(os.environ.get("IA_IMAGE_PNG_COMPRESSION", "9"))
+IMAGE_QUALITE = int(os.environ.get("IA_IMAGE_QUALITE", "80"))
+IMAGE_CACHE_TAILLE = int(os.environ.get("IA_IMAGE_CACHE_TAILLE", "128"))
+
+# ---------------------------
+# INTERFACE
+# ---------------------------
+# Nombre de messages affichés, puis chargés à chaque demande d'historique plus ancien
+HISTORIQUE_FENETRE = int(os.environ.get("IA_HISTORIQUE_FENETRE", "20"))
+
+# ---------------------------
+# SESSIONS
+# ---------------------------
+# Plafonds par session : au-delà, les plus anciens tours sont résumés puis oubliés
+SESSION_MAX_MESSAGES = int(os.environ.get("IA_SESSION_MAX_MESSAGES", "200"))
+SESSION_MAX_MEMOIRE = int(os.environ.get("IA_SESSION_MAX_MEMOIRE", "50"))
+# Sessions gardées en RAM ; les autres (et les inactives) partent dans SQLite si configuré
+SESSIONS_MAX_EN_MEMOIRE = int(os.environ.get("IA_SESSIONS_MAX_EN_MEMOIRE", "1000"))
+SESSIONS_INACTIVITE_S = float(os.environ.get("IA_SESSIONS_INACTIVITE_S", "3600"))
+SESSIONS_SQLITE = os.environ.get("IA_SESSIONS_SQLITE") or None
+
+# ---------------------------
+# MÉMOIRE SÉMANTIQUE (voir ia.index_memoire)
+# ---------------------------
+# Taille de l'espace de hachage des vecteurs TF-IDF (creux : seuls les termes présents coûtent)
+MEMOIRE_DIMENSION = int(os.environ.get("IA_MEMOIRE_DIMENSION", str(1 << 18)))
+# Anciens messages les plus proches du nouveau ajoutés au contexte (0 : seulement les récents)
+MEMOIRE_RAPPELS = int(os.environ.get("IA_MEMOIRE_RAPPELS", "2"))
+# Similarité cosinus minimale d'un message rappelé
+MEMOIRE_SEUIL = float(os.environ.get("IA_MEMOIRE_SEUIL", "0.2"))
+
+# ---------------------------
+# POOL DE PROCESSUS
+# ---------------------------
+# Nombre de processus de génération (0 : génération dans le processus Streamlit)
+WORKERS = int(os.environ.get("IA_WORKERS", "0"))
+# Cœurs par processus (0 : les cœurs disponibles sont répartis entre les processus)
+COEURS_PAR_WORKER = int(os.environ.get("IA_COEURS_PAR_WORKER", "0"))
+SANTE_INTERVALLE_S = float(os.environ.get("IA_SANTE_INTERVALLE_S", "2"))
+
+# ---------------------------
+# RUNTIME TORCH (voir ia.runtime)
+# ---------------------------
+# Réglages de l'hôte écrits par `python -m ia.runtime regler` ; vide : aucun fichier.
+# Chaque variable ci-dessous, si elle est définie, prime sur le fichier.
+RUNTIME_FICHIER = os.environ.get("IA_RUNTIME_FICHIER", os.path.join(".cache", "runtime.json"))
+# Threads intra-op et inter-op de torch (0 : défaut de torch, ou un par cœur de IA_COEURS)
+THREADS_INTRA = os.environ.get("IA_THREADS_INTRA")
+THREADS_INTER = os.environ.get("IA_THREADS_INTER")
+# Cœurs autorisés au processus, ex. « 0-3 » ou « 0,2,4 » ; vide : tous
+COEURS = os.environ.get("IA_COEURS")
+# "systeme", "jemalloc" ou "tcmalloc" (préchargé par `python -m ia.runtime lancer -- …`)
+ALLOCATEUR = os.environ.get("IA_ALLOCATEUR")
+# Arènes malloc de la glibc (0 : défaut) ; moins d'arènes, moins de RSS avec beaucoup de fils
+MALLOC_ARENES = os.environ.get("IA_MALLOC_ARENES")
+# "inference" (torch.inference_mode autour de generate) ou "no_grad" (défaut de transformers)
+MODE_INFERENCE = os.environ.get("IA_MODE_INFERENCE")
+
+# ---------------------------
+# DÉGRADATION SOUS CHARGE (voir ia.degradation)
+# ---------------------------
+DEGRADATION = _env_bool("IA_DEGRADATION", True)
+# Objectif de latence : p95 de la durée d'une réponse texte sur la fenêtre récente
+SLO_P95_S = float(os.environ.get("IA_SLO_P95_S", "2"))
+FENETRE_LATENCE_S = float(os.environ.get("IA_FENETRE_LATENCE_S", "60"))
+# Générations en cours à partir desquelles le serveur est considéré chargé
+DEGRADATION_FILE = int(os.environ.get("IA_DEGRADATION_FILE", "4"))
+# Générations en cours à partir desquelles la latence compte aussi dans la pression
+DEGRADATION_FILE_LATENCE = int(os.environ.get("IA_DEGRADATION_FILE_LATENCE", "2"))
+# Au-delà, les nouveaux messages sont refusés avec un message explicite
+DELESTAGE_FILE = int(os.environ.get("IA_DELESTAGE_FILE", "16"))
+# Part de max_new_tokens gardée sous charge
+DEGRADATION_FACTEUR_TOKENS = float(os.environ.get("IA_DEGRADATION_FACTEUR_TOKENS", "0.5"))
+# Modèle de secours déclaré dans IA_MODELES (ex. « leger=distilgpt2@int8 ») ; vide : aucun
+DEGRADATION_MODELE = os.environ.get("IA_DEGRADATION_MODELE", "")
+# Durée de charge revenue à la normale avant de remonter d'un niveau
+DEGRADATION_RETOUR_S = float(os.environ.get("IA_DEGRADATION_RETOUR_S", "10"))
@@ -0,0 +1,84 @@
+"""Construction du contexte envoyé au modèle, sous un budget de tokens."""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+def budget(generator, budget_max: int, max_new_tokens: int) -> int:
+    """Budget de contexte qui laisse la place à `max_new_tokens` dans la fenêtre du modèle."""
+    fenetre = getattr(generator.model.config, "n_positions", None)
+    if fenetre is None:
+        return budget_max
+    return max(1, min(budget_max, fenetre - max_new_tokens))
+
+
+def tokens(tokenizer, texte: str, cache: Dict[str, List[int]]) -> List[int]:
+    """IDs de `" " + texte`, tokenisé une seule fois par message."""
+    ids = cache.get(texte)
+    if ids is None:
+        ids = tokenizer(" " + texte)["input_ids"]
+        cache[texte] = ids
+    return ids
+
+
+def construire(tokenizer, memoire: Sequence[str], prompt: str, budget_tokens: int,
+               cache: Dict[str, List[int]], debut: Optional[int] = None,
+               rappels: Sequence[int] = ()) -> Tuple[str, int, int]:
+    """Assemble les derniers messages de `memoire` et `prompt` sans dépasser `budget_tokens`.
+
+    Sans `debut`, on garde autant de messages récents que le budget le permet.
+    Avec `debut` (contexte ancré pour le cache KV), le contexte s'allonge par la
+    fin tant qu'il tient dans le budget ; sinon il est reconstruit sur la moitié
+    du budget pour ne pas être ré-ancré à chaque tour.
+
+    `rappels` : positions dans `memoire` de messages pertinents, par ordre de
+    préférence. Ceux qui ne sont pas déjà dans la fenêtre et tiennent dans ce
+    qu'elle laisse du budget (au plus la moitié) sont placés après elle, juste
+    avant `prompt`, dans l'ordre chronologique : ils changent à chaque tour et
+    ne doivent pas casser le préfixe réutilisé par le cache KV.
+
+    Renvoie `(contexte, nb_tokens, debut)`.
+    """
+    ids_prompt = tokens(tokenizer, prompt, cache)
+    if len(ids_prompt) >= budget_tokens:
+        # Message trop long à lui seul : on n'en garde que la fin
+        ids = ids_prompt[-budget_tokens:]
+        return tokenizer.decode(ids), len(ids), len(memoire)
+
+    restant = budget_tokens - len(ids_prompt)
+    tailles = [len(tokens(tokenizer, m, cache)) for m in memoire]
+
+    ancre = debut is not None
+    if ancre and sum(tailles[debut:]) <= restant:
+        total = sum(tailles[debut:])
+    else:
+        # Ré-ancrage sur la moitié du budget, ou place gardée pour les rappels
+        limite = restant // 2 if ancre or rappels else restant
+        debut, total = len(memoire), 0
+        while debut > 0 and total + tailles[debut - 1] <= limite:
+            debut -= 1
+            total += tailles[debut]
+
+    # Un message rappelé déjà présent dans la fenêtre n'est ni répété ni compté
+    place = min(restant - total, restant // 2)
+    choisis, total_rappels = [], 0
+    for position in rappels:
+        if position < debut and total_rappels + tailles[position] <= place:
+            choisis.append(position)
+            total_rappels += tailles[position]
+
+    if not ancre:
+        # Sans cache KV, le budget laissé par les rappels revient aux messages récents
+        while debut > 0:
+            precedent = debut - 1
+            if precedent in choisis:
+                choisis.remove(precedent)
+                total_rappels -= tailles[precedent]
+            elif total + total_rappels + tailles[precedent] > restant:
+                break
+            debut -= 1
+            total += tailles[debut]
+
+    choisis.sort()
+    total += total_rappels
+    contexte = "".join(" " + m for m in memoire[debut:])
+    contexte += "".join(" " + memoire[p] for p in choisis) + " " + prompt
+    return contexte, total + len(ids_prompt), debut
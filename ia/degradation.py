@@ -0,0 +1,174 @@
+"""Dégradation progressive de la génération quand le serveur est chargé.
+
+Le régulateur compare les générations en cours et le p95 récent de la durée
+des réponses texte à leurs objectifs (`IA_DEGRADATION_FILE`, `IA_SLO_P95_S`).
+La latence ne compte qu'à partir de `IA_DEGRADATION_FILE_LATENCE` générations
+en cours : des réponses lentes sans file ne sont pas de la charge. Après
+`IA_DEGRADATION_RETOUR_S` sans aucune génération, les anciennes durées sont
+oubliées. Selon cette pression, chaque nouveau message est servi :
+- niveau 0 : normalement ;
+- niveau 1 : avec `max_new_tokens` réduit et un seul candidat ;
+- niveau 2 : en plus, avec le modèle de secours (`IA_DEGRADATION_MODELE`) s'il est déclaré ;
+- niveau 3 : pas du tout (délestage), avec un message invitant à réessayer.
+
+La montée est immédiate ; la descente se fait d'un niveau par
+`IA_DEGRADATION_RETOUR_S` passées sans pression (le délestage, lui, cesse
+dès que la file est résorbée). Chaque changement de
+niveau est journalisé.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Optional, Tuple
+
+from ia import config
+
+logger = logging.getLogger(__name__)
+
+NIVEAUX = ("normal", "réduit", "secours", "délestage")
+# Pression (rapport à l'objectif) à partir de laquelle le modèle de secours est utilisé
+SEUIL_SECOURS = 1.5
+# Avec au moins IA_DEGRADATION_FILE générations en cours, p95 au-delà duquel on déleste
+SEUIL_DELESTAGE = 2.0
+
+
+@dataclass
+class Decision:
+    niveau: int = 0
+    facteur_tokens: float = 1.0
+    modele: Optional[str] = None
+
+    @property
+    def delester(self) -> bool:
+        return self.niveau >= 3
+
+    def params(self, params: dict) -> dict:
+        """Paramètres de génération à utiliser pour ce message."""
+        if self.facteur_tokens >= 1:
+            return params
+        return dict(params, max_new_tokens=max(1, int(params["max_new_tokens"] * self.facteur_tokens)))
+
+    def candidats(self, nb_candidats: int) -> int:
+        return 1 if self.niveau else nb_candidats
+
+
+class Regulateur:
+    """Choisit le niveau de dégradation d'après la charge observée ; partagé par tous les fils."""
+
+    def __init__(self, slo_p95_s: float = 2.0, file_degradation: int = 4, file_delestage: int = 16,
+                 facteur_tokens: float = 0.5, modele_secours: Optional[str] = None,
+                 retour_s: float = 10.0, fenetre_s: float = 60.0, actif: bool = True,
+                 file_latence: int = 2):
+        self.slo_p95_s = slo_p95_s
+        self.file_degradation = max(1, file_degradation)
+        self.file_delestage = file_delestage
+        self.file_latence = max(1, file_latence)
+        self.facteur_tokens = facteur_tokens
+        self.modele_secours = modele_secours or None
+        self.retour_s = retour_s
+        self.fenetre_s = fenetre_s
+        self.actif = actif
+        self.niveau = 0
+        self.en_cours = 0
+        self.delestees = 0
+        self._durees: Deque[Tuple[float, float]] = deque()
+        self._sous_pression = time.monotonic()
+        self._inactif_depuis = time.monotonic()
+        self._verrou = threading.Lock()
+
+    def p95(self) -> float:
+        with self._verrou:
+            return self._p95()
+
+    def _p95(self) -> float:
+        maintenant = time.monotonic()
+        limite = maintenant - self.fenetre_s
+        # Après une période sans génération, les durées d'avant ne disent plus rien de la charge
+        if self.en_cours == 0 and maintenant - self._inactif_depuis >= self.retour_s:
+            limite = max(limite, self._inactif_depuis)
+        while self._durees and self._durees[0][0] <= limite:
+            self._durees.popleft()
+        durees = sorted(d for _, d in self._durees)
+        if not durees:
+            return 0.0
+        return durees[min(len(durees) - 1, int(0.95 * len(durees)))]
+
+    def _cible(self, p95: float) -> int:
+        pression = self.en_cours / self.file_degradation
+        # La latence seule ne fait pas monter le niveau : il faut aussi une file
+        if self.en_cours >= self.file_latence:
+            pression = max(pression, p95 / self.slo_p95_s)
+        # Une latence élevée seule ne déleste pas : sans file, rien ne la ferait redescendre
+        if self.en_cours >= self.file_delestage or (
+            self.en_cours >= self.file_degradation and p95 >= SEUIL_DELESTAGE * self.slo_p95_s
+        ):
+            return 3
+        if pression >= SEUIL_SECOURS and self.modele_secours:
+            return 2
+        return 1 if pression >= 1 else 0
+
+    def decider(self) -> Decision:
+        if not self.actif:
+            return Decision()
+        with self._verrou:
+            maintenant = time.monotonic()
+            p95 = self._p95()
+            cible = self._cible(p95)
+            if cible >= self.niveau:
+                self._sous_pression = maintenant
+                if cible > self.niveau:
+                    self._changer(cible, p95, logging.WARNING)
+            else:
+                paliers = int((maintenant - self._sous_pression) / self.retour_s)
+                # Le délestage refuse tout : il cesse dès que la file est résorbée
+                if self.niveau >= 3:
+                    paliers = max(paliers, 1)
+                if paliers:
+                    self._sous_pression = maintenant
+                    self._changer(max(cible, self.niveau - paliers), p95, logging.INFO)
+            if self.niveau >= 3:
+                self.delestees += 1
+            return Decision(
+                niveau=self.niveau,
+                facteur_tokens=self.facteur_tokens if self.niveau else 1.0,
+                modele=self.modele_secours if self.niveau == 2 else None,
+            )
+
+    def _changer(self, niveau: int, p95: float, gravite: int):
+        logger.log(
+            gravite,
+            "Dégradation : %s → %s (%d générations en cours pour un seuil de %d, p95 %.2f s pour un objectif de %.2f s)",
+            NIVEAUX[self.niveau], NIVEAUX[niveau], self.en_cours, self.file_degradation,
+            p95, self.slo_p95_s,
+        )
+        self.niveau = niveau
+
+    def entrer(self):
+        with self._verrou:
+            self.en_cours += 1
+
+    def sortir(self, duree: Optional[float]):
+        """Fin d'une génération ; `duree` None : non comptée dans la latence (ex. tour profilé)."""
+        with self._verrou:
+            maintenant = time.monotonic()
+            self.en_cours -= 1
+            if duree is not None:
+                self._durees.append((maintenant, duree))
+            if self.en_cours == 0:
+                self._inactif_depuis = maintenant
+
+
+def regulateur_depuis_config() -> Regulateur:
+    return Regulateur(
+        config.SLO_P95_S,
+        config.DEGRADATION_FILE,
+        config.DELESTAGE_FILE,
+        config.DEGRADATION_FACTEUR_TOKENS,
+        config.DEGRADATION_MODELE,
+        config.DEGRADATION_RETOUR_S,
+        config.FENETRE_LATENCE_S,
+        config.DEGRADATION,
+        config.DEGRADATION_FILE_LATENCE,
+    )
@@ -0,0 +1,77 @@
+"""Génération d'images simulées (placeholder CPU pour la commande !image).
+
+La police, le fond et la palette sont préparés une seule fois, et les images
+encodées sont mémorisées par texte et par format dans un LRU borné.
+"""
+import io
+from functools import lru_cache
+
+from ia import config
+
+FORMATS = {"png": "PNG", "webp": "WEBP", "jpeg": "JPEG"}
+TYPES_MIME = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+@lru_cache(maxsize=1)
+def _police():
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.truetype("arial.ttf", 24)
+    except IOError:
+        return ImageFont.load_default()
+
+
+FOND = (40, 40, 65)
+ENCRE = (255, 255, 100)
+NIVEAUX = 16
+
+
+@lru_cache(maxsize=1)
+def _masque_vide():
+    from PIL import Image
+
+    return Image.new('L', (512, 512), 0)
+
+
+@lru_cache(maxsize=1)
+def _palette():
+    # Dégradé du fond vers l'encre : conserve l'anticrénelage du texte en 16 couleurs
+    palette = []
+    for i in range(NIVEAUX):
+        palette.extend(f + (e - f) * i // (NIVEAUX - 1) for f, e in zip(FOND, ENCRE))
+    return palette
+
+
+def _options(format_image: str) -> dict:
+    if format_image == "png":
+        return {"compress_level": config.IMAGE_PNG_COMPRESSION}
+    if format_image == "webp":
+        return {"quality": config.IMAGE_QUALITE, "method": 4}
+    return {"quality": config.IMAGE_QUALITE, "optimize": True}
+
+
+@lru_cache(maxsize=config.IMAGE_CACHE_TAILLE)
+def _encoder(texte: str, format_image: str) -> bytes:
+    from PIL import ImageDraw
+
+    # Le texte est dessiné en niveaux de gris puis converti en image à palette :
+    # un PNG à 16 couleurs est bien plus petit qu'un PNG RGB pour un fond uni.
+    masque = _masque_vide().copy()
+    ImageDraw.Draw(masque).text((20, 230), texte, fill=255, font=_police())
+    img = masque.point(lambda v: v * (NIVEAUX - 1) // 255)
+    img.putpalette(_palette())
+    if format_image != "png":
+        img = img.convert('RGB')
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format=FORMATS[format_image], **_options(format_image))
+    return img_bytes.getvalue()
+
+
+def generer_image(prompt_image: str, format_image: str = None):
+    format_image = (format_image or config.IMAGE_FORMAT).lower()
+    if format_image not in FORMATS:
+        raise ValueError(f"Format d'image inconnu : {format_image!r} (attendu : {', '.join(FORMATS)})")
+    texte = f"Simulation :\n{prompt_image[:90]}..."
+    # Chaque appel reçoit son propre flux : les octets en cache restent intacts
+    return io.BytesIO(_encoder(texte, format_image))
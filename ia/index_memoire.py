@@ -0,0 +1,126 @@
+"""Index vectoriel de la mémoire d'une session : TF-IDF haché et similarité cosinus.
+
+Chaque message est vectorisé une seule fois, à l'insertion : mots et bigrammes
+de mots hachés sur `dimension` composantes, TF logarithmique pondéré par
+l'IDF connu à ce moment-là, puis normalisé. Les vecteurs sont creux (une
+quinzaine de composantes par message) et rangés bout à bout dans des tableaux
+NumPy : une recherche ne vectorise que la requête et parcourt ces tableaux
+en quelques opérations vectorisées, bien sous la milliseconde pour quelques
+milliers de messages.
+"""
+import math
+import re
+import threading
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+_MOTS = re.compile(r"\w+")
+# Poids de la requête en cours, à plat sur toute la dimension (un tableau par fil)
+_local = threading.local()
+
+
+def _termes(texte: str) -> List[str]:
+    mots = _MOTS.findall(texte.lower())
+    return mots + [f"{a} {b}" for a, b in zip(mots, mots[1:])]
+
+
+class IndexMemoire:
+    """Vecteurs des messages d'une mémoire, dans le même ordre qu'elle."""
+
+    def __init__(self, dimension: int = 1 << 18, capacite: int = 256):
+        self.dimension = dimension
+        # Composantes non nulles de tous les messages, bout à bout, et numéro du message
+        self._composantes = np.zeros(capacite, dtype=np.int64)
+        self._poids = np.zeros(capacite, dtype=np.float32)
+        self._messages = np.zeros(capacite, dtype=np.int64)
+        self._fin = 0
+        # Position de la première composante de chaque message encore indexé
+        self._departs: List[int] = []
+        self._premier = 0
+        self._frequences: Dict[int, int] = {}
+        self._nb_documents = 0
+
+    def __len__(self) -> int:
+        return len(self._departs)
+
+    def _vecteur(self, texte: str, apprendre: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Composantes triées et poids TF-IDF normalisés du texte."""
+        comptes: Dict[int, int] = {}
+        for terme in _termes(texte):
+            composante = zlib.crc32(terme.encode("utf-8")) % self.dimension
+            comptes[composante] = comptes.get(composante, 0) + 1
+        if apprendre:
+            self._nb_documents += 1
+            for composante in comptes:
+                self._frequences[composante] = self._frequences.get(composante, 0) + 1
+        composantes = np.array(sorted(comptes), dtype=np.int64)
+        poids = np.array([
+            (1 + math.log(comptes[c]))
+            * (math.log((1 + self._nb_documents) / (1 + self._frequences.get(c, 0))) + 1)
+            for c in composantes.tolist()
+        ], dtype=np.float32)
+        norme = np.linalg.norm(poids)
+        return composantes, poids / norme if norme else poids
+
+    def ajouter(self, texte: str):
+        composantes, poids = self._vecteur(texte, apprendre=True)
+        if self._fin + len(composantes) > len(self._composantes):
+            self._agrandir(len(composantes))
+        fin = self._fin + len(composantes)
+        self._composantes[self._fin:fin] = composantes
+        self._poids[self._fin:fin] = poids
+        self._messages[self._fin:fin] = self._premier + len(self._departs)
+        self._departs.append(self._fin)
+        self._fin = fin
+
+    def _agrandir(self, besoin: int):
+        debut = self._departs[0] if self._departs else self._fin
+        utilise = self._fin - debut
+        capacite = len(self._composantes)
+        # Assez de place libérée en tête par les retraits : on tasse au lieu d'agrandir
+        while utilise + besoin > capacite // 2:
+            capacite *= 2
+        for nom in ("_composantes", "_poids", "_messages"):
+            tableau = getattr(self, nom)
+            nouveau = np.zeros(capacite, dtype=tableau.dtype) if capacite != len(tableau) else tableau
+            nouveau[:utilise] = tableau[debut:self._fin]
+            setattr(self, nom, nouveau)
+        self._departs = [d - debut for d in self._departs]
+        self._fin = utilise
+
+    def retirer_debut(self, nombre: int):
+        """Oublie les `nombre` plus anciens messages (l'IDF garde leur trace)."""
+        nombre = min(nombre, len(self._departs))
+        del self._departs[:nombre]
+        self._premier += nombre
+
+    def chercher(self, texte: str, k: int, seuil: float = 0.0) -> List[Tuple[int, float]]:
+        """`(position dans la mémoire, similarité)` des `k` messages les plus proches, meilleur d'abord."""
+        if not self._departs or k <= 0:
+            return []
+        composantes_requete, poids_requete = self._vecteur(texte)
+        if not len(composantes_requete):
+            return []
+        requete = getattr(_local, "requete", None)
+        if requete is None or len(requete) != self.dimension:
+            requete = _local.requete = np.zeros(self.dimension, dtype=np.float32)
+        debut = self._departs[0]
+        requete[composantes_requete] = poids_requete
+        try:
+            # Produit scalaire creux : chaque composante stockée lit son poids dans la
+            # requête, puis seules les composantes communes sont sommées par message
+            lus = requete[self._composantes[debut:self._fin]]
+            communes = np.flatnonzero(lus) + debut
+            scores = np.bincount(
+                self._messages[communes] - self._premier,
+                weights=lus[communes - debut] * self._poids[communes],
+                minlength=len(self._departs),
+            )
+        finally:
+            requete[composantes_requete] = 0
+        k = min(k, len(scores))
+        meilleurs = np.argpartition(-scores, k - 1)[:k]
+        meilleurs = meilleurs[np.argsort(-scores[meilleurs])]
+        return [(int(i), float(scores[i])) for i in meilleurs if scores[i] > seuil]
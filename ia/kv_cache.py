@@ -0,0 +1,124 @@
+"""Cache de préfixes : réutilise les `past_key_values` déjà calculés d'un tour à l'autre."""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+import torch
+
+from ia.cache_reponses import appliquer_graine
+
+logger = logging.getLogger(__name__)
+
+
+def _tronquer(past, longueur: int):
+    """Copie des `longueur` premières positions (la copie libère le tenseur d'origine)."""
+    return tuple((k[:, :, :longueur].clone(), v[:, :, :longueur].clone()) for k, v in past)
+
+
+def _taille_octets(past) -> int:
+    return sum(t.element_size() * t.nelement() for couche in past for t in couche)
+
+
+def _prefixe_commun(a: tuple, b: tuple, maximum: int) -> int:
+    """Longueur du plus long préfixe commun à `a` et `b` (au plus `maximum`), par dichotomie."""
+    n = min(len(a), len(b), maximum)
+    if a[:n] == b[:n]:
+        return n
+    # a[:bas] == b[:bas] et a[:haut] != b[:haut]
+    bas, haut = 0, n
+    while haut - bas > 1:
+        milieu = (bas + haut) // 2
+        if a[:milieu] == b[:milieu]:
+            bas = milieu
+        else:
+            haut = milieu
+    return bas
+
+
+class CacheKV:
+    """LRU de `past_key_values` indexé par préfixe d'IDs de tokens, borné en mémoire."""
+
+    def __init__(self, capacite_mo: float = 256):
+        self.capacite = int(capacite_mo * 1024 * 1024)
+        self.octets = 0
+        self.succes = 0
+        self.echecs = 0
+        self.tokens_evites = 0
+        self._entrees: "OrderedDict[Tuple[int, ...], tuple]" = OrderedDict()
+        self._tailles = {}
+        self._verrou = threading.Lock()
+
+    def __len__(self):
+        return len(self._entrees)
+
+    def chercher(self, ids: Sequence[int]) -> Tuple[int, Optional[tuple]]:
+        """Plus long préfixe en cache de `ids`, en laissant au moins un token à calculer.
+
+        Une entrée sert aussi si seul son début est commun avec `ids` (ex. même
+        historique, mais rappels de mémoire différents avant le nouveau message).
+        """
+        ids = tuple(ids)
+        meilleure, longueur = None, 0
+        with self._verrou:
+            for cle in self._entrees:
+                n = _prefixe_commun(cle, ids, len(ids) - 1)
+                if n > longueur:
+                    meilleure, longueur = cle, n
+            if meilleure is None:
+                self.echecs += 1
+                return 0, None
+            self._entrees.move_to_end(meilleure)
+            past = self._entrees[meilleure]
+            self.succes += 1
+            self.tokens_evites += longueur
+        if longueur < len(meilleure):
+            past = tuple((k[:, :, :longueur], v[:, :, :longueur]) for k, v in past)
+        return longueur, past
+
+    def ajouter(self, ids: Sequence[int], past):
+        cle = tuple(ids)
+        taille = _taille_octets(past)
+        if taille > self.capacite:
+            return
+        with self._verrou:
+            if cle in self._entrees:
+                self._entrees.move_to_end(cle)
+                return
+            self._entrees[cle] = past
+            self._tailles[cle] = taille
+            self.octets += taille
+            while self.octets > self.capacite:
+                ancienne, _ = self._entrees.popitem(last=False)
+                self.octets -= self._tailles.pop(ancienne)
+
+    def vider(self):
+        with self._verrou:
+            self._entrees.clear()
+            self._tailles.clear()
+            self.octets = 0
+
+
+def generer(model, entrees, cache: Optional[CacheKV] = None, **params):
+    """`model.generate()` pour un seul prompt, en ne calculant que les tokens absents du cache.
+
+    Renvoie les séquences générées (prompt inclus), comme `generate()`.
+    """
+    params = appliquer_graine(params)
+    if cache is None:
+        return model.generate(**entrees, **params)
+
+    input_ids = entrees["input_ids"]
+    ids = input_ids[0].tolist()
+    longueur, past = cache.chercher(ids)
+    if past is not None:
+        logger.debug("Cache KV : %d/%d tokens du contexte réutilisés", longueur, len(ids))
+        params = dict(params, past_key_values=past)
+    if "attention_mask" not in entrees:
+        entrees = dict(entrees, attention_mask=torch.ones_like(input_ids))
+
+    sortie = model.generate(**entrees, return_dict_in_generate=True, **params)
+    if sortie.past_key_values is not None:
+        # Seul le contexte est réutilisable au tour suivant, pas la réponse tirée au sort
+        cache.ajouter(ids, _tronquer(sortie.past_key_values, len(ids)))
+    return sortie.sequences
@@ -0,0 +1,148 @@
+"""Mode lot : complète un fichier JSONL de prompts et écrit les réponses au fil de l'eau.
+
+Usage : python -m ia.lot entree.jsonl sortie.jsonl [--champ prompt] [--id id]
+                         [--taille-lot 8] [--candidats N]
+
+Les prompts sont générés par lots (un `generate()` paddé à gauche par lot),
+chaque lot est écrit et synchronisé sur disque dès qu'il est prêt. Relancer la
+commande reprend là où elle s'était arrêtée : les identifiants déjà présents
+dans la sortie sont sautés.
+
+Sortie, une ligne par prompt :
+    {"id": ..., "reponse": "...", "score": -2.1, "autres_candidats": [...]}
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Iterator, List, Set, Tuple
+
+from ia import config, runtime
+
+logger = logging.getLogger(__name__)
+
+
+def lire_prompts(chemin: str, champs: List[str], champ_id: str) -> Iterator[Tuple[str, str]]:
+    """`(id, prompt)` pour chaque ligne ; plusieurs champs sont joints par un saut de ligne.
+
+    Une ligne sans prompt est sautée (et signalée) ; si aucune n'en a, le
+    champ est sans doute mal nommé et ValueError est levée.
+    """
+    nb_prompts = 0
+    with open(chemin, encoding="utf-8") as f:
+        for numero, ligne in enumerate(f, 1):
+            if not ligne.strip():
+                continue
+            donnees = json.loads(ligne)
+            prompt = "\n".join(str(donnees[c]) for c in champs if donnees.get(c))
+            if not prompt.strip():
+                logger.warning("Ligne %d sans prompt (champs %s) : sautée", numero, ", ".join(champs))
+                continue
+            nb_prompts += 1
+            yield str(donnees.get(champ_id, numero)), prompt
+    if not nb_prompts:
+        raise ValueError(f"Aucune ligne de {chemin} n'a de prompt dans les champs {', '.join(champs)}.")
+
+
+def deja_traites(chemin: str) -> Set[str]:
+    """Identifiants déjà écrits ; une dernière ligne incomplète (arrêt brutal) est retirée."""
+    if not os.path.exists(chemin):
+        return set()
+    with open(chemin, "rb+") as f:
+        contenu = f.read()
+        fin = contenu.rfind(b"\n") + 1
+        if fin < len(contenu):
+            f.truncate(fin)
+    ids = set()
+    for ligne in contenu[:fin].decode("utf-8").splitlines():
+        if ligne.strip():
+            ids.add(str(json.loads(ligne)["id"]))
+    return ids
+
+
+def _lots(elements: Iterator, taille: int) -> Iterator[list]:
+    lot = []
+    for element in elements:
+        lot.append(element)
+        if len(lot) == taille:
+            yield lot
+            lot = []
+    if lot:
+        yield lot
+
+
+def generer_lot(model, tokenizer, prompts: List[str], nb_candidats: int, budget_tokens: int,
+                **params) -> list:
+    """Candidats classés pour chaque prompt du lot, en un seul `generate()`."""
+    from ia import arret
+    from ia.cache_reponses import appliquer_graine
+    from ia.candidats import classer
+
+    entrees = tokenizer(
+        prompts, return_tensors="pt", padding=True, truncation=True, max_length=budget_tokens
+    )
+    with runtime.contexte_inference():
+        sortie = model.generate(
+            **entrees,
+            num_return_sequences=nb_candidats,
+            return_dict_in_generate=True,
+            output_logits=True,
+            pad_token_id=tokenizer.pad_token_id,
+            stopping_criteria=arret.criteres(tokenizer, entrees["input_ids"].shape[1]),
+            **appliquer_graine(params),
+        )
+    generes = sortie.sequences[:, entrees["input_ids"].shape[1]:]
+    return classer(tokenizer, generes, sortie.logits, nb_candidats, config.PENALITE_REPETITION)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Complète un fichier JSONL de prompts.")
+    parser.add_argument("entree")
+    parser.add_argument("sortie")
+    parser.add_argument("--champ", default="prompt",
+                        help="champ(s) du prompt, séparés par des virgules (ex. title,body)")
+    parser.add_argument("--id", default="id", help="champ identifiant (défaut : numéro de ligne)")
+    parser.add_argument("--taille-lot", type=int, default=config.TAILLE_MAX_BATCH)
+    parser.add_argument("--candidats", type=int, default=config.CANDIDATS)
+    args = parser.parse_args()
+    logging.basicConfig(level=config.NIVEAU_LOG)
+
+    from ia import backends, contexte
+
+    generator = backends.charger(config.BACKEND, config.NOM_MODELE, config.DOSSIER_ONNX)
+    model, tokenizer = generator.model, generator.tokenizer
+    tokenizer.padding_side = "left"
+    # Un prompt trop long garde sa fin, la plus proche de la réponse attendue
+    tokenizer.truncation_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    params = config.PARAMS_GENERATION
+    nb_candidats = args.candidats if params.get("do_sample") else 1
+    budget = contexte.budget(generator, config.BUDGET_CONTEXTE_TOKENS, params["max_new_tokens"])
+
+    faits = deja_traites(args.sortie)
+    restants = (
+        (i, p) for i, p in lire_prompts(args.entree, args.champ.split(","), args.id)
+        if i not in faits
+    )
+    if faits:
+        logger.info("Reprise : %d prompts déjà traités", len(faits))
+    debut, total = time.perf_counter(), 0
+    with open(args.sortie, "a", encoding="utf-8") as sortie:
+        for lot in _lots(restants, max(1, args.taille_lot)):
+            classes = generer_lot(model, tokenizer, [p for _, p in lot], nb_candidats, budget, **params)
+            for (ident, _), candidats in zip(lot, classes):
+                ligne = {"id": ident, "reponse": candidats[0].texte, "score": candidats[0].score}
+                if len(candidats) > 1:
+                    ligne["autres_candidats"] = [c.texte for c in candidats[1:]]
+                sortie.write(json.dumps(ligne, ensure_ascii=False) + "\n")
+            # Un lot écrit est un lot acquis, même si le processus est tué ensuite
+            sortie.flush()
+            os.fsync(sortie.fileno())
+            total += len(lot)
+            logger.info("%d prompts traités (%.2f prompts/s)", total, total / (time.perf_counter() - debut))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Magasin de modèles hors ligne : tokenizer et poids safetensors dans un dossier local.
+
+Usage : python -m ia.magasin empaqueter distilgpt2 [gpt2 …] [--dossier .cache/modeles]
+        python -m ia.magasin verifier distilgpt2 [--dossier .cache/modeles]
+
+Un modèle empaqueté est chargé sans aucune requête au Hub. Les poids sont
+projetés en mémoire (mmap) au lieu d'être copiés : le démarrage ne lit que
+les pages utilisées, et plusieurs processus servant le même modèle partagent
+les mêmes pages du cache du système. Le manifeste garde l'empreinte SHA-256
+de chaque fichier, vérifiée avant le chargement.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from typing import Dict
+
+from ia import config
+
+logger = logging.getLogger(__name__)
+
+MANIFESTE = "manifeste.json"
+VERIFICATIONS = ("complete", "taille", "aucune")
+
+
+class ErreurIntegrite(Exception):
+    """Fichier du magasin absent, tronqué ou modifié depuis l'empaquetage."""
+
+
+def chemin(nom_modele: str, dossier: str = config.MAGASIN) -> str:
+    return os.path.join(dossier, re.sub(r"[^\w.-]", "_", nom_modele))
+
+
+def disponible(nom_modele: str, dossier: str = config.MAGASIN) -> bool:
+    return os.path.isfile(os.path.join(chemin(nom_modele, dossier), MANIFESTE))
+
+
+def source(nom_modele: str, dossier: str = config.MAGASIN) -> str:
+    """Dossier du magasin si le modèle y est empaqueté, sinon le nom tel quel (Hub ou chemin)."""
+    return chemin(nom_modele, dossier) if disponible(nom_modele, dossier) else nom_modele
+
+
+def _sha256(fichier: str) -> str:
+    with open(fichier, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+# ---------------------------
+# EMPAQUETAGE
+# ---------------------------
+def empaqueter(nom_modele: str, dossier: str = config.MAGASIN) -> str:
+    """Copie tokenizer, configuration et poids (safetensors) de `nom_modele` dans le magasin."""
+    import transformers
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    cible = chemin(nom_modele, dossier)
+    temporaire = cible + ".tmp"
+    shutil.rmtree(temporaire, ignore_errors=True)
+    AutoTokenizer.from_pretrained(nom_modele).save_pretrained(temporaire)
+    AutoModelForCausalLM.from_pretrained(nom_modele).save_pretrained(
+        temporaire, safe_serialization=True
+    )
+    fichiers = {}
+    for nom in sorted(os.listdir(temporaire)):
+        fichier = os.path.join(temporaire, nom)
+        fichiers[nom] = {"sha256": _sha256(fichier), "taille": os.path.getsize(fichier)}
+    with open(os.path.join(temporaire, MANIFESTE), "w", encoding="utf-8") as f:
+        json.dump({
+            "modele": nom_modele,
+            "transformers": transformers.__version__,
+            "fichiers": fichiers,
+        }, f, indent=2)
+    # Le dossier n'apparaît qu'une fois complet : un empaquetage interrompu ne laisse rien d'utilisable
+    shutil.rmtree(cible, ignore_errors=True)
+    os.replace(temporaire, cible)
+    logger.info("%s empaqueté dans %s (%d fichiers)", nom_modele, cible, len(fichiers))
+    return cible
+
+
+def verifier(cible: str, verification: str = "complete") -> Dict[str, dict]:
+    """Contrôle les fichiers listés par le manifeste ; lève ErreurIntegrite au premier écart."""
+    if verification not in VERIFICATIONS:
+        raise ValueError(
+            f"Vérification inconnue : {verification!r} (attendu : {', '.join(VERIFICATIONS)})"
+        )
+    with open(os.path.join(cible, MANIFESTE), encoding="utf-8") as f:
+        fichiers = json.load(f)["fichiers"]
+    if verification == "aucune":
+        return fichiers
+    for nom, attendu in fichiers.items():
+        fichier = os.path.join(cible, nom)
+        if not os.path.isfile(fichier):
+            raise ErreurIntegrite(f"{fichier} est absent du magasin.")
+        if os.path.getsize(fichier) != attendu["taille"]:
+            raise ErreurIntegrite(f"{fichier} n'a pas la taille attendue ({attendu['taille']} octets).")
+        # La lecture amène aussi le fichier dans le cache du système, avant le mmap
+        if verification == "complete" and _sha256(fichier) != attendu["sha256"]:
+            raise ErreurIntegrite(f"{fichier} a été modifié depuis l'empaquetage (SHA-256 différent).")
+    return fichiers
+
+
+# ---------------------------
+# CHARGEMENT
+# ---------------------------
+def charger(nom_modele: str, dossier: str = config.MAGASIN,
+            verification: str = config.MAGASIN_VERIFICATION):
+    """`(model, tokenizer)` depuis le magasin, sans accès au Hub."""
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    cible = chemin(nom_modele, dossier)
+    debut = time.perf_counter()
+    verifier(cible, verification)
+    duree_verification = time.perf_counter() - debut
+
+    tokenizer = AutoTokenizer.from_pretrained(cible, local_files_only=True)
+    # Depuis un fichier safetensors, transformers assigne aux paramètres les
+    # tenseurs projetés en mémoire : pas de copie des poids
+    model = AutoModelForCausalLM.from_pretrained(cible, local_files_only=True, use_safetensors=True)
+    logger.info(
+        "%s chargé depuis le magasin en %.2f s (dont vérification %s %.2f s)",
+        nom_modele, time.perf_counter() - debut, verification, duree_verification,
+    )
+    return model.eval(), tokenizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Magasin de modèles hors ligne.")
+    parser.add_argument("action", choices=("empaqueter", "verifier"))
+    parser.add_argument("modeles", nargs="+", help="noms du Hub ou dossiers locaux")
+    parser.add_argument("--dossier", default=config.MAGASIN)
+    args = parser.parse_args()
+    logging.basicConfig(level=config.NIVEAU_LOG)
+
+    for nom_modele in args.modeles:
+        if args.action == "empaqueter":
+            empaqueter(nom_modele, args.dossier)
+        else:
+            debut = time.perf_counter()
+            verifier(chemin(nom_modele, args.dossier))
+            logger.info("%s intègre (%.2f s)", nom_modele, time.perf_counter() - debut)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Métriques du processus : histogrammes de latence par étape, compteurs et jauges.
+
+Exportées au format texte Prometheus sur `GET /metriques` de l'API HTTP, et
+affichées dans la barre latérale de débogage de Streamlit (`IA_DEBUG=1`).
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Bornes des histogrammes de latence, en secondes
+BORNES_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Etiquettes = Tuple[Tuple[str, str], ...]
+
+
+def _etiquettes(etiquettes: Dict[str, str]) -> Etiquettes:
+    return tuple(sorted(etiquettes.items()))
+
+
+def _echapper(valeur) -> str:
+    """Valeur d'étiquette échappée comme l'exige le format texte Prometheus."""
+    return str(valeur).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_etiquettes(etiquettes: Etiquettes) -> str:
+    if not etiquettes:
+        return ""
+    valeurs = ",".join(f'{k}="{_echapper(v)}"' for k, v in etiquettes)
+    return "{" + valeurs + "}"
+
+
+class Histogramme:
+    """Histogramme cumulatif (buckets Prometheus) et fenêtre des dernières valeurs pour les centiles."""
+
+    def __init__(self, bornes=BORNES_S, fenetre: int = 1000):
+        self.bornes = bornes
+        self.comptes = [0] * (len(bornes) + 1)
+        self.somme = 0.0
+        self.nombre = 0
+        self.recentes = deque(maxlen=fenetre)
+
+    def observer(self, valeur: float):
+        self.comptes[bisect_left(self.bornes, valeur)] += 1
+        self.somme += valeur
+        self.nombre += 1
+        self.recentes.append(valeur)
+
+    def copie(self) -> "Histogramme":
+        copie = Histogramme(self.bornes, self.recentes.maxlen)
+        copie.comptes = list(self.comptes)
+        copie.somme, copie.nombre = self.somme, self.nombre
+        copie.recentes.extend(self.recentes)
+        return copie
+
+    def centile(self, q: float) -> float:
+        valeurs = sorted(self.recentes)
+        if not valeurs:
+            return 0.0
+        return valeurs[min(len(valeurs) - 1, int(q * len(valeurs)))]
+
+
+class Metriques:
+    """Registre des métriques, partagé par tous les fils du processus."""
+
+    def __init__(self):
+        self.histogrammes: Dict[str, Dict[Etiquettes, Histogramme]] = {}
+        self.compteurs: Dict[str, Dict[Etiquettes, float]] = {}
+        self.aides: Dict[str, str] = {}
+        self._collecteurs: List[Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]] = []
+        self._verrou = threading.Lock()
+
+    def decrire(self, nom: str, aide: str):
+        self.aides[nom] = aide
+
+    def observer(self, nom: str, valeur: float, **etiquettes):
+        cle = _etiquettes(etiquettes)
+        with self._verrou:
+            serie = self.histogrammes.setdefault(nom, {})
+            if cle not in serie:
+                serie[cle] = Histogramme()
+            serie[cle].observer(valeur)
+
+    def incrementer(self, nom: str, valeur: float = 1, **etiquettes):
+        cle = _etiquettes(etiquettes)
+        with self._verrou:
+            serie = self.compteurs.setdefault(nom, {})
+            serie[cle] = serie.get(cle, 0) + valeur
+
+    def histogrammes_de(self, nom: str) -> Dict[Etiquettes, Histogramme]:
+        """Copies des histogrammes de `nom`, lisibles sans verrou pendant que les autres fils observent."""
+        with self._verrou:
+            return {cle: histo.copie() for cle, histo in self.histogrammes.get(nom, {}).items()}
+
+    @contextmanager
+    def chronometrer(self, nom: str, **etiquettes):
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observer(nom, time.perf_counter() - debut, **etiquettes)
+
+    def ajouter_collecteur(self, collecteur: Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]):
+        """`collecteur()` renvoie des jauges `(nom, etiquettes, valeur)` lues au moment de l'export."""
+        self._collecteurs.append(collecteur)
+
+    def jauges(self) -> Dict[str, Dict[Etiquettes, float]]:
+        jauges: Dict[str, Dict[Etiquettes, float]] = {}
+        for collecteur in self._collecteurs:
+            for nom, etiquettes, valeur in collecteur():
+                jauges.setdefault(nom, {})[_etiquettes(etiquettes)] = valeur
+        return jauges
+
+    def exposer(self) -> str:
+        """Toutes les métriques au format texte Prometheus 0.0.4."""
+        lignes = []
+
+        def entete(nom: str, genre: str):
+            if nom in self.aides:
+                lignes.append(f"# HELP {nom} {self.aides[nom]}")
+            lignes.append(f"# TYPE {nom} {genre}")
+
+        with self._verrou:
+            for nom, serie in sorted(self.compteurs.items()):
+                entete(nom, "counter")
+                for cle, valeur in serie.items():
+                    lignes.append(f"{nom}{_format_etiquettes(cle)} {valeur:g}")
+            for nom, serie in sorted(self.histogrammes.items()):
+                entete(nom, "histogram")
+                for cle, histo in serie.items():
+                    cumul = 0
+                    for borne, compte in zip(histo.bornes + (float("inf"),), histo.comptes):
+                        cumul += compte
+                        le = "+Inf" if borne == float("inf") else f"{borne:g}"
+                        lignes.append(f"{nom}_bucket{_format_etiquettes(cle + (('le', le),))} {cumul}")
+                    lignes.append(f"{nom}_sum{_format_etiquettes(cle)} {histo.somme:g}")
+                    lignes.append(f"{nom}_count{_format_etiquettes(cle)} {histo.nombre}")
+        for nom, serie in sorted(self.jauges().items()):
+            entete(nom, "gauge")
+            for cle, valeur in serie.items():
+                lignes.append(f"{nom}{_format_etiquettes(cle)} {valeur:g}")
+        return "\n".join(lignes) + "\n"
+
+
+METRIQUES = Metriques()
+METRIQUES.decrire("ia_etape_secondes", "Durée de chaque étape du traitement d'un message.")
+METRIQUES.decrire("ia_tokens_generes_total", "Tokens produits par le modèle.")
+METRIQUES.decrire("ia_messages_total", "Messages traités, par type de réponse.")
+METRIQUES.decrire("ia_erreurs_total", "Erreurs, par étape et type d'exception.")
+METRIQUES.decrire("ia_commandes_total", "Commandes reçues, par nom et résultat (exécutée, limitée).")
@@ -0,0 +1,668 @@
+"""Moteur de conversation indépendant de l'interface (Streamlit ou API HTTP).
+
+Il traite un message utilisateur : commande aiguillée par le routeur (voir
+ia.commandes ; `!aide` les liste), ou génération de texte avec le modèle
+choisi par la session, pris dans le registre des modèles partagé par tout le
+processus. Les générations tournent comme tâches annulables (voir ia.taches) :
+un nouveau message de la session annule la réponse précédente encore en cours.
+"""
+import functools
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, List, Optional
+
+from ia import cache_reponses, config
+from ia.chargement import ChargeurModele
+from ia.commandes import Commande, Demande, Routeur, limites_declarees
+from ia.degradation import Regulateur, regulateur_depuis_config
+from ia.images import generer_image
+from ia.metriques import METRIQUES
+from ia.registre import RegistreModeles, registre_depuis_config
+from ia.sessions import MagasinSessions, Session
+from ia.taches import Abonnement, GenerationAnnulee, GestionnaireTaches
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_MODELE_INDISPONIBLE = "Le modèle n’a pas pu être chargé."
+MESSAGE_SURCHARGE = "Le service est très sollicité : réessayez dans quelques instants."
+MESSAGE_ANNULE = "Réponse interrompue par un message plus récent."
+
+
+@dataclass
+class Reponse:
+    """Réponse à un message. Si `morceaux` est fourni, il faut le consommer :
+    `texte` n'est complet qu'une fois le flux terminé."""
+    texte: str = ""
+    # "texte", "image", "memoire", "profil", "commande", "limite", "erreur", "surcharge" ou "annule"
+    type: str = "texte"
+    info: Optional[str] = None
+    image: Optional[Any] = None
+    legende: Optional[str] = None
+    stats: Optional[Any] = None
+    depuis_cache: bool = False
+    morceaux: Optional[Iterator[str]] = None
+    # Candidats non retenus, du meilleur au moins bon (voir ia.candidats)
+    autres_candidats: List[str] = field(default_factory=list)
+    # Mesures et fichiers d'un tour profilé (voir ia.profilage)
+    profil: Optional[Any] = None
+
+    def en_dict(self) -> dict:
+        donnees = {"type": self.type, "texte": self.texte, "depuis_cache": self.depuis_cache}
+        if self.info:
+            donnees["info"] = self.info
+        if self.autres_candidats:
+            donnees["autres_candidats"] = self.autres_candidats
+        if self.stats is not None:
+            donnees["stats"] = {
+                "ttft_s": self.stats.ttft,
+                "nb_tokens": self.stats.nb_tokens,
+                "tokens_par_seconde": self.stats.tokens_par_seconde,
+            }
+            if self.stats.tokens_proposes:
+                donnees["stats"]["acceptation"] = self.stats.acceptation
+                donnees["stats"]["acceleration"] = self.stats.acceleration
+        if self.profil is not None:
+            donnees["profil"] = dict(self.profil.resume, dossier=self.profil.dossier)
+        return donnees
+
+
+class Moteur:
+    """Traite les messages de toutes les sessions, chacune avec le modèle qu'elle a choisi."""
+
+    def __init__(self, registre: RegistreModeles, cache: Optional[cache_reponses.CacheReponses] = None,
+                 sessions: Optional[MagasinSessions] = None, regulateur: Optional[Regulateur] = None,
+                 taches: Optional[GestionnaireTaches] = None, commandes: Optional[Routeur] = None):
+        self.registre = registre
+        self.cache = cache
+        self.sessions = sessions if sessions is not None else MagasinSessions()
+        self.regulateur = regulateur if regulateur is not None else Regulateur(actif=False)
+        self.taches = taches if taches is not None else GestionnaireTaches(config.GENERATIONS_SIMULTANEES)
+        # D'autres commandes peuvent être ajoutées par `moteur.commandes.enregistrer(...)`
+        self.commandes = commandes if commandes is not None else Routeur(
+            limites_declarees(config.LIMITES_COMMANDES)
+        )
+        self._enregistrer_commandes()
+
+    @property
+    def chargeur(self) -> ChargeurModele:
+        """Chargeur du modèle par défaut."""
+        return self.registre.obtenir()
+
+    def _modele(self, session: Session) -> Optional[str]:
+        # Un modèle retiré de IA_MODELES depuis la sauvegarde de la session : retour au défaut
+        if session.modele is not None and session.modele not in self.registre.modeles:
+            session.modele = None
+        return session.modele
+
+    def chargeur_pour(self, session: Session) -> ChargeurModele:
+        return self.registre.obtenir(self._modele(session))
+
+    def choisir_modele(self, session: Session, modele: Optional[str]):
+        """Change le modèle de la session ; lève ValueError si `modele` n'est pas déclaré."""
+        alias = self.registre.alias(modele) if modele else None
+        if alias == self.registre.defaut:
+            alias = None
+        if alias == session.modele:
+            return
+        session.modele = alias
+        # Les tokens mis en cache ne valent que pour le tokenizer de l'ancien modèle
+        session.tokens_messages.clear()
+        session.debut_contexte = 0
+        logger.info("Modèle de la session : %s", alias or self.registre.defaut)
+
+    def traiter(self, session: Session, prompt: str, flux: bool = False,
+                veille: Optional[Callable[[], None]] = None) -> Reponse:
+        """Réponse à `prompt`.
+
+        Sans flux, `veille()` est appelée régulièrement pendant l'attente de la
+        génération : l'interface peut y interrompre l'attente en levant une exception.
+        """
+        reponse = self._traiter(session, prompt, flux, veille)
+        METRIQUES.incrementer("ia_messages_total", type=reponse.type)
+        return reponse
+
+    def _traiter(self, session: Session, prompt: str, flux: bool,
+                 veille: Optional[Callable[[], None]] = None) -> Reponse:
+        with METRIQUES.chronometrer("ia_etape_secondes", etape="analyse"):
+            nom, argument = self.commandes.analyser(prompt)
+            commande = self.commandes.trouver(nom) if nom is not None else None
+        if commande is not None:
+            return self._commande(commande, Demande(session, argument, flux, veille))
+        # Un `!mot` qui n'est pas une commande reste du texte pour le modèle
+        return self._generation(session, prompt, flux, veille)
+
+    # ---------------------------
+    # COMMANDES (voir ia.commandes)
+    # ---------------------------
+    def _enregistrer_commandes(self):
+        enregistrer = self.commandes.enregistrer
+        enregistrer("aide", self._commande_aide, "`!aide` : cette liste")
+        enregistrer("image", self._commande_image, "`!image <description>` : image simulée")
+        enregistrer(
+            "mémoire", self._commande_memoire,
+            "`!mémoire [sujet]` : derniers sujets, ou les plus proches du sujet", alias=("memoire",),
+        )
+        enregistrer("oublier", self._commande_oublier, "`!oublier` : vide la mémoire de la session")
+        enregistrer("stats", self._commande_stats, "`!stats` : mesures de la session et du serveur")
+        enregistrer(
+            "modèle", self._commande_modele,
+            "`!modèle [alias]` : modèles disponibles, ou choix du modèle de la session", alias=("modele",),
+        )
+        enregistrer(
+            "cache", self._commande_cache,
+            "`!cache [vider]` : état du cache des réponses, ou vidage des caches",
+        )
+        enregistrer(
+            "profil", self._commande_profil,
+            "`!profil [message]` : bascule le profilage, ou profile un seul message (voir ia.profilage)",
+            rapide=False,
+        )
+
+    def _commande(self, commande: Commande, demande: Demande) -> Reponse:
+        attente = self.commandes.limiter(demande.session, commande)
+        if attente:
+            METRIQUES.incrementer("ia_commandes_total", commande=commande.nom, resultat="limitee")
+            return Reponse(
+                f"`!{commande.nom}` est limitée à {commande.limite.texte()} : "
+                f"réessayez dans {attente:.0f} s.",
+                type="limite",
+            )
+        METRIQUES.incrementer("ia_commandes_total", commande=commande.nom, resultat="executee")
+        return commande.gestionnaire(demande)
+
+    def _commande_aide(self, demande: Demande) -> Reponse:
+        return Reponse(f"Commandes disponibles :\n{self.commandes.aide()}", type="commande")
+
+    def _commande_image(self, demande: Demande) -> Reponse:
+        prompt_image = demande.argument or "Aucune description"
+        with METRIQUES.chronometrer("ia_etape_secondes", etape="image"):
+            image = generer_image(prompt_image)
+        return Reponse(
+            "Voici une image simulée (version CPU).",
+            type="image",
+            info=f"Simulation d'image pour : {prompt_image}",
+            image=image,
+            legende=f"Image simulée : {prompt_image}",
+        )
+
+    def _commande_memoire(self, demande: Demande) -> Reponse:
+        session, requete = demande.session, demande.argument
+        # !mémoire <sujet> : messages passés les plus proches du sujet
+        if requete:
+            with METRIQUES.chronometrer("ia_etape_secondes", etape="recherche_memoire"):
+                trouves = session.index.chercher(requete, 5, config.MEMOIRE_SEUIL)
+            mémoire_text = "\n".join(
+                [f"- {session.memoire[position]} ({score:.2f})" for position, score in trouves]
+            ) or "Aucun message proche."
+            return Reponse(f"Sujets proches de « {requete} » :\n{mémoire_text}", type="memoire")
+
+        mémoire_text = "\n".join(
+            [f"- {m}" for m in session.memoire[-5:]]
+        ) or "Mémoire vide."
+        if session.resume.texte():
+            mémoire_text += f"\n\n{session.resume.texte()}"
+        return Reponse(f"Derniers sujets :\n{mémoire_text}", type="memoire")
+
+    def _commande_oublier(self, demande: Demande) -> Reponse:
+        nombre = len(demande.session.memoire)
+        demande.session.oublier()
+        return Reponse(f"Mémoire vidée ({nombre} sujets oubliés).", type="commande")
+
+    def _commande_stats(self, demande: Demande) -> Reponse:
+        from ia.degradation import NIVEAUX
+
+        session = demande.session
+        lignes = [
+            f"Session : {len(session.historique)} messages, {len(session.memoire)} sujets en mémoire, "
+            f"modèle {session.modele or self.registre.defaut}."
+        ]
+        generations = [s for s in session.stats_generation if s.premier_token is not None]
+        if generations:
+            lignes.append(f"Dernière génération : {generations[-1].resume()}.")
+            debit = sum(s.tokens_par_seconde for s in generations) / len(generations)
+            lignes.append(f"Moyenne sur {len(generations)} générations : {debit:.1f} tokens/s.")
+        lignes.append(
+            f"Serveur : niveau {NIVEAUX[self.regulateur.niveau]}, "
+            f"{self.regulateur.en_cours} générations en cours, p95 {self.regulateur.p95():.2f} s, "
+            f"{len(self.sessions)} sessions en mémoire."
+        )
+        if self.cache:
+            lignes.append(f"Cache des réponses : {self.cache.succes} succès, {self.cache.echecs} échecs.")
+        return Reponse("\n".join(lignes), type="commande")
+
+    def _commande_modele(self, demande: Demande) -> Reponse:
+        session = demande.session
+        if demande.argument:
+            try:
+                self.choisir_modele(session, demande.argument)
+            except ValueError as e:
+                return Reponse(str(e), type="erreur")
+        actuel = self._modele(session) or self.registre.defaut
+        lignes = []
+        for modele in self.registre.etat():
+            ligne = f"- {modele['alias']} ({modele['modele']})"
+            if modele["charge"]:
+                ligne += f" · chargé, {modele['empreinte_mo']:.0f} Mo, {modele['en_cours']} en cours"
+            if modele["defaut"]:
+                ligne += " · par défaut"
+            if modele["alias"] == actuel:
+                ligne += " · cette session"
+            lignes.append(ligne)
+        return Reponse(
+            f"Modèle de la session : {actuel}\n" + "\n".join(lignes)
+            + f"\nBudget : {self.registre.budget_mo:.0f} Mo, {self.registre.empreinte_mo():.0f} Mo chargés.",
+            type="commande",
+        )
+
+    def _commande_cache(self, demande: Demande) -> Reponse:
+        if demande.argument.lower() == "vider":
+            if self.cache:
+                self.cache.vider()
+            # Les caches KV ne vident que des préfixes : ils se reconstruisent au message suivant
+            for chargeur in self.registre.charges().values():
+                if chargeur.cache_kv:
+                    chargeur.cache_kv.vider()
+            logger.info("Caches vidés à la demande")
+            return Reponse("Caches des réponses et KV vidés.", type="commande")
+        if not self.cache:
+            return Reponse(
+                "Cache des réponses désactivé (IA_CACHE_REPONSES=1 et IA_DECODAGE=glouton). "
+                "`!cache vider` vide les caches KV.",
+                type="commande",
+            )
+        return Reponse(
+            f"Cache des réponses : {self.cache.succes} succès, {self.cache.echecs} échecs. "
+            "`!cache vider` pour le vider.",
+            type="commande",
+        )
+
+    def _commande_profil(self, demande: Demande) -> Reponse:
+        session = demande.session
+        # `!profil <message>` ne profile que ce message
+        if demande.argument:
+            return self._generation(session, demande.argument, demande.flux, demande.veille, profiler=True)
+        session.profil = not session.profil
+        if session.profil:
+            return Reponse(
+                "Profilage activé : chaque réponse est profilée "
+                f"(fichiers dans {config.DOSSIER_PROFILS}). `!profil` pour l'arrêter.",
+                type="profil",
+            )
+        return Reponse("Profilage désactivé.", type="profil")
+
+    # ---------------------------
+    # GÉNÉRATION
+    # ---------------------------
+    def _generation(self, session: Session, prompt: str, flux: bool,
+                    veille: Optional[Callable[[], None]] = None,
+                    profiler: Optional[bool] = None) -> Reponse:
+        if profiler is None:
+            profiler = session.profil
+
+        # Réponse textuelle, dégradée si le serveur est chargé (voir ia.degradation)
+        decision = self.regulateur.decider()
+        if decision.delester:
+            return Reponse(MESSAGE_SURCHARGE, type="surcharge")
+        modele = self._modele(session)
+        if decision.modele and self.registre.alias(decision.modele) == (modele or self.registre.defaut):
+            decision.modele = None
+        # Le modèle reste chargé jusqu'à la fin de la réponse, même s'il est
+        # évincé ou rechargé entre-temps
+        chargeur = self.registre.acquerir(decision.modele or modele)
+        self.regulateur.entrer()
+        debut = time.perf_counter()
+
+        def terminer():
+            chargeur.relacher()
+            # Le surcoût des profileurs ne doit pas faire croire le serveur chargé
+            self.regulateur.sortir(None if profiler else time.perf_counter() - debut)
+
+        try:
+            chargeur.attendre()
+            if chargeur.generator is None:
+                reponse = Reponse(MESSAGE_MODELE_INDISPONIBLE, type="erreur")
+            else:
+                reponse = self._texte(chargeur, session, prompt, flux, decision, veille, profiler)
+        except BaseException:
+            terminer()
+            raise
+        if reponse.morceaux is None:
+            terminer()
+        else:
+            reponse.morceaux = _Flux(reponse.morceaux, terminer)
+        return reponse
+
+    def construire_contexte(self, session: Session, prompt: str,
+                            chargeur: Optional[ChargeurModele] = None, secours: bool = False) -> str:
+        from ia import contexte as ctx
+
+        chargeur = chargeur or self.chargeur_pour(session)
+        generator = chargeur.generator
+        # Le modèle de secours n'a pas forcément le tokenizer de la session :
+        # ses tokens ne sont pas gardés et le contexte n'est pas ancré
+        tokens_messages = {} if secours else session.tokens_messages
+        if not secours:
+            session.oublier_tokens_orphelins()
+        # Seul le nouveau message est tokenisé ici : l'historique l'est déjà
+        with METRIQUES.chronometrer("ia_etape_secondes", etape="tokenisation"):
+            ctx.tokens(generator.tokenizer, prompt, tokens_messages)
+        budget = ctx.budget(
+            generator, config.BUDGET_CONTEXTE_TOKENS, config.PARAMS_GENERATION["max_new_tokens"]
+        )
+        # Le contexte n'est ancré que si le cache KV peut en réutiliser le début
+        debut = session.debut_contexte if chargeur.cache_kv and not secours else None
+        # Anciens messages proches du nouveau, en plus des plus récents
+        rappels = [
+            position for position, _ in
+            session.index.chercher(prompt, config.MEMOIRE_RAPPELS, config.MEMOIRE_SEUIL)
+        ]
+        contexte, _, debut = ctx.construire(
+            generator.tokenizer, session.memoire, prompt, budget, tokens_messages, debut, rappels
+        )
+        if not secours:
+            session.debut_contexte = debut
+        return contexte
+
+    def _texte(self, chargeur: ChargeurModele, session: Session, prompt: str, flux: bool,
+               decision, veille: Optional[Callable[[], None]] = None, profiler: bool = False) -> Reponse:
+        from ia import arret
+        from ia.profilage import Profil
+        from ia.streaming import StatsGeneration
+
+        params = decision.params(config.PARAMS_GENERATION)
+        # En décodage glouton, les candidats seraient tous identiques
+        nb_candidats = decision.candidats(config.CANDIDATS) if params.get("do_sample") else 1
+        # Il faut tous les candidats pour choisir : pas de flux dans ce mode
+        flux = flux and nb_candidats == 1
+        # Un tour profilé est une seule génération, sans flux ni cache
+        if profiler:
+            nb_candidats, flux = 1, False
+        try:
+            with METRIQUES.chronometrer("ia_etape_secondes", etape="contexte"):
+                contexte = self.construire_contexte(
+                    session, prompt, chargeur, secours=decision.modele is not None
+                )
+            modele = f"{chargeur.nom_modele}@{chargeur.backend}"
+            signature = dict(params, candidats=nb_candidats, arret=arret.signature())
+            cle = cache_reponses.cle(contexte, modele, signature) if self.cache and not profiler else None
+            en_cache = self.cache.lire(cle) if cle is not None else None
+            if en_cache is not None:
+                session.ajouter_memoire(prompt)
+                return Reponse(en_cache, depuis_cache=True)
+
+            # Une demande identique déjà en cours (double envoi) partage son calcul
+            stats = StatsGeneration()
+            profil = Profil(config.DOSSIER_PROFILS) if profiler else None
+            if profil is not None:
+                abonnement = self.taches.soumettre(
+                    profil.dossier,
+                    functools.partial(self._profiler, profil, chargeur, contexte, stats, params),
+                    donnees=stats,
+                )
+            else:
+                abonnement = self.taches.soumettre(
+                    cache_reponses.cle(contexte, modele, dict(signature, flux=flux)),
+                    functools.partial(self._produire, chargeur, contexte, stats, params, nb_candidats, flux),
+                    donnees=stats,
+                )
+            stats = abonnement.donnees
+            self._remplacer_generation(session, abonnement)
+            if flux:
+                reponse = Reponse(stats=stats)
+                # Flux abandonné (session relancée, client parti) : la génération est annulée
+                reponse.morceaux = _Flux(
+                    self._suivre(session, prompt, cle, abonnement, reponse),
+                    functools.partial(self._oublier_generation, session, abonnement),
+                )
+                return reponse
+            try:
+                resultat = abonnement.resultat(veille)[0]
+            finally:
+                self._oublier_generation(session, abonnement)
+            if nb_candidats > 1:
+                return self._candidats(session, prompt, cle, resultat, stats, abonnement.fusionne)
+            with METRIQUES.chronometrer("ia_etape_secondes", etape="post_traitement"):
+                result = arret.nettoyer(resultat)
+            self._terminer(session, prompt, cle, result, stats, abonnement.fusionne)
+            if profil is not None:
+                return Reponse(result, stats=stats, info=profil.texte(), profil=profil)
+            return Reponse(result, stats=stats)
+        except GenerationAnnulee:
+            return Reponse(MESSAGE_ANNULE, type="annule")
+        except Exception as e:
+            logger.exception("Erreur pendant la génération")
+            METRIQUES.incrementer("ia_erreurs_total", etape="generation", exception=type(e).__name__)
+            return Reponse(f"Erreur pendant la génération : {e}", type="erreur")
+
+    def _produire(self, chargeur: ChargeurModele, contexte: str, stats, params: dict,
+                  nb_candidats: int, flux: bool, annulation: threading.Event) -> Iterator[Any]:
+        """Corps d'une tâche de génération : morceaux de texte en flux, sinon un seul résultat."""
+        from ia.candidats import generer_candidats
+        from ia.streaming import generer_en_flux
+
+        generator, serveur = chargeur.generator, chargeur.serveur
+        if nb_candidats > 1:
+            yield generer_candidats(
+                generator.model,
+                generator.tokenizer,
+                contexte,
+                nb_candidats,
+                chargeur.cache_kv,
+                stats,
+                config.PENALITE_REPETITION,
+                annulation,
+                **params,
+            )
+        elif flux and serveur:
+            yield from serveur.generer_en_flux(contexte, stats, annulation=annulation, **params)
+        elif flux:
+            yield from generer_en_flux(
+                generator, contexte, stats, chargeur.cache_kv, chargeur.assistant, annulation, **params
+            )
+        elif serveur:
+            result = serveur(contexte, num_return_sequences=1, stats=stats, annulation=annulation, **params)
+            # Le serveur renvoie exactement `contexte + suite`
+            yield result[0]["generated_text"][len(contexte):]
+        else:
+            yield self._generer(chargeur, contexte, stats, params, annulation)
+
+    @staticmethod
+    def _profiler(profil, chargeur: ChargeurModele, contexte: str, stats, params: dict,
+                  annulation: threading.Event) -> Iterator[str]:
+        """Corps d'une tâche de génération profilée (voir ia.profilage)."""
+        from ia.profilage import profiler_generation
+
+        yield profiler_generation(profil, chargeur, contexte, stats, params, annulation)
+
+    def _generer(self, chargeur: ChargeurModele, contexte: str, stats, params: dict,
+                 annulation: Optional[threading.Event] = None) -> str:
+        """Génération dans le fil appelant ; l'écho du contexte est retiré à la position du token."""
+        from ia import arret, kv_cache
+        from ia.streaming import CompteurTokens
+
+        generator, assistant = chargeur.generator, chargeur.assistant
+        tokenizer = generator.tokenizer
+        entrees = tokenizer(contexte, return_tensors="pt")
+        options = dict(
+            streamer=CompteurTokens(stats),
+            pad_token_id=tokenizer.eos_token_id,
+            stopping_criteria=arret.criteres(
+                tokenizer, entrees["input_ids"].shape[1], [annulation] if annulation is not None else ()
+            ),
+        )
+        if assistant:
+            with assistant.suivre(stats):
+                sequences = kv_cache.generer(
+                    generator.model, entrees, **options, **params, **assistant.params()
+                )
+        else:
+            sequences = kv_cache.generer(
+                generator.model, entrees, chargeur.cache_kv, **options, **params
+            )
+        stats.fin = time.perf_counter()
+        return tokenizer.decode(sequences[0, entrees["input_ids"].shape[1]:], skip_special_tokens=True)
+
+    def _candidats(self, session: Session, prompt: str, cle: Optional[str], candidats: list,
+                   stats, fusionne: bool = False) -> Reponse:
+        meilleur = candidats[0]
+        logger.info(
+            "%d candidats, retenu : score %.2f (log-prob %.2f, répétition %.0f %%)",
+            len(candidats), meilleur.score, meilleur.logprob_moyenne, meilleur.repetition * 100,
+        )
+        self._terminer(session, prompt, cle, meilleur.texte, stats, fusionne)
+        return Reponse(
+            meilleur.texte, stats=stats, autres_candidats=[c.texte for c in candidats[1:]]
+        )
+
+    def _suivre(self, session: Session, prompt: str, cle: Optional[str],
+                abonnement: Abonnement, reponse: Reponse) -> Iterator[str]:
+        from ia import arret
+
+        recus = []
+        try:
+            for morceau in arret.filtrer_flux(abonnement):
+                recus.append(morceau)
+                yield morceau
+        except GenerationAnnulee:
+            reponse.texte = MESSAGE_ANNULE
+            reponse.type = "annule"
+            return
+        except Exception as e:
+            logger.exception("Erreur pendant la génération")
+            METRIQUES.incrementer("ia_erreurs_total", etape="generation", exception=type(e).__name__)
+            reponse.texte = f"Erreur pendant la génération : {e}"
+            reponse.type = "erreur"
+            return
+        # Déjà nettoyé par filtrer_flux : on garde exactement ce qui a été affiché
+        reponse.texte = "".join(recus)
+        self._terminer(session, prompt, cle, reponse.texte, reponse.stats, abonnement.fusionne)
+
+    @staticmethod
+    def _remplacer_generation(session: Session, abonnement: Abonnement):
+        """Un nouveau message annule la réponse précédente de la session, si elle est encore en cours.
+
+        Le nouvel abonnement est pris avant de fermer l'ancien : un double envoi
+        garde ainsi la tâche commune.
+        """
+        precedente, session.generation = session.generation, abonnement
+        if precedente is not None:
+            precedente.close()
+
+    @staticmethod
+    def _oublier_generation(session: Session, abonnement: Abonnement):
+        abonnement.close()
+        if session.generation is abonnement:
+            session.generation = None
+
+    def _terminer(self, session: Session, prompt: str, cle: Optional[str], texte: str, stats,
+                  fusionne: bool = False):
+        if self.cache and cle is not None:
+            self.cache.ecrire(cle, texte)
+        session.ajouter_memoire(prompt)
+        if stats is not None:
+            session.stats_generation.append(stats)
+        # Un calcul partagé n'est compté qu'une fois, par la demande qui l'a lancé
+        if stats is not None and not fusionne:
+            METRIQUES.incrementer("ia_tokens_generes_total", stats.nb_tokens)
+            if stats.premier_token is not None:
+                # Prefill : jusqu'au premier token ; décodage : les suivants
+                METRIQUES.observer("ia_etape_secondes", stats.ttft, etape="prefill")
+                if stats.fin is not None:
+                    METRIQUES.observer(
+                        "ia_etape_secondes", stats.fin - stats.premier_token, etape="decodage"
+                    )
+
+    def jauges(self):
+        """Jauges lues à chaque export des métriques (voir ia.metriques)."""
+        if self.cache:
+            yield "ia_cache_reponses", {"resultat": "succes"}, self.cache.succes
+            yield "ia_cache_reponses", {"resultat": "echec"}, self.cache.echecs
+        for modele, chargeur in self.registre.charges().items():
+            for etape, duree in list(chargeur.durees.items()):
+                yield "ia_chargement_secondes", {"modele": modele, "etape": etape}, duree
+            yield "ia_modele_empreinte_mo", {"modele": modele}, chargeur.empreinte_mo
+            yield "ia_modele_requetes_en_cours", {"modele": modele}, chargeur.en_cours
+            if chargeur.cache_kv:
+                yield "ia_cache_kv", {"modele": modele, "resultat": "succes"}, chargeur.cache_kv.succes
+                yield "ia_cache_kv", {"modele": modele, "resultat": "echec"}, chargeur.cache_kv.echecs
+                yield "ia_cache_kv_tokens_evites", {"modele": modele}, chargeur.cache_kv.tokens_evites
+            if hasattr(chargeur.serveur, "nb_batchs"):
+                yield "ia_batchs", {"modele": modele}, chargeur.serveur.nb_batchs
+                yield "ia_requetes_batchees", {"modele": modele}, chargeur.serveur.nb_requetes
+            if hasattr(chargeur.serveur, "redemarrages"):
+                yield "ia_workers_redemarres", {"modele": modele}, chargeur.serveur.redemarrages
+        yield "ia_modeles_evictions", {}, self.registre.evictions
+        yield "ia_degradation_niveau", {}, self.regulateur.niveau
+        yield "ia_generations_en_cours", {}, self.regulateur.en_cours
+        yield "ia_latence_p95_secondes", {}, self.regulateur.p95()
+        yield "ia_requetes_delestees", {}, self.regulateur.delestees
+        yield "ia_taches_en_cours", {}, len(self.taches)
+        yield "ia_taches_fusionnees", {}, self.taches.fusionnees
+        yield "ia_taches_annulees", {}, self.taches.annulees
+        yield "ia_sessions_en_memoire", {}, len(self.sessions)
+
+
+class _Flux:
+    """Morceaux d'une réponse ; `terminer()` est appelé une fois le flux consommé,
+    fermé ou abandonné, même s'il n'a jamais été lu."""
+
+    def __init__(self, morceaux: Iterator[str], terminer: Callable[[], None]):
+        self._morceaux = morceaux
+        self._terminer = terminer
+        self._termine = False
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self._morceaux)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._termine:
+            return
+        self._termine = True
+        try:
+            if hasattr(self._morceaux, "close"):
+                self._morceaux.close()
+        finally:
+            self._terminer()
+
+    def __del__(self):
+        self.close()
+
+
+_moteur: Optional[Moteur] = None
+_verrou = threading.Lock()
+
+
+def moteur_partage() -> Moteur:
+    """Moteur unique du processus, partagé par Streamlit et l'API HTTP."""
+    global _moteur
+    with _verrou:
+        if _moteur is None:
+            cache = None
+            # Une réponse mise en cache n'est valable que si le décodage est reproductible
+            if config.CACHE_REPONSES and config.DETERMINISTE:
+                cache = cache_reponses.CacheReponses(
+                    config.CACHE_REPONSES_TAILLE,
+                    config.CACHE_REPONSES_SQLITE,
+                    config.CACHE_REPONSES_TTL_S,
+                )
+            sessions = MagasinSessions(
+                config.SESSIONS_MAX_EN_MEMOIRE,
+                config.SESSIONS_INACTIVITE_S,
+                config.SESSIONS_SQLITE,
+            )
+            registre = registre_depuis_config()
+            if config.DEGRADATION and config.DEGRADATION_MODELE:
+                # Le modèle de secours est prêt avant d'en avoir besoin, pas en pleine charge
+                registre.obtenir(config.DEGRADATION_MODELE)
+            _moteur = Moteur(registre, cache, sessions, regulateur_depuis_config())
+            METRIQUES.ajouter_collecteur(_moteur.jauges)
+        return _moteur
@@ -0,0 +1,297 @@
+"""Pool de processus de génération pour exploiter plusieurs cœurs CPU.
+
+Chaque processus est épinglé sur une tranche de cœurs avec son propre
+`torch.set_num_threads`. Les poids sont chargés une fois par le processus
+principal puis placés en mémoire partagée : les processus les reçoivent sans
+copie, K processus ne coûtent donc pas K fois la mémoire du modèle.
+
+Les requêtes passent par une file IPC par processus ; un fil de répartition
+rend les morceaux de texte à la session demandeuse et un fil de surveillance
+relance les processus morts (leurs requêtes en cours échouent). Une requête
+annulée envoie un message `annuler` sur la même file : un fil de réception du
+processus lève son drapeau, lu à chaque pas de décodage.
+"""
+import itertools
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from types import ModuleType, SimpleNamespace
+from typing import Dict, Iterator, List, Optional
+
+import torch
+import torch.multiprocessing as mp
+
+from ia.streaming import StatsGeneration
+
+logger = logging.getLogger(__name__)
+
+_FIN = object()
+# Délai entre deux vérifications du drapeau d'annulation d'une requête en attente
+_VERIFICATION_ANNULATION_S = 0.05
+
+
+def tranches_de_coeurs(nb_workers: int, coeurs_par_worker: int = 0) -> List[List[int]]:
+    """Répartit les cœurs autorisés du processus en tranches contiguës disjointes."""
+    coeurs = sorted(os.sched_getaffinity(0))
+    taille = coeurs_par_worker or max(1, len(coeurs) // nb_workers)
+    tranches = []
+    for i in range(nb_workers):
+        tranche = coeurs[i * taille:(i + 1) * taille]
+        # Plus de processus que de cœurs : on réutilise les cœurs en boucle
+        tranches.append(tranche or [coeurs[i % len(coeurs)]])
+    return tranches
+
+
+def _etat_partage(model) -> dict:
+    """Poids en mémoire partagée, sans les doublons des poids liés (refaits par `tie_weights`)."""
+    etat, vus = {}, set()
+    for nom, tenseur in model.state_dict().items():
+        if tenseur.data_ptr() in vus:
+            continue
+        vus.add(tenseur.data_ptr())
+        etat[nom] = tenseur.share_memory_()
+    return etat
+
+
+def _worker(index: int, coeurs: List[int], nom_tokenizer: str, config_modele,
+            cache_kv_mo: float, taches: "mp.Queue", resultats: "mp.Queue"):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    from ia import kv_cache, magasin, runtime
+    from ia.streaming import generer_en_flux
+
+    os.sched_setaffinity(0, coeurs)
+    torch.set_num_threads(len(coeurs))
+    # Les poids arrivent en premier message : les tenseurs partagés ne passent
+    # que par une file, pas par les arguments d'un processus `spawn`.
+    etat = taches.get()
+    tokenizer = AutoTokenizer.from_pretrained(magasin.source(nom_tokenizer))
+    model = AutoModelForCausalLM.from_config(config_modele)
+    # `assign=True` : les paramètres pointent sur la mémoire partagée, sans copie
+    model.load_state_dict(etat, strict=False, assign=True)
+    model.tie_weights()
+    model.eval()
+    # Le processus garde ses propres threads et cœurs (sa tranche) ; seul le mode d'inférence est repris
+    runtime.preparer_modele(model, runtime.reglages_depuis_config().mode_inference)
+    generator = SimpleNamespace(model=model, tokenizer=tokenizer)
+    cache = kv_cache.CacheKV(cache_kv_mo) if cache_kv_mo else None
+    # La boucle de génération est occupée pendant un generate() : un fil à part
+    # reçoit les annulations et lève le drapeau de la requête visée
+    recues: "queue.Queue" = queue.Queue()
+    annulations: Dict[int, threading.Event] = {}
+
+    def recevoir():
+        while True:
+            tache = taches.get()
+            if tache is not None and tache[0] == "annuler":
+                annulation = annulations.get(tache[1])
+                if annulation is not None:
+                    annulation.set()
+                continue
+            if tache is not None:
+                annulations[tache[0]] = threading.Event()
+            recues.put(tache)
+            if tache is None:
+                return
+
+    threading.Thread(target=recevoir, name="worker-reception", daemon=True).start()
+    resultats.put(("pret", index, None))
+
+    while True:
+        tache = recues.get()
+        if tache is None:
+            return
+        ident, contexte, params, flux = tache
+        annulation = annulations[ident]
+        try:
+            stats = StatsGeneration()
+            morceaux = []
+            for morceau in generer_en_flux(generator, contexte, stats, cache, annulation=annulation, **params):
+                morceaux.append(morceau)
+                if flux:
+                    resultats.put(("morceau", ident, morceau))
+            # Sans flux, le premier token n'est daté qu'ici : perf_counter est l'horloge
+            # monotone du système sous Linux, comparable d'un processus à l'autre
+            resultats.put(("fin", ident, ("".join(morceaux), stats.nb_tokens, stats.premier_token)))
+        except Exception as e:
+            resultats.put(("erreur", ident, repr(e)))
+        finally:
+            annulations.pop(ident, None)
+
+
+@dataclass
+class _Requete:
+    ident: int
+    contexte: str
+    stats: StatsGeneration
+    flux: Optional[queue.Queue]
+    worker: int
+    annulation: Optional[threading.Event] = None
+    annulee: bool = False
+    termine: threading.Event = field(default_factory=threading.Event)
+    texte: Optional[str] = None
+    erreur: Optional[Exception] = None
+
+
+class PoolWorkers:
+    """Même interface que `ServeurBatch`, mais la génération tourne dans K processus."""
+
+    def __init__(self, generator, nom_tokenizer: str, nb_workers: int,
+                 coeurs_par_worker: int = 0, cache_kv_mo: float = 0,
+                 intervalle_sante_s: float = 2.0):
+        self.tokenizer = generator.tokenizer
+        self._ctx = mp.get_context("spawn")
+        self._nom_tokenizer = nom_tokenizer
+        self._config_modele = generator.model.config
+        self._etat = _etat_partage(generator.model)
+        self._cache_kv_mo = cache_kv_mo
+        self._tranches = tranches_de_coeurs(nb_workers, coeurs_par_worker)
+        self._resultats = self._ctx.Queue()
+        self._taches: List = [None] * nb_workers
+        self._processus: List = [None] * nb_workers
+        self._en_cours: Dict[int, _Requete] = {}
+        self._ids = itertools.count()
+        self._verrou = threading.Lock()
+        self._actif = True
+        self.redemarrages = 0
+        for index in range(nb_workers):
+            self._demarrer(index)
+        threading.Thread(target=self._repartir, name="pool-resultats", daemon=True).start()
+        threading.Thread(
+            target=self._surveiller, args=(intervalle_sante_s,), name="pool-sante", daemon=True
+        ).start()
+
+    # ---------------------------
+    # API CLIENT
+    # ---------------------------
+    def soumettre(self, contexte: str, stats: Optional[StatsGeneration] = None,
+                  flux: bool = False, annulation: Optional[threading.Event] = None,
+                  **params) -> _Requete:
+        stats = stats or StatsGeneration()
+        with self._verrou:
+            charge = [0] * len(self._processus)
+            for req in self._en_cours.values():
+                charge[req.worker] += 1
+            worker = charge.index(min(charge))
+            ident = next(self._ids)
+            req = _Requete(ident, contexte, stats, queue.Queue() if flux else None, worker, annulation)
+            self._en_cours[ident] = req
+            self._taches[worker].put((ident, contexte, params, flux))
+        return req
+
+    def __call__(self, contexte: str, num_return_sequences: int = 1,
+                 stats: Optional[StatsGeneration] = None,
+                 annulation: Optional[threading.Event] = None, **params):
+        if num_return_sequences != 1:
+            raise ValueError("Le pool ne génère qu'une séquence par requête.")
+        req = self.soumettre(contexte, stats, annulation=annulation, **params)
+        while not req.termine.wait(_VERIFICATION_ANNULATION_S if annulation is not None else None):
+            self._verifier_annulation(req)
+        if req.erreur is not None:
+            raise req.erreur
+        return [{"generated_text": contexte + req.texte}]
+
+    def generer_en_flux(self, contexte: str, stats: Optional[StatsGeneration] = None,
+                        annulation: Optional[threading.Event] = None, **params) -> Iterator[str]:
+        req = self.soumettre(contexte, stats, flux=True, annulation=annulation, **params)
+        while True:
+            self._verifier_annulation(req)
+            try:
+                morceau = req.flux.get(timeout=_VERIFICATION_ANNULATION_S if annulation is not None else None)
+            except queue.Empty:
+                continue
+            if morceau is _FIN:
+                break
+            yield morceau
+        if req.erreur is not None:
+            raise req.erreur
+
+    def _verifier_annulation(self, req: _Requete):
+        """Transmet au processus l'annulation de `req`, une seule fois."""
+        if req.annulee or req.annulation is None or not req.annulation.is_set():
+            return
+        req.annulee = True
+        with self._verrou:
+            if req.ident in self._en_cours:
+                self._taches[req.worker].put(("annuler", req.ident))
+
+    def arreter(self):
+        self._actif = False
+        for taches in self._taches:
+            taches.put(None)
+        for proc in self._processus:
+            proc.join(timeout=5)
+
+    # ---------------------------
+    # PROCESSUS
+    # ---------------------------
+    def _demarrer(self, index: int):
+        self._taches[index] = self._ctx.Queue()
+        proc = self._ctx.Process(
+            target=_worker,
+            args=(index, self._tranches[index], self._nom_tokenizer, self._config_modele,
+                  self._cache_kv_mo, self._taches[index], self._resultats),
+            name=f"ia-worker-{index}",
+            daemon=True,
+        )
+        # Streamlit exécute le script comme `__main__` : sans ce masque, `spawn`
+        # relancerait toute l'application dans chaque processus.
+        principal = sys.modules["__main__"]
+        sys.modules["__main__"] = ModuleType("__main__")
+        try:
+            proc.start()
+        finally:
+            sys.modules["__main__"] = principal
+        self._taches[index].put(self._etat)
+        self._processus[index] = proc
+        logger.info("Processus de génération %d démarré sur les cœurs %s", index, self._tranches[index])
+
+    def _repartir(self):
+        while True:
+            genre, ident, donnees = self._resultats.get()
+            if genre == "pret":
+                continue
+            with self._verrou:
+                req = self._en_cours.get(ident)
+                if req is None:
+                    continue
+                if genre != "morceau":
+                    del self._en_cours[ident]
+            if genre == "morceau":
+                if req.stats.premier_token is None:
+                    req.stats.premier_token = time.perf_counter()
+                req.flux.put(donnees)
+            elif genre == "fin":
+                req.texte, req.stats.nb_tokens, premier_token = donnees
+                if req.stats.premier_token is None:
+                    req.stats.premier_token = premier_token
+                self._terminer(req)
+            else:
+                self._terminer(req, RuntimeError(f"Erreur du processus de génération : {donnees}"))
+
+    def _terminer(self, req: _Requete, erreur: Optional[Exception] = None):
+        req.stats.fin = time.perf_counter()
+        req.erreur = erreur
+        req.termine.set()
+        if req.flux is not None:
+            req.flux.put(_FIN)
+
+    def _surveiller(self, intervalle_s: float):
+        while self._actif:
+            time.sleep(intervalle_s)
+            for index, proc in enumerate(self._processus):
+                if proc.is_alive() or not self._actif:
+                    continue
+                logger.error("Processus de génération %d arrêté (code %s), redémarrage",
+                             index, proc.exitcode)
+                with self._verrou:
+                    perdues = [i for i, r in self._en_cours.items() if r.worker == index]
+                    requetes = [self._en_cours.pop(i) for i in perdues]
+                    self._demarrer(index)
+                    self.redemarrages += 1
+                for req in requetes:
+                    self._terminer(req, RuntimeError("Le processus de génération s'est arrêté."))
@@ -0,0 +1,294 @@
+"""Profilage d'un tour de conversation : trace torch, dump cProfile et chronologie par token.
+
+Activé pour une session par `!profil` (ou la case de la barre latérale), ou
+pour un seul message par `!profil <message>`. Le tour profilé est généré
+dans le fil de sa tâche, sans batch, flux, candidats ni cache KV, pour que
+toutes les sorties décrivent la même génération. Dans `IA_DOSSIER_PROFILS/<horodatage>/` :
+- trace.json : trace du profileur torch (chrome://tracing, Perfetto) ;
+- piles.txt : piles torch agrégées par temps CPU propre (flamegraph.pl) ;
+- profil.pstats : dump cProfile (snakeviz, flameprof, gprof2dot) ;
+- chronologie.jsonl : une ligne par token — forward, processeurs de logits,
+  échantillonnage (température, top-k/top-p, tirage), détokenisation, critères
+  d'arrêt et reste de la boucle de `generate` ;
+- resume.json : tokenisation, prefill, moyennes par token et rendu Streamlit.
+
+Les durées sont mesurées sous les deux profileurs : cProfile ralentit surtout
+le code Python (échantillonnage, critères), beaucoup moins les forwards.
+"""
+import cProfile
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria
+from transformers.generation.streamers import BaseStreamer
+
+from ia import arret, kv_cache
+
+logger = logging.getLogger(__name__)
+
+_numeros = itertools.count(1)
+# Étapes d'un pas de décodage, dans l'ordre où `generate` les enchaîne
+ETAPES = ("forward", "processeurs", "echantillonnage", "detokenisation", "arret", "boucle")
+
+
+class Chronologie(BaseStreamer):
+    """Horodate chaque étape de chaque pas de décodage.
+
+    Crochets du modèle pour le forward, processeur de logits et critère
+    d'arrêt placés en dernier pour borner leurs étapes, et streamer pour le
+    choix du token, détokenisé comme le fait le streamer du flux (texte
+    cumulé décodé à chaque token).
+    """
+
+    def __init__(self, tokenizer, stats=None):
+        self.tokenizer = tokenizer
+        self.stats = stats
+        # Fil de la génération profilée : les crochets du modèle partagé voient aussi les autres
+        self._fil = threading.get_ident()
+        self.pas: List[dict] = []
+        self._tokens: List[int] = []
+        self._prompt_vu = False
+
+    def _marquer(self, etape: str):
+        if self.pas:
+            self.pas[-1][etape] = time.perf_counter()
+
+    # Crochets du modèle : seules les passes du fil profilé comptent
+    def _avant_forward(self, module, entrees):
+        if threading.get_ident() != self._fil:
+            return
+        maintenant = time.perf_counter()
+        if self.pas:
+            self.pas[-1]["suivant"] = maintenant
+        self.pas.append({"debut": maintenant})
+
+    def _apres_forward(self, module, entrees, sorties):
+        if threading.get_ident() == self._fil:
+            self._marquer("forward")
+
+    def accrocher(self, model) -> list:
+        """Pose les crochets sur `model` ; renvoie les poignées à retirer après la génération."""
+        if not hasattr(model, "register_forward_pre_hook"):
+            # Backend ONNX : pas de module torch à instrumenter, seuls le choix du token
+            # et la détokenisation sont horodatés
+            return []
+        return [
+            model.register_forward_pre_hook(self._avant_forward),
+            model.register_forward_hook(self._apres_forward),
+        ]
+
+    # Streamer
+    def put(self, value):
+        if not self._prompt_vu:
+            self._prompt_vu = True
+            return
+        maintenant = time.perf_counter()
+        if not self.pas or "token" in self.pas[-1]:
+            self.pas.append({"debut": maintenant})
+        pas = self.pas[-1]
+        pas["token"] = maintenant
+        if self.stats is not None:
+            if self.stats.premier_token is None:
+                self.stats.premier_token = maintenant
+            self.stats.nb_tokens += value.numel()
+        ids = value.reshape(-1).tolist()
+        self._tokens.extend(ids)
+        texte = self.tokenizer.decode(self._tokens, skip_special_tokens=True)
+        pas["detokenisation"] = time.perf_counter()
+        pas["ids"] = ids
+        pas["longueur_texte"] = len(texte)
+
+    def end(self):
+        pass
+
+    def durees(self) -> List[dict]:
+        """Durées de chaque étape de chaque pas, en millisecondes."""
+        lignes = []
+        for numero, pas in enumerate(self.pas):
+            if "token" not in pas:
+                continue
+            ligne = {"pas": numero, "ids": pas.get("ids", [])}
+            precedent = pas["debut"]
+            # Sans une étape (ex. pas de crochet en ONNX), sa durée va à la suivante
+            for etape, marque in (("forward", "forward"), ("processeurs", "processeurs"),
+                                  ("echantillonnage", "token"), ("detokenisation", "detokenisation"),
+                                  ("arret", "arret"), ("boucle", "suivant")):
+                if marque in pas:
+                    ligne[etape] = (pas[marque] - precedent) * 1000
+                    precedent = pas[marque]
+            lignes.append(ligne)
+        return lignes
+
+
+class _MarqueProcesseurs(LogitsProcessor):
+    """Dernier processeur de logits : fin des pénalités, avant température et top-k/top-p."""
+
+    def __init__(self, chronologie: Chronologie):
+        self.chronologie = chronologie
+
+    def __call__(self, input_ids, scores):
+        self.chronologie._marquer("processeurs")
+        return scores
+
+
+class _MarqueArret(StoppingCriteria):
+    """Dernier critère d'arrêt : fin du pas de décodage."""
+
+    def __init__(self, chronologie: Chronologie):
+        self.chronologie = chronologie
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.chronologie._marquer("arret")
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+
+def _moyenne(valeurs: List[float]) -> Optional[float]:
+    return sum(valeurs) / len(valeurs) if valeurs else None
+
+
+class Profil:
+    """Dossier et mesures d'un tour profilé."""
+
+    def __init__(self, racine: str):
+        self.dossier = os.path.join(
+            racine, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_numeros)}"
+        )
+        os.makedirs(self.dossier, exist_ok=True)
+        self.resume: dict = {}
+        self._verrou = threading.Lock()
+
+    def chemin(self, nom: str) -> str:
+        return os.path.join(self.dossier, nom)
+
+    def ecrire(self, trace, profileur: cProfile.Profile, chronologie: Chronologie,
+               tokenisation_s: float, generation_s: float):
+        trace.export_chrome_trace(self.chemin("trace.json"))
+        try:
+            trace.export_stacks(self.chemin("piles.txt"), "self_cpu_time_total")
+        except Exception as e:
+            logger.warning("Piles torch non exportées : %s", e)
+        profileur.dump_stats(self.chemin("profil.pstats"))
+        lignes = chronologie.durees()
+        with open(self.chemin("chronologie.jsonl"), "w", encoding="utf-8") as f:
+            for ligne in lignes:
+                f.write(json.dumps(ligne) + "\n")
+
+        # Le premier pas est le prefill ; les moyennes portent sur les pas de décodage suivants
+        decodage = lignes[1:]
+        with self._verrou:
+            self.resume.update({
+                "nb_tokens": sum(len(ligne["ids"]) for ligne in lignes),
+                "tokenisation_ms": tokenisation_s * 1000,
+                "prefill_ms": lignes[0].get("forward") if lignes else None,
+                "generation_ms": generation_s * 1000,
+                "par_token_ms": {
+                    etape: _moyenne([ligne[etape] for ligne in decodage if etape in ligne])
+                    for etape in ETAPES
+                },
+            })
+            self._sauver()
+
+    def noter_rendu(self, duree_s: float):
+        """Ajoute au résumé la durée d'affichage de la réponse par Streamlit."""
+        with self._verrou:
+            self.resume["rendu_ms"] = duree_s * 1000
+            self._sauver()
+
+    def _sauver(self):
+        with open(self.chemin("resume.json"), "w", encoding="utf-8") as f:
+            json.dump(self.resume, f, indent=2)
+
+    def texte(self) -> str:
+        """Résumé à afficher dans la conversation."""
+        resume = self.resume
+        par_token = resume.get("par_token_ms", {})
+        prefill = resume.get("prefill_ms")
+        detail = " · ".join(
+            f"{nom} {par_token[etape]:.2f}"
+            for etape, nom in (("forward", "forward"), ("processeurs", "processeurs"),
+                               ("echantillonnage", "échantillonnage top-k/top-p"),
+                               ("detokenisation", "détokenisation"), ("arret", "arrêt"),
+                               ("boucle", "boucle"))
+            if par_token.get(etape) is not None
+        )
+        return (
+            f"Profil ({resume.get('nb_tokens', 0)} tokens, "
+            f"{resume.get('generation_ms', 0):.0f} ms de génération) : "
+            f"tokenisation {resume.get('tokenisation_ms', 0):.1f} ms · "
+            f"prefill {f'{prefill:.1f} ms' if prefill is not None else '–'}"
+            + (f"\nPar token (ms) : {detail}" if detail else "")
+            + f"\nFichiers : {self.dossier}"
+        )
+
+
+def _options_trace() -> dict:
+    """Réglage privé de torch qui garde les piles Python pour export_stacks, s'il existe."""
+    config_experimentale = getattr(torch.profiler, "_ExperimentalConfig", None)
+    if config_experimentale is None:
+        return {}
+    try:
+        return {"experimental_config": config_experimentale(verbose=True)}
+    except TypeError:
+        return {}
+
+
+def profiler_generation(profil: Profil, chargeur, contexte: str, stats, params: dict,
+                        annulation: Optional[threading.Event] = None) -> str:
+    """Génère la suite de `contexte` sous profileurs et écrit les sorties dans `profil.dossier`.
+
+    À appeler dans le fil de la génération : cProfile et le profileur torch
+    n'observent que le fil qui les active, et la chronologie ignore les passes
+    des autres fils sur le modèle partagé.
+    """
+    generator = chargeur.generator
+    model, tokenizer = generator.model, generator.tokenizer
+    chronologie = Chronologie(tokenizer, stats)
+    profileur = cProfile.Profile()
+    poignees = chronologie.accrocher(model)
+    try:
+        with torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU],
+            with_stack=True,
+            # Sans ce réglage, les piles Python ne sont pas gardées pour export_stacks
+            **_options_trace(),
+        ) as trace:
+            profileur.enable()
+            try:
+                debut = time.perf_counter()
+                with torch.profiler.record_function("tokenisation"):
+                    entrees = tokenizer(contexte, return_tensors="pt")
+                tokenisation_s = time.perf_counter() - debut
+                criteres = arret.criteres(
+                    tokenizer, entrees["input_ids"].shape[1],
+                    [annulation] if annulation is not None else (),
+                )
+                criteres.append(_MarqueArret(chronologie))
+                debut = time.perf_counter()
+                with torch.profiler.record_function("generation"):
+                    # Sans cache KV : le prefill mesuré est celui de tout le contexte
+                    sequences = kv_cache.generer(
+                        model,
+                        entrees,
+                        None,
+                        streamer=chronologie,
+                        pad_token_id=tokenizer.eos_token_id,
+                        logits_processor=LogitsProcessorList([_MarqueProcesseurs(chronologie)]),
+                        stopping_criteria=criteres,
+                        **params,
+                    )
+                generation_s = time.perf_counter() - debut
+            finally:
+                profileur.disable()
+    finally:
+        for poignee in poignees:
+            poignee.remove()
+    stats.fin = time.perf_counter()
+    profil.ecrire(trace, profileur, chronologie, tokenisation_s, generation_s)
+    logger.info("Tour profilé : %s", profil.dossier)
+    return tokenizer.decode(sequences[0, entrees["input_ids"].shape[1]:], skip_special_tokens=True)
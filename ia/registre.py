@@ -0,0 +1,160 @@
+"""Registre des modèles disponibles et LRU des modèles chargés, sous un budget de RAM.
+
+Chaque session choisit son modèle parmi ceux déclarés dans `IA_MODELES`
+(noms du Hub ou dossiers locaux, éventuellement sous un alias et avec un
+backend propre : `leger=distilgpt2@int8`). Quand la
+somme des modèles chargés dépasse `IA_MODELES_BUDGET_MO`, les moins
+récemment utilisés sont retirés ; un modèle retiré termine d'abord ses
+requêtes en cours.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from ia import config
+from ia.chargement import ChargeurModele
+
+logger = logging.getLogger(__name__)
+
+
+def modeles_declares(declaration: str, defaut: str) -> Dict[str, str]:
+    """`"distilgpt2,gpt2,local=/chemin"` → `{alias: nom ou chemin}` ; le modèle par défaut en fait partie."""
+    modeles = {}
+    for entree in declaration.split(","):
+        entree = entree.strip()
+        if not entree:
+            continue
+        alias, _, nom = entree.partition("=")
+        modeles[alias.strip()] = (nom or alias).strip()
+    if defaut not in modeles and defaut not in modeles.values():
+        modeles[defaut] = defaut
+    return modeles
+
+
+class RegistreModeles:
+    """Modèles chargés à la demande, gardés en LRU tant qu'ils tiennent dans le budget."""
+
+    def __init__(self, modeles: Dict[str, str], defaut: str, budget_mo: float):
+        self.modeles = modeles
+        self.defaut = self.alias(defaut)
+        self.budget_mo = budget_mo
+        self.evictions = 0
+        self._charges: "OrderedDict[str, ChargeurModele]" = OrderedDict()
+        self._verrou = threading.Lock()
+
+    def alias(self, nom: str) -> str:
+        """Alias déclaré pour `nom` (un alias ou un nom de modèle)."""
+        if nom in self.modeles:
+            return nom
+        for alias, cible in self.modeles.items():
+            if cible == nom:
+                return alias
+        raise ValueError(f"Modèle inconnu : {nom}. Disponibles : {', '.join(self.modeles)}")
+
+    def obtenir(self, alias: Optional[str] = None) -> ChargeurModele:
+        """Chargeur du modèle (chargé en arrière-plan s'il ne l'est pas déjà)."""
+        alias = self.alias(alias or self.defaut)
+        with self._verrou:
+            return self._obtenir(alias)
+
+    def acquerir(self, alias: Optional[str] = None) -> ChargeurModele:
+        """Comme `obtenir`, en tenant le modèle jusqu'à `relacher()`."""
+        alias = self.alias(alias or self.defaut)
+        with self._verrou:
+            chargeur = self._obtenir(alias)
+            chargeur.acquerir()
+            return chargeur
+
+    def _obtenir(self, alias: str) -> ChargeurModele:
+        chargeur = self._charges.get(alias)
+        if chargeur is None:
+            logger.info("Chargement du modèle %s (%s)", alias, self.modeles[alias])
+            chargeur = self._charges[alias] = self._chargeur(alias)
+            threading.Thread(
+                target=self._apres_chargement, args=(chargeur,), name="registre", daemon=True
+            ).start()
+        self._charges.move_to_end(alias)
+        return chargeur
+
+    def _chargeur(self, alias: str) -> ChargeurModele:
+        nom, _, backend = self.modeles[alias].partition("@")
+        return ChargeurModele(nom, backend or None)
+
+    def _apres_chargement(self, chargeur: ChargeurModele):
+        chargeur.attendre()
+        with self._verrou:
+            retires = self._evincer()
+        for ancien in retires:
+            ancien.retirer()
+
+    def _evincer(self) -> List[ChargeurModele]:
+        """Sort du LRU les modèles en trop ; l'appelant les retire hors du verrou."""
+        retires = []
+        # Le plus récent reste chargé même s'il dépasse le budget à lui seul
+        while len(self._charges) > 1 and self.empreinte_mo() > self.budget_mo:
+            alias, chargeur = self._charges.popitem(last=False)
+            self.evictions += 1
+            logger.info(
+                "Modèle %s retiré (budget de %.0f Mo dépassé, %d requêtes en cours)",
+                alias, self.budget_mo, chargeur.en_cours,
+            )
+            retires.append(chargeur)
+        return retires
+
+    def empreinte_mo(self) -> float:
+        return sum(c.empreinte_mo for c in self._charges.values())
+
+    def definir_defaut(self, alias: str):
+        self.defaut = self.alias(alias)
+        logger.info("Modèle par défaut : %s", self.defaut)
+
+    def recharger(self, alias: str) -> ChargeurModele:
+        """Recharge un modèle sans interruption : l'ancien sert jusqu'à ce que le nouveau soit prêt."""
+        alias = self.alias(alias)
+        nouveau = self._chargeur(alias)
+
+        def basculer():
+            nouveau.attendre()
+            if nouveau.erreur is not None:
+                logger.error("Rechargement de %s abandonné : %s", alias, nouveau.erreur)
+                nouveau.retirer()
+                return
+            with self._verrou:
+                ancien = self._charges.pop(alias, None)
+                self._charges[alias] = nouveau
+                retires = self._evincer()
+            for chargeur in [ancien] + retires:
+                if chargeur is not None:
+                    chargeur.retirer()
+            logger.info("Modèle %s rechargé", alias)
+
+        threading.Thread(target=basculer, name="registre-rechargement", daemon=True).start()
+        return nouveau
+
+    def etat(self) -> List[dict]:
+        with self._verrou:
+            charges = dict(self._charges)
+        return [
+            {
+                "alias": alias,
+                "modele": nom,
+                "defaut": alias == self.defaut,
+                "charge": alias in charges and charges[alias].pret,
+                "empreinte_mo": charges[alias].empreinte_mo if alias in charges else 0.0,
+                "en_cours": charges[alias].en_cours if alias in charges else 0,
+            }
+            for alias, nom in self.modeles.items()
+        ]
+
+    def charges(self) -> Dict[str, ChargeurModele]:
+        with self._verrou:
+            return dict(self._charges)
+
+
+def registre_depuis_config() -> RegistreModeles:
+    return RegistreModeles(
+        modeles_declares(config.MODELES, config.NOM_MODELE),
+        config.NOM_MODELE,
+        config.MODELES_BUDGET_MO,
+    )
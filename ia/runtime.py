@@ -0,0 +1,430 @@
+"""Réglages du runtime torch : threads, affinité CPU, allocateur mémoire et mode d'inférence.
+
+Par défaut, torch lance autant de threads intra-op que l'hôte a de cœurs :
+plusieurs répliques Streamlit sur un même hôte se les disputent. Les
+réglages viennent du fichier écrit par `regler` pour l'hôte (`IA_RUNTIME_FICHIER`),
+chaque variable `IA_*` définie primant sur lui. Ils sont appliqués une fois
+par processus, au premier chargement de modèle (voir ia.chargement).
+
+Usage : python -m ia.runtime regler [--modele distilgpt2] [--sortie .cache/runtime.json]
+        python -m ia.runtime lancer -- streamlit run app.py
+
+`regler` mesure chaque combinaison dans un processus neuf (les threads
+inter-op et l'allocateur ne se changent qu'au démarrage) sur un jeu de
+prompts fixe, puis écrit la meilleure. `lancer` démarre une commande avec
+l'allocateur préchargé (LD_PRELOAD) et l'affinité choisie.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from ia import config
+
+logger = logging.getLogger(__name__)
+
+ALLOCATEURS = ("systeme", "jemalloc", "tcmalloc")
+MODES_INFERENCE = ("inference", "no_grad")
+# mallopt(M_ARENA_MAX, n) de la glibc
+_M_ARENA_MAX = -8
+
+PROMPTS_REGLAGE = (
+    "Bonjour, peux-tu m'expliquer comment fonctionne un réseau de neurones ?",
+    "Écris une fonction Python qui trie une liste de dictionnaires par date.",
+    "Quelle est la différence entre un processus et un thread ?",
+    "Résume en quelques phrases l'histoire de l'informatique.",
+    "The weather today is nice, please write a short story about it.",
+)
+
+_applique = False
+# Mode d'inférence du processus, lu par `contexte_inference()`
+_mode_inference: Optional[str] = None
+_verrou = threading.Lock()
+
+
+@dataclass
+class Reglages:
+    # 0 : valeur par défaut de torch (ou un thread par cœur autorisé)
+    threads_intra: int = 0
+    threads_inter: int = 0
+    # Cœurs autorisés au processus ; vide : inchangé
+    coeurs: List[int] = field(default_factory=list)
+    allocateur: str = "systeme"
+    # Arènes malloc de la glibc (0 : défaut de la glibc)
+    malloc_arenes: int = 0
+    mode_inference: str = "inference"
+
+    def __post_init__(self):
+        if self.allocateur not in ALLOCATEURS:
+            raise ValueError(
+                f"Allocateur inconnu : {self.allocateur!r} (attendu : {', '.join(ALLOCATEURS)})"
+            )
+        if self.mode_inference not in MODES_INFERENCE:
+            raise ValueError(
+                f"Mode d'inférence inconnu : {self.mode_inference!r} (attendu : {', '.join(MODES_INFERENCE)})"
+            )
+
+    def en_env(self) -> Dict[str, str]:
+        """Variables `IA_*` qui reproduisent ces réglages dans un autre processus."""
+        return {
+            "IA_THREADS_INTRA": str(self.threads_intra),
+            "IA_THREADS_INTER": str(self.threads_inter),
+            "IA_COEURS": ",".join(map(str, self.coeurs)),
+            "IA_ALLOCATEUR": self.allocateur,
+            "IA_MALLOC_ARENES": str(self.malloc_arenes),
+            "IA_MODE_INFERENCE": self.mode_inference,
+        }
+
+    def resume(self) -> str:
+        coeurs = lister_coeurs(self.coeurs) if self.coeurs else "tous"
+        return (
+            f"threads {self.threads_intra or 'défaut'}/{self.threads_inter or 'défaut'}, "
+            f"cœurs {coeurs}, allocateur {self.allocateur}, mode {self.mode_inference}"
+        )
+
+
+def lire_coeurs(texte: str) -> List[int]:
+    """« 0-3,6 » → [0, 1, 2, 3, 6]."""
+    coeurs = set()
+    for partie in texte.replace(" ", "").split(","):
+        if not partie:
+            continue
+        debut, _, fin = partie.partition("-")
+        coeurs.update(range(int(debut), int(fin or debut) + 1))
+    return sorted(coeurs)
+
+
+def lister_coeurs(coeurs: List[int]) -> str:
+    """[0, 1, 2, 3, 6] → « 0-3,6 »."""
+    plages, debut = [], None
+    for i, coeur in enumerate(coeurs):
+        if debut is None:
+            debut = coeur
+        if i + 1 == len(coeurs) or coeurs[i + 1] != coeur + 1:
+            plages.append(str(debut) if debut == coeur else f"{debut}-{coeur}")
+            debut = None
+    return ",".join(plages)
+
+
+def reglages_depuis_config(fichier: Optional[str] = None) -> Reglages:
+    """Réglages du fichier de l'hôte, s'il existe, avec les variables `IA_*` par-dessus."""
+    fichier = config.RUNTIME_FICHIER if fichier is None else fichier
+    valeurs = {}
+    if fichier and os.path.isfile(fichier):
+        with open(fichier, encoding="utf-8") as f:
+            valeurs = json.load(f)["reglages"]
+    if config.THREADS_INTRA is not None:
+        valeurs["threads_intra"] = int(config.THREADS_INTRA)
+    if config.THREADS_INTER is not None:
+        valeurs["threads_inter"] = int(config.THREADS_INTER)
+    if config.COEURS is not None:
+        valeurs["coeurs"] = lire_coeurs(config.COEURS)
+    if config.ALLOCATEUR is not None:
+        valeurs["allocateur"] = config.ALLOCATEUR
+    if config.MALLOC_ARENES is not None:
+        valeurs["malloc_arenes"] = int(config.MALLOC_ARENES)
+    if config.MODE_INFERENCE is not None:
+        valeurs["mode_inference"] = config.MODE_INFERENCE
+    return Reglages(**valeurs)
+
+
+# ---------------------------
+# ALLOCATEUR
+# ---------------------------
+def bibliotheque_allocateur(allocateur: str) -> Optional[str]:
+    """Bibliothèque à précharger pour `allocateur` (None : système ou introuvable)."""
+    if allocateur == "systeme":
+        return None
+    return ctypes.util.find_library(allocateur)
+
+
+def allocateur_charge() -> str:
+    """Allocateur effectivement présent dans le processus."""
+    try:
+        with open("/proc/self/maps", encoding="utf-8") as f:
+            projections = f.read()
+    except OSError:
+        return "systeme"
+    for allocateur in ALLOCATEURS[1:]:
+        if f"lib{allocateur}" in projections:
+            return allocateur
+    return "systeme"
+
+
+def _limiter_arenes(arenes: int):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"))
+        if not libc.mallopt(_M_ARENA_MAX, arenes):
+            logger.warning("mallopt(M_ARENA_MAX, %d) refusé par la libc", arenes)
+    except (OSError, AttributeError):
+        logger.warning("IA_MALLOC_ARENES ignoré : libc sans mallopt")
+
+
+# ---------------------------
+# APPLICATION
+# ---------------------------
+def _epingler(coeurs: List[int]):
+    """Restreint tous les fils du processus à `coeurs` (l'affinité Linux est par fil)."""
+    try:
+        fils = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        fils = [0]
+    for tid in fils:
+        try:
+            os.sched_setaffinity(tid, coeurs)
+        except (ProcessLookupError, PermissionError):
+            # Fil terminé entre-temps
+            pass
+
+
+def appliquer(reglages: Reglages) -> bool:
+    """Applique les réglages propres au processus ; seul le premier appel a un effet."""
+    global _applique, _mode_inference
+    with _verrou:
+        if _applique:
+            return False
+        _applique = True
+        _mode_inference = reglages.mode_inference
+    import torch
+
+    if reglages.coeurs:
+        _epingler(reglages.coeurs)
+    intra = reglages.threads_intra or len(reglages.coeurs)
+    if intra:
+        torch.set_num_threads(intra)
+    if reglages.threads_inter:
+        try:
+            torch.set_num_interop_threads(reglages.threads_inter)
+        except RuntimeError:
+            # Autorisé seulement avant le premier travail inter-op du processus
+            logger.warning("IA_THREADS_INTER ignoré : torch a déjà démarré ses threads inter-op")
+    charge = allocateur_charge()
+    if reglages.allocateur != charge:
+        logger.warning(
+            "Allocateur %s demandé mais %s chargé : lancez via `python -m ia.runtime lancer -- …`",
+            reglages.allocateur, charge,
+        )
+    if reglages.malloc_arenes and charge == "systeme":
+        _limiter_arenes(reglages.malloc_arenes)
+    logger.info(
+        "Runtime torch : %d threads intra-op, %d inter-op, cœurs %s, allocateur %s, mode %s",
+        torch.get_num_threads(), torch.get_num_interop_threads(),
+        lister_coeurs(sorted(os.sched_getaffinity(0))), charge, reglages.mode_inference,
+    )
+    return True
+
+
+def preparer_modele(model, mode_inference: str = "inference"):
+    """Fige les poids et fait tourner `generate()` sans suivi autograd."""
+    if not hasattr(model, "requires_grad_"):
+        # Modèle hors PyTorch (ONNX Runtime)
+        return model
+    import torch
+
+    model.requires_grad_(False)
+    if mode_inference == "inference" and not getattr(model.generate, "_mode_inference", False):
+        # Plus léger que le no_grad de transformers : ni compteur de version, ni suivi des vues
+        generate = torch.inference_mode()(model.generate)
+        generate._mode_inference = True
+        model.generate = generate
+    return model
+
+
+def contexte_inference():
+    """`torch.inference_mode()` ou `torch.no_grad()`, selon le mode d'inférence du processus.
+
+    Pour le code qui appelle le modèle hors de `generate()` (batch, candidats, lots).
+    """
+    global _mode_inference
+    import torch
+
+    if _mode_inference is None:
+        _mode_inference = reglages_depuis_config().mode_inference
+    return torch.inference_mode() if _mode_inference == "inference" else torch.no_grad()
+
+
+# ---------------------------
+# RÉGLAGE AUTOMATIQUE
+# ---------------------------
+def mesurer(nom_modele: str, repetitions: int, max_tokens: int) -> dict:
+    """Latence du jeu de prompts fixe avec les réglages de l'environnement (processus neuf)."""
+    from ia import backends
+
+    reglages = reglages_depuis_config()
+    appliquer(reglages)
+    generator = backends.charger(config.BACKEND, nom_modele, config.DOSSIER_ONNX)
+    model, tokenizer = preparer_modele(generator.model, reglages.mode_inference), generator.tokenizer
+    options = dict(
+        max_new_tokens=max_tokens, min_new_tokens=max_tokens, do_sample=False,
+        pad_token_id=tokenizer.eos_token_id,
+    )
+    entrees = [tokenizer(p, return_tensors="pt") for p in PROMPTS_REGLAGE]
+    model.generate(**entrees[0], **options)
+    durees = []
+    for _ in range(repetitions):
+        for e in entrees:
+            debut = time.perf_counter()
+            model.generate(**e, **options)
+            durees.append(time.perf_counter() - debut)
+    durees.sort()
+    return {
+        "mediane_s": statistics.median(durees),
+        "p95_s": durees[min(len(durees) - 1, int(0.95 * len(durees)))],
+        "tokens_par_seconde": max_tokens * len(durees) / sum(durees),
+    }
+
+
+def _paliers(nb_coeurs: int) -> List[int]:
+    paliers, n = [], 1
+    while n < nb_coeurs:
+        paliers.append(n)
+        n *= 2
+    return paliers + [nb_coeurs]
+
+
+def _essayer(reglages: Reglages, args) -> Optional[dict]:
+    env = dict(os.environ, **reglages.en_env(), IA_RUNTIME_FICHIER="")
+    bibliotheque = bibliotheque_allocateur(reglages.allocateur)
+    if bibliotheque:
+        env["LD_PRELOAD"] = bibliotheque
+    commande = [
+        sys.executable, "-m", "ia.runtime", "mesurer", "--modele", args.modele,
+        "--repetitions", str(args.repetitions), "--max-tokens", str(args.max_tokens),
+    ]
+    sortie = subprocess.run(commande, env=env, capture_output=True, text=True)
+    if sortie.returncode != 0:
+        logger.warning("Échec de la mesure (%s) :\n%s", reglages.resume(), sortie.stderr[-2000:])
+        return None
+    mesure = json.loads(sortie.stdout.strip().splitlines()[-1])
+    logger.info(
+        "%s : médiane %.3f s, p95 %.3f s, %.1f tokens/s",
+        reglages.resume(), mesure["mediane_s"], mesure["p95_s"], mesure["tokens_par_seconde"],
+    )
+    return mesure
+
+
+def _meilleur(essais: List[tuple], tolerance: float) -> tuple:
+    """Le plus rapide ; à `tolerance` près, celui qui prend le moins de threads (place aux autres répliques)."""
+    record = min(m["mediane_s"] for _, m in essais)
+    proches = [e for e in essais if e[1]["mediane_s"] <= record * (1 + tolerance)]
+    return min(proches, key=lambda e: (
+        e[0].threads_intra, e[0].threads_inter, not e[0].coeurs, e[1]["mediane_s"]
+    ))
+
+
+def regler(args) -> Reglages:
+    """Balayage par étapes : threads intra-op et épinglage, threads inter-op, allocateur, mode d'inférence."""
+    coeurs = sorted(os.sched_getaffinity(0))
+    essais = []
+    # Un seul thread inter-op pendant cette étape ; il est balayé à la suivante
+    for threads in _paliers(len(coeurs)):
+        for epingle in (False, True):
+            reglages = Reglages(threads, 1, coeurs[:threads] if epingle else [])
+            mesure = _essayer(reglages, args)
+            if mesure is not None:
+                essais.append((reglages, mesure))
+    if not essais:
+        raise RuntimeError("Aucune mesure n'a abouti : voir les erreurs ci-dessus.")
+    meilleur = _meilleur(essais, args.tolerance)
+
+    # `generate()` n'a guère de travail inter-op : on vérifie que plus d'un thread n'aide pas
+    etape = [meilleur]
+    for inter in sorted({n for n in (2, len(coeurs)) if 1 < n <= len(coeurs)}):
+        reglages = Reglages(**dict(asdict(meilleur[0]), threads_inter=inter))
+        mesure = _essayer(reglages, args)
+        if mesure is not None:
+            etape.append((reglages, mesure))
+    meilleur = _meilleur(etape, args.tolerance)
+
+    allocateurs = [a for a in ALLOCATEURS[1:] if bibliotheque_allocateur(a)]
+    logger.info("Allocateurs disponibles en plus du système : %s", ", ".join(allocateurs) or "aucun")
+    etape = [meilleur]
+    for allocateur in allocateurs:
+        reglages = Reglages(**dict(asdict(meilleur[0]), allocateur=allocateur))
+        mesure = _essayer(reglages, args)
+        if mesure is not None:
+            etape.append((reglages, mesure))
+    meilleur = min(etape, key=lambda e: e[1]["mediane_s"])
+
+    reglages = Reglages(**dict(asdict(meilleur[0]), mode_inference="no_grad"))
+    mesure = _essayer(reglages, args)
+    if mesure is not None and mesure["mediane_s"] < meilleur[1]["mediane_s"]:
+        meilleur = (reglages, mesure)
+
+    reglages, mesure = meilleur
+    os.makedirs(os.path.dirname(args.sortie) or ".", exist_ok=True)
+    with open(args.sortie, "w", encoding="utf-8") as f:
+        json.dump({
+            "hote": platform.node(),
+            "coeurs": lister_coeurs(coeurs),
+            "modele": args.modele,
+            "reglages": asdict(reglages),
+            "mesure": mesure,
+        }, f, indent=2)
+    logger.info("Meilleurs réglages (%s) écrits dans %s", reglages.resume(), args.sortie)
+    return reglages
+
+
+def lancer(commande: List[str]):
+    """Remplace le processus par `commande`, avec l'allocateur préchargé et l'affinité appliquée."""
+    reglages = reglages_depuis_config()
+    env = dict(os.environ)
+    bibliotheque = bibliotheque_allocateur(reglages.allocateur)
+    if bibliotheque:
+        env["LD_PRELOAD"] = " ".join(filter(None, [bibliotheque, env.get("LD_PRELOAD")]))
+    elif reglages.allocateur != "systeme":
+        logger.warning("Allocateur %s introuvable : allocateur système", reglages.allocateur)
+    if reglages.malloc_arenes:
+        env["MALLOC_ARENA_MAX"] = str(reglages.malloc_arenes)
+    intra = reglages.threads_intra or len(reglages.coeurs)
+    if intra:
+        # Lu par OpenMP à son démarrage, avant même torch.set_num_threads
+        env.setdefault("OMP_NUM_THREADS", str(intra))
+    if reglages.coeurs:
+        os.sched_setaffinity(0, reglages.coeurs)
+    logger.info("Lancement avec %s : %s", reglages.resume(), " ".join(commande))
+    os.execvpe(commande[0], commande, env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Réglages du runtime torch pour cet hôte.")
+    actions = parser.add_subparsers(dest="action", required=True)
+    reglage = actions.add_parser("regler", help="mesure les combinaisons et écrit la meilleure")
+    reglage.add_argument("--modele", default=config.NOM_MODELE)
+    reglage.add_argument("--sortie", default=config.RUNTIME_FICHIER or os.path.join(".cache", "runtime.json"))
+    reglage.add_argument("--repetitions", type=int, default=3)
+    reglage.add_argument("--max-tokens", type=int, default=32)
+    reglage.add_argument("--tolerance", type=float, default=0.05,
+                         help="écart de latence accepté pour prendre moins de threads")
+    mesure = actions.add_parser("mesurer", help=argparse.SUPPRESS)
+    mesure.add_argument("--modele", default=config.NOM_MODELE)
+    mesure.add_argument("--repetitions", type=int, default=3)
+    mesure.add_argument("--max-tokens", type=int, default=32)
+    lancement = actions.add_parser("lancer", help="lance une commande avec ces réglages")
+    lancement.add_argument("commande", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    logging.basicConfig(level=config.NIVEAU_LOG)
+
+    if args.action == "regler":
+        regler(args)
+    elif args.action == "mesurer":
+        print(json.dumps(mesurer(args.modele, args.repetitions, args.max_tokens)))
+    else:
+        commande = args.commande[1:] if args.commande[:1] == ["--"] else args.commande
+        if not commande:
+            parser.error("commande à lancer manquante")
+        lancer(commande)
+
+
+if __name__ == "__main__":
+    main()
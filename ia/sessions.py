@@ -0,0 +1,223 @@
+"""Sessions de conversation bornées et magasin de sessions (RAM + SQLite optionnel).
+
+Chaque session plafonne son historique et sa mémoire : les tours évincés ne
+laissent qu'un résumé (nombre de messages, derniers sujets). Le magasin garde
+en RAM les sessions actives et écrit les autres sur disque pour les restaurer
+au retour de l'utilisateur.
+"""
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+from ia import config
+from ia.index_memoire import IndexMemoire
+from ia.taches import Abonnement
+
+logger = logging.getLogger(__name__)
+
+SUJETS_RESUME = 5
+
+
+@dataclass(slots=True)
+class Tour:
+    """Message affiché dans la conversation (représentation compacte)."""
+    id: int
+    role: str
+    contenu: str
+    # Autres candidats proposés pour ce message (voir ia.candidats)
+    variantes: tuple = ()
+
+    def __post_init__(self):
+        # "user" / "assistant" : une seule chaîne partagée par tous les tours
+        self.role = sys.intern(self.role)
+        self.variantes = tuple(self.variantes)
+
+
+@dataclass
+class Resume:
+    """Ce qui reste des tours évincés."""
+    messages_archives: int = 0
+    sujets_archives: int = 0
+    derniers_sujets: List[str] = field(default_factory=list)
+
+    def texte(self) -> str:
+        if not self.messages_archives and not self.sujets_archives:
+            return ""
+        return f"{self.messages_archives} messages et {self.sujets_archives} sujets plus anciens archivés."
+
+
+@dataclass
+class Session:
+    """État conversationnel d'un utilisateur, borné en taille."""
+    memoire: List[str] = field(default_factory=list)
+    tokens_messages: Dict[str, List[int]] = field(default_factory=dict)
+    debut_contexte: int = 0
+    stats_generation: Deque = field(default_factory=lambda: deque(maxlen=50))
+    historique: List[Tour] = field(default_factory=list)
+    prochain_id: int = 0
+    resume: Resume = field(default_factory=Resume)
+    # Alias du registre (voir ia.registre) ; None : modèle par défaut
+    modele: Optional[str] = None
+    # Vecteurs de `memoire`, recalculés au chargement plutôt que sauvegardés
+    index: IndexMemoire = field(default_factory=lambda: IndexMemoire(config.MEMOIRE_DIMENSION), repr=False)
+    # Réponse en cours (voir ia.taches), annulée si un nouveau message arrive avant sa fin
+    generation: Optional[Abonnement] = field(default=None, repr=False)
+    # Réponses profilées (commande !profil, voir ia.profilage) ; non sauvegardé
+    profil: bool = False
+    # Derniers appels de chaque commande limitée (voir ia.commandes) ; non sauvegardé
+    appels_commandes: Dict[str, Deque[float]] = field(default_factory=dict, repr=False)
+    max_messages: int = config.SESSION_MAX_MESSAGES
+    max_memoire: int = config.SESSION_MAX_MEMOIRE
+
+    def ajouter_tour(self, role: str, contenu: str, variantes=()) -> Tour:
+        tour = Tour(self.prochain_id, role, contenu, variantes)
+        self.prochain_id += 1
+        self.historique.append(tour)
+        surplus = len(self.historique) - self.max_messages
+        if surplus > 0:
+            self.resume.messages_archives += surplus
+            del self.historique[:surplus]
+        return tour
+
+    def __post_init__(self):
+        for texte in self.memoire[len(self.index):]:
+            self.index.ajouter(texte)
+
+    def ajouter_memoire(self, prompt: str):
+        self.memoire.append(prompt)
+        self.index.ajouter(prompt)
+        surplus = len(self.memoire) - self.max_memoire
+        if surplus <= 0:
+            return
+        evinces = self.memoire[:surplus]
+        del self.memoire[:surplus]
+        self.index.retirer_debut(surplus)
+        self.resume.sujets_archives += surplus
+        self.resume.derniers_sujets = (self.resume.derniers_sujets + evinces)[-SUJETS_RESUME:]
+        # Les indices de la mémoire ont glissé : le contexte ancré suit
+        self.debut_contexte = max(0, self.debut_contexte - surplus)
+        restants = set(self.memoire)
+        for texte in evinces:
+            if texte not in restants:
+                self.tokens_messages.pop(texte, None)
+
+    def oublier_tokens_orphelins(self):
+        """Retire les tokens des prompts jamais entrés en mémoire (tour échoué, annulé ou refusé).
+
+        Il ne peut alors y avoir plus d'entrées que de messages en mémoire, plus le prompt en cours.
+        """
+        if len(self.tokens_messages) <= len(self.memoire):
+            return
+        restants = set(self.memoire)
+        for texte in [t for t in self.tokens_messages if t not in restants]:
+            del self.tokens_messages[texte]
+
+    def oublier(self):
+        """Vide la mémoire et son index ; l'historique affiché est gardé."""
+        self.memoire.clear()
+        self.index = IndexMemoire(self.index.dimension)
+        self.tokens_messages.clear()
+        self.debut_contexte = 0
+        self.resume.sujets_archives = 0
+        self.resume.derniers_sujets = []
+
+    def en_json(self) -> str:
+        return json.dumps({
+            "memoire": self.memoire,
+            "debut_contexte": self.debut_contexte,
+            "historique": [
+                [t.id, t.role, t.contenu] + ([list(t.variantes)] if t.variantes else [])
+                for t in self.historique
+            ],
+            "prochain_id": self.prochain_id,
+            "resume": [self.resume.messages_archives, self.resume.sujets_archives,
+                       self.resume.derniers_sujets],
+            "modele": self.modele,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def depuis_json(cls, brut: str) -> "Session":
+        donnees = json.loads(brut)
+        session = cls(
+            memoire=donnees["memoire"],
+            debut_contexte=donnees["debut_contexte"],
+            historique=[Tour(*t) for t in donnees["historique"]],
+            prochain_id=donnees["prochain_id"],
+            modele=donnees.get("modele"),
+        )
+        session.resume = Resume(*donnees["resume"])
+        return session
+
+
+class MagasinSessions:
+    """Sessions par identifiant : LRU en RAM, inactives écrites dans SQLite si configuré.
+
+    Sans SQLite, une session évincée de la RAM est perdue.
+    """
+
+    def __init__(self, max_en_memoire: int = 1000, inactivite_s: float = 3600,
+                 chemin_sqlite: Optional[str] = None):
+        self.max_en_memoire = max_en_memoire
+        self.inactivite_s = inactivite_s
+        self._actives: "OrderedDict[str, tuple]" = OrderedDict()
+        self._verrou = threading.Lock()
+        self._db = None
+        if chemin_sqlite:
+            self._db = sqlite3.connect(chemin_sqlite, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, etat TEXT NOT NULL, modifie REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._actives)
+
+    def obtenir(self, identifiant: str) -> Session:
+        with self._verrou:
+            entree = self._actives.get(identifiant)
+            if entree is not None:
+                session = entree[0]
+            else:
+                session = self._lire(identifiant) or Session()
+            self._actives[identifiant] = (session, time.monotonic())
+            self._actives.move_to_end(identifiant)
+            self._evincer()
+            return session
+
+    def sauver(self, identifiant: str, session: Session):
+        """Écrit la session sur disque (à appeler après chaque tour)."""
+        if self._db is None:
+            return
+        with self._verrou:
+            self._ecrire(identifiant, session)
+
+    def _evincer(self):
+        limite = time.monotonic() - self.inactivite_s
+        while self._actives:
+            identifiant, (session, vu) = next(iter(self._actives.items()))
+            if len(self._actives) <= self.max_en_memoire and vu >= limite:
+                break
+            del self._actives[identifiant]
+            if self._db is not None:
+                self._ecrire(identifiant, session)
+            logger.debug("Session %s déchargée de la mémoire", identifiant)
+
+    def _lire(self, identifiant: str) -> Optional[Session]:
+        if self._db is None:
+            return None
+        ligne = self._db.execute("SELECT etat FROM sessions WHERE id = ?", (identifiant,)).fetchone()
+        return Session.depuis_json(ligne[0]) if ligne else None
+
+    def _ecrire(self, identifiant: str, session: Session):
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions (id, etat, modifie) VALUES (?, ?, ?)",
+            (identifiant, session.en_json(), time.time()),
+        )
+        self._db.commit()
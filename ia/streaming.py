@@ -0,0 +1,162 @@
+"""Génération token par token via un streamer transformers exécuté en arrière-plan."""
+import logging
+import time
+from dataclasses import dataclass, field
+from threading import Event, Thread
+from typing import Iterator, Optional
+
+from transformers import TextIteratorStreamer
+from transformers.generation.streamers import BaseStreamer
+
+from ia import arret, kv_cache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StatsGeneration:
+    """Mesures d'un tour de génération."""
+    debut: float = field(default_factory=time.perf_counter)
+    premier_token: Optional[float] = None
+    fin: Optional[float] = None
+    nb_tokens: int = 0
+    # Décodage assisté (voir ia.assistant)
+    passes_principales: int = 0
+    tokens_proposes: int = 0
+    tokens_acceptes: int = 0
+    acceleration: Optional[float] = None
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """Temps jusqu'au premier token, en secondes."""
+        if self.premier_token is None:
+            return None
+        return self.premier_token - self.debut
+
+    @property
+    def tokens_par_seconde(self) -> float:
+        if self.premier_token is None or self.fin is None or self.nb_tokens < 2:
+            return 0.0
+        duree = self.fin - self.premier_token
+        # Le premier token inclut le prefill : on mesure le débit de décodage seul
+        return (self.nb_tokens - 1) / duree if duree > 0 else 0.0
+
+    @property
+    def acceptation(self) -> Optional[float]:
+        """Part des tokens proposés par le brouillon que le modèle principal a gardés."""
+        if not self.tokens_proposes:
+            return None
+        return self.tokens_acceptes / self.tokens_proposes
+
+    def resume_assistance(self) -> str:
+        acceleration = f"×{self.acceleration:.2f}" if self.acceleration is not None else "–"
+        return (
+            f"acceptation {self.acceptation or 0:.0%} "
+            f"({self.tokens_acceptes}/{self.tokens_proposes}) · accélération {acceleration}"
+        )
+
+    def resume(self) -> str:
+        ttft = f"{self.ttft:.2f} s" if self.ttft is not None else "–"
+        texte = f"Premier token : {ttft} · {self.nb_tokens} tokens · {self.tokens_par_seconde:.1f} tokens/s"
+        if self.tokens_proposes:
+            texte += " · " + self.resume_assistance()
+        return texte
+
+
+class CompteurTokens(BaseStreamer):
+    """Streamer minimal : horodate le premier token et compte les tokens, sans décoder."""
+
+    def __init__(self, stats: StatsGeneration):
+        self.stats = stats
+        self._prompt_vu = False
+
+    def put(self, value):
+        if not self._prompt_vu:
+            self._prompt_vu = True
+            return
+        if self.stats.premier_token is None:
+            self.stats.premier_token = time.perf_counter()
+        self.stats.nb_tokens += value.numel()
+
+    def end(self):
+        pass
+
+
+class _StreamerCompteur(TextIteratorStreamer):
+    """Streamer qui horodate le premier token et compte les tokens générés."""
+
+    def __init__(self, tokenizer, stats: StatsGeneration, **kwargs):
+        super().__init__(tokenizer, **kwargs)
+        self.stats = stats
+        self._prompt_vu = False
+
+    def put(self, value):
+        if not self._prompt_vu:
+            # Premier appel de generate() : ce sont les tokens du prompt
+            self._prompt_vu = True
+        else:
+            if self.stats.premier_token is None:
+                self.stats.premier_token = time.perf_counter()
+            self.stats.nb_tokens += value.numel()
+        super().put(value)
+
+
+def generer_en_flux(generator, contexte: str, stats: Optional[StatsGeneration] = None,
+                    cache_kv: Optional[kv_cache.CacheKV] = None, assistant=None,
+                    annulation: Optional[Event] = None, **params) -> Iterator[str]:
+    """Produit la suite de `contexte` morceau par morceau (sans l'écho du prompt).
+
+    Avec un `assistant` (ia.assistant), le décodage est assisté par son brouillon.
+    Le décodage s'arrête au pas suivant une fois `annulation` levé.
+    """
+    if stats is None:
+        stats = StatsGeneration()
+    tokenizer = generator.tokenizer
+    entrees = tokenizer(contexte, return_tensors="pt")
+    longueur_prompt = entrees["input_ids"].shape[1]
+    streamer = _StreamerCompteur(tokenizer, stats, skip_prompt=True, skip_special_tokens=True)
+    annulations = [annulation] if annulation is not None else []
+    erreurs = []
+
+    def _generer():
+        try:
+            if assistant is None:
+                kv_cache.generer(
+                    generator.model,
+                    entrees,
+                    cache_kv,
+                    streamer=streamer,
+                    pad_token_id=tokenizer.eos_token_id,
+                    stopping_criteria=arret.criteres(tokenizer, longueur_prompt, annulations),
+                    **params,
+                )
+                return
+            # Le cache KV du contexte n'est pas transmis au brouillon : pas de réutilisation
+            with assistant.suivre(stats):
+                kv_cache.generer(
+                    generator.model,
+                    entrees,
+                    streamer=streamer,
+                    pad_token_id=tokenizer.eos_token_id,
+                    stopping_criteria=arret.criteres(tokenizer, longueur_prompt, annulations),
+                    **params,
+                    **assistant.params(),
+                )
+        except Exception as e:
+            erreurs.append(e)
+            streamer.end()
+
+    stats.debut = time.perf_counter()
+    thread = Thread(target=_generer, daemon=True)
+    thread.start()
+    try:
+        for morceau in streamer:
+            if morceau:
+                yield morceau
+    finally:
+        thread.join()
+        stats.fin = time.perf_counter()
+
+    if erreurs:
+        raise erreurs[0]
+    logger.info("Génération : %s", stats.resume())
@@ -0,0 +1,203 @@
+"""Générations exécutées comme tâches annulables, partagées entre demandes identiques.
+
+Une génération ne tourne plus dans le fil de la session mais sur un fil du
+gestionnaire : Streamlit ou l'API ne font que lire ses morceaux. Dès que
+plus personne ne lit une tâche (session relancée, nouveau message, client
+déconnecté), son drapeau d'annulation est levé ; le critère d'arrêt
+`ia.arret.CritereAnnulation` le consulte à chaque pas de décodage.
+
+Deux demandes identiques en cours (même contexte, même modèle, mêmes
+paramètres) s'abonnent à la même tâche : un double envoi ne coûte qu'un calcul.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationAnnulee(Exception):
+    """La tâche lue a été annulée, ou l'abonnement fermé, avant la fin."""
+
+
+class Tache:
+    """Une génération en cours : morceaux produits et lecteurs abonnés."""
+
+    def __init__(self, cle: str, donnees: Any = None):
+        self.cle = cle
+        # Laissé à la disposition de l'appelant (ex. les statistiques de la génération)
+        self.donnees = donnees
+        self.annulation = threading.Event()
+        self.morceaux: List[Any] = []
+        self.terminee = False
+        self.erreur: Optional[BaseException] = None
+        self.abonnes = 0
+        self._condition = threading.Condition()
+
+    def publier(self, morceau: Any):
+        with self._condition:
+            self.morceaux.append(morceau)
+            self._condition.notify_all()
+
+    def clore(self, erreur: Optional[BaseException] = None):
+        with self._condition:
+            self.erreur = erreur
+            self.terminee = True
+            self._condition.notify_all()
+
+    def reveiller(self):
+        with self._condition:
+            self._condition.notify_all()
+
+
+class Abonnement:
+    """Lecteur d'une tâche, à itérer pour recevoir ses morceaux.
+
+    `close()` (appelé aussi quand l'abonnement est abandonné) désabonne ; la
+    tâche est annulée quand son dernier lecteur part avant la fin.
+    """
+
+    def __init__(self, tache: Tache, gestionnaire: "GestionnaireTaches", fusionne: bool):
+        self._tache = tache
+        self._gestionnaire = gestionnaire
+        self._lus = 0
+        self._fini = False
+        self.ferme = False
+        # Abonné à une tâche lancée par une autre demande identique
+        self.fusionne = fusionne
+
+    @property
+    def donnees(self) -> Any:
+        return self._tache.donnees
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        morceau = self._lire(None)
+        if morceau is _RIEN:
+            raise StopIteration
+        return morceau
+
+    def _lire(self, delai_s: Optional[float]) -> Any:
+        """Morceau suivant, `_RIEN` en fin de tâche, `_ATTENTE` si `delai_s` est écoulé."""
+        tache = self._tache
+        if self._fini:
+            return _RIEN
+        with tache._condition:
+            if not self.ferme and self._lus >= len(tache.morceaux) and not tache.terminee:
+                tache._condition.wait(delai_s)
+            if self.ferme:
+                raise GenerationAnnulee("Abonnement fermé avant la fin de la génération.")
+            if self._lus < len(tache.morceaux):
+                self._lus += 1
+                return tache.morceaux[self._lus - 1]
+            if not tache.terminee:
+                return _ATTENTE
+        self._fini = True
+        self.close()
+        if tache.erreur is not None:
+            raise tache.erreur
+        if tache.annulation.is_set():
+            raise GenerationAnnulee("Génération annulée.")
+        return _RIEN
+
+    def resultat(self, veille: Optional[Callable[[], None]] = None,
+                 intervalle_s: float = 0.1) -> List[Any]:
+        """Tous les morceaux, une fois la tâche terminée.
+
+        `veille()` est appelée toutes les `intervalle_s` pendant l'attente :
+        l'appelant peut y interrompre l'attente en levant une exception.
+        """
+        morceaux = []
+        while True:
+            morceau = self._lire(intervalle_s if veille else None)
+            if morceau is _RIEN:
+                return morceaux
+            if morceau is _ATTENTE:
+                veille()
+            else:
+                morceaux.append(morceau)
+
+    def close(self):
+        if self.ferme:
+            return
+        self.ferme = True
+        self._gestionnaire._desabonner(self._tache)
+
+    def __del__(self):
+        self.close()
+
+
+_RIEN = object()
+_ATTENTE = object()
+
+
+class GestionnaireTaches:
+    """Exécute les générations sur `nb_fils` fils et regroupe les demandes identiques en cours."""
+
+    def __init__(self, nb_fils: int = 8):
+        self._executeur = ThreadPoolExecutor(max(1, nb_fils), thread_name_prefix="generation")
+        self._en_cours: Dict[str, Tache] = {}
+        self._verrou = threading.Lock()
+        self.fusionnees = 0
+        self.annulees = 0
+
+    def __len__(self) -> int:
+        return len(self._en_cours)
+
+    def soumettre(self, cle: str, fonction: Callable[[threading.Event], Iterator[Any]],
+                  donnees: Any = None) -> Abonnement:
+        """Abonne l'appelant à la tâche `cle`, lancée avec `fonction(annulation)` si elle n'est pas en cours.
+
+        `fonction` produit les morceaux de la génération et doit s'arrêter
+        au plus vite une fois `annulation` levé.
+        """
+        with self._verrou:
+            tache = self._en_cours.get(cle)
+            fusionne = tache is not None and not tache.annulation.is_set()
+            if fusionne:
+                self.fusionnees += 1
+                logger.info("Demande identique déjà en cours : calcul partagé (%d lecteurs)", tache.abonnes + 1)
+            else:
+                tache = self._en_cours[cle] = Tache(cle, donnees)
+            tache.abonnes += 1
+        if not fusionne:
+            self._executeur.submit(self._executer, tache, fonction)
+        return Abonnement(tache, self, fusionne)
+
+    def _executer(self, tache: Tache, fonction: Callable[[threading.Event], Iterator[Any]]):
+        erreur = None
+        try:
+            # Annulée avant d'avoir trouvé un fil libre : rien à calculer
+            if not tache.annulation.is_set():
+                for morceau in fonction(tache.annulation):
+                    tache.publier(morceau)
+        except Exception as e:
+            erreur = e
+        finally:
+            with self._verrou:
+                if self._en_cours.get(tache.cle) is tache:
+                    del self._en_cours[tache.cle]
+            tache.clore(erreur)
+
+    def _desabonner(self, tache: Tache):
+        with self._verrou:
+            tache.abonnes -= 1
+            if tache.abonnes > 0 or tache.terminee or tache.annulation.is_set():
+                tache.reveiller()
+                return
+            tache.annulation.set()
+            self.annulees += 1
+            # Une nouvelle demande identique relance un calcul complet
+            if self._en_cours.get(tache.cle) is tache:
+                del self._en_cours[tache.cle]
+        logger.info("Génération annulée : plus aucun lecteur")
+        tache.reveiller()
+
+    def arreter(self):
+        with self._verrou:
+            for tache in self._en_cours.values():
+                tache.annulation.set()
+        self._executeur.shutdown(wait=True)
@@ -0,0 +1,161 @@
+"""Test de charge : N sessions de chat simultanées contre le moteur complet.
+
+Deux modes :
+- `ferme` : N sessions enchaînent chacune leurs messages (boucle fermée) ;
+- `ouvert` : les messages arrivent selon un processus de Poisson à `--debit`
+  requêtes/s, qu'ils aient ou non été servis (boucle ouverte) ; leur latence
+  court depuis l'heure d'arrivée prévue, attente de la session comprise.
+
+Les réponses de surcharge (régulateur de charge) et d'annulation sont
+comptées à part, hors latences et débit.
+
+Usage : python -m scripts.bench_charge [--mode ferme|ouvert] [--sessions 8] [--json charge.json]
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from scripts.bench_commun import choisir_modele, ecrire_rapport, percentiles, prompt_realiste
+
+
+class Mesures:
+    def __init__(self):
+        self.latences = []
+        self.ttft = []
+        self.tokens = 0
+        self.erreurs = 0
+        # Réponses immédiates sans génération : file saturée (`surcharge`) ou tour annulé
+        self.refus = {"surcharge": 0, "annule": 0}
+        self._verrou = threading.Lock()
+
+    def enregistrer(self, latence: float, ttft, nb_tokens: int, type_reponse: str):
+        with self._verrou:
+            if type_reponse == "erreur":
+                self.erreurs += 1
+                return
+            if type_reponse in self.refus:
+                # Hors latences et débit : elles reviennent vite et flatteraient les mesures
+                self.refus[type_reponse] += 1
+                return
+            self.latences.append(latence)
+            if ttft is not None:
+                self.ttft.append(ttft)
+            self.tokens += nb_tokens
+
+
+def _envoyer(moteur, session, prompt: str, mesures: Mesures, debut: Optional[float] = None):
+    """Envoie `prompt` ; latence et 1er token sont comptés depuis `debut` (arrivée prévue)."""
+    if debut is None:
+        debut = time.perf_counter()
+    premier = None
+    reponse = moteur.traiter(session, prompt, flux=True)
+    if reponse.morceaux is not None:
+        for _ in reponse.morceaux:
+            if premier is None:
+                premier = time.perf_counter() - debut
+    nb_tokens = reponse.stats.nb_tokens if reponse.stats is not None else 0
+    mesures.enregistrer(time.perf_counter() - debut, premier, nb_tokens, reponse.type)
+
+
+def boucle_fermee(moteur, sessions: int, messages: int, reflexion_s: float, rng_graine: int, mesures):
+    from ia.sessions import Session
+
+    def utilisateur(i):
+        rng = random.Random(rng_graine + i)
+        session = Session()
+        for _ in range(messages):
+            _envoyer(moteur, session, prompt_realiste(rng), mesures)
+            if reflexion_s:
+                time.sleep(rng.expovariate(1 / reflexion_s))
+
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(utilisateur, range(sessions)))
+
+
+def boucle_ouverte(moteur, sessions: int, debit: float, duree_s: float, rng_graine: int, mesures):
+    from ia.sessions import Session
+
+    rng = random.Random(rng_graine)
+    etats = [Session() for _ in range(sessions)]
+    # Une session n'envoie qu'un message à la fois
+    verrous = [threading.Lock() for _ in range(sessions)]
+
+    def requete(i, prompt, arrivee):
+        with verrous[i]:
+            _envoyer(moteur, etats[i], prompt, mesures, arrivee)
+
+    # Latences comptées depuis l'arrivée prévue : l'attente d'un fil libre ou de la session
+    # fait partie du temps de réponse (sinon omission coordonnée)
+    arrivee = time.perf_counter()
+    fin = arrivee + duree_s
+    with ThreadPoolExecutor(max_workers=max(sessions, 4) * 4) as pool:
+        while True:
+            arrivee += rng.expovariate(debit)
+            if arrivee >= fin:
+                break
+            time.sleep(max(0.0, arrivee - time.perf_counter()))
+            pool.submit(requete, rng.randrange(sessions), prompt_realiste(rng), arrivee)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modele", default="factice",
+                        help="`factice` (GPT-2 aléatoire hors ligne) ou modèle déjà en cache local")
+    parser.add_argument("--mode", choices=("ferme", "ouvert"), default="ferme")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=5, help="messages par session (mode fermé)")
+    parser.add_argument("--reflexion", type=float, default=0.0,
+                        help="temps de réflexion moyen entre deux messages, en s (mode fermé)")
+    parser.add_argument("--debit", type=float, default=4.0, help="requêtes/s (mode ouvert)")
+    parser.add_argument("--duree", type=float, default=30.0, help="durée en s (mode ouvert)")
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--json", help="fichier où écrire le rapport")
+    args = parser.parse_args()
+
+    os.environ["IA_MODELE"] = choisir_modele(args.modele)
+    from ia.moteur import moteur_partage
+
+    moteur = moteur_partage()
+    moteur.chargeur.attendre()
+    if moteur.chargeur.generator is None:
+        raise SystemExit(f"Modèle indisponible : {moteur.chargeur.erreur}")
+
+    mesures = Mesures()
+    debut = time.perf_counter()
+    if args.mode == "ferme":
+        boucle_fermee(moteur, args.sessions, args.messages, args.reflexion, args.graine, mesures)
+    else:
+        boucle_ouverte(moteur, args.sessions, args.debit, args.duree, args.graine, mesures)
+    duree = time.perf_counter() - debut
+    if moteur.chargeur.serveur is not None:
+        moteur.chargeur.serveur.arreter()
+
+    resultats = {
+        "duree_s": duree,
+        "requetes": len(mesures.latences),
+        "erreurs": mesures.erreurs,
+        "surcharges": mesures.refus["surcharge"],
+        "annulations": mesures.refus["annule"],
+        "requetes_par_s": len(mesures.latences) / duree,
+        "tokens_par_s": mesures.tokens / duree,
+        "latence_s": percentiles(mesures.latences),
+        "ttft_s": percentiles(mesures.ttft),
+    }
+    lat, ttft = resultats["latence_s"], resultats["ttft_s"]
+    print(f"{resultats['requetes']} requêtes ({mesures.erreurs} erreurs, "
+          f"{resultats['surcharges']} surcharges, {resultats['annulations']} annulations) en {duree:.1f} s : "
+          f"{resultats['requetes_par_s']:.2f} req/s, {resultats['tokens_par_s']:.1f} tokens/s")
+    if lat:
+        print(f"latence  p50 {lat['p50']:.3f} s  p95 {lat['p95']:.3f} s  p99 {lat['p99']:.3f} s")
+    if ttft:
+        print(f"1er tok. p50 {ttft['p50']:.3f} s  p95 {ttft['p95']:.3f} s  p99 {ttft['p99']:.3f} s")
+    if args.json:
+        ecrire_rapport(args.json, f"charge-{args.mode}", vars(args), resultats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Coût de l'aiguillage d'un message selon le nombre de commandes : routeur contre chaîne de `startswith`.
+
+Le routeur (voir ia.commandes) lit le nom puis le cherche dans un
+dictionnaire ; l'ancienne chaîne mettait tout le message en minuscules puis
+testait chaque préfixe l'un après l'autre. Les messages mêlent texte
+ordinaire (longueur réaliste et longue traîne) et appels de commandes tirées
+au hasard parmi celles enregistrées.
+
+Usage : python -m scripts.bench_commandes [--commandes 5,50,500,5000] [--json commandes.json]
+"""
+import argparse
+import random
+
+from scripts.bench_commun import ecrire_rapport, mesurer, percentiles, prompt_realiste
+
+
+def _messages(rng: random.Random, noms, nombre: int, part_commandes: float):
+    messages = []
+    for _ in range(nombre):
+        if rng.random() < part_commandes:
+            messages.append(f"!{rng.choice(noms)} {prompt_realiste(rng)}")
+        else:
+            messages.append(prompt_realiste(rng))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commandes", default="5,50,500,5000",
+                        help="nombres de commandes enregistrées à comparer")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--part-commandes", type=float, default=0.2)
+    parser.add_argument("--repetitions", type=int, default=20)
+    parser.add_argument("--json", help="fichier où écrire le rapport")
+    args = parser.parse_args()
+
+    from ia.commandes import Routeur
+
+    rng = random.Random(0)
+    resultats = {}
+    print(f"{'commandes':>10} {'routeur p50':>14} {'chaîne p50':>14}   (ns par message)")
+    for nombre in (int(n) for n in args.commandes.split(",")):
+        noms = [f"commande{i}" for i in range(nombre)]
+        routeur = Routeur()
+        for nom in noms:
+            routeur.enregistrer(nom, lambda demande: None, f"`!{nom}`")
+        messages = _messages(rng, noms, args.messages, args.part_commandes)
+
+        def routeur_seul():
+            for message in messages:
+                nom, _ = routeur.analyser(message)
+                if nom is not None:
+                    routeur.trouver(nom)
+
+        prefixes = [f"!{nom}" for nom in noms]
+
+        def chaine():
+            for message in messages:
+                commande = message.lower()
+                for prefixe in prefixes:
+                    if commande.startswith(prefixe):
+                        break
+
+        par_message = {}
+        for nom_mesure, fonction in (("routeur", routeur_seul), ("chaine", chaine)):
+            # La chaîne devient très lente avec beaucoup de commandes : moins de répétitions
+            repetitions = args.repetitions if nom_mesure == "routeur" or nombre <= 500 else 3
+            durees = [d / len(messages) for d in mesurer(fonction, repetitions)]
+            par_message[nom_mesure] = percentiles(durees)
+        resultats[str(nombre)] = par_message
+        print(f"{nombre:>10} {par_message['routeur']['p50'] * 1e9:>14.0f} "
+              f"{par_message['chaine']['p50'] * 1e9:>14.0f}")
+
+    if args.json:
+        ecrire_rapport(args.json, "commandes", vars(args), resultats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Outils communs aux benchmarks : modèle factice hors ligne, percentiles, RSS et rapport JSON."""
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import time
+from typing import Dict, List, Sequence
+
+DOSSIER_FACTICE = os.path.join(".cache", "gpt2-factice")
+
+MOTS = (
+    "bonjour comment écrire une fonction python qui trie liste explique réseau neurones "
+    "code génération texte image simulation mémoire modèle question réponse pourquoi "
+    "the weather today is nice please write a short story about data science machine "
+    "learning how does this work can you help me with my homework thanks"
+).split()
+
+
+def modele_factice(dossier: str = DOSSIER_FACTICE) -> str:
+    """GPT-2 à poids aléatoires (2 couches) et tokenizer octet, construits sans réseau.
+
+    Les sorties n'ont aucun sens mais les formes et le coût par token restent
+    représentatifs d'un petit GPT-2, ce qui suffit pour la CI et les comparaisons.
+    """
+    if os.path.isfile(os.path.join(dossier, "config.json")):
+        return dossier
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+    from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+
+    vocab = {c: i for i, c in enumerate(bytes_to_unicode().values())}
+    vocab["<|endoftext|>"] = len(vocab)
+    tok = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tok, bos_token="<|endoftext|>", eos_token="<|endoftext|>",
+        unk_token="<|endoftext|>",
+    )
+    torch.manual_seed(0)
+    modele = GPT2LMHeadModel(GPT2Config(
+        vocab_size=len(vocab), n_positions=1024, n_embd=128, n_layer=2, n_head=2,
+        bos_token_id=vocab["<|endoftext|>"], eos_token_id=vocab["<|endoftext|>"],
+    ))
+    os.makedirs(dossier, exist_ok=True)
+    modele.save_pretrained(dossier)
+    tokenizer.save_pretrained(dossier)
+    return dossier
+
+
+def choisir_modele(nom: str) -> str:
+    """`factice` construit le modèle de substitution ; sinon on exige le cache local."""
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    if nom == "factice":
+        return modele_factice()
+    return nom
+
+
+def prompt_realiste(rng: random.Random) -> str:
+    """Longueur en mots tirée d'une loi log-normale (médiane ~12 mots, longue traîne)."""
+    n = int(min(200, max(1, rng.lognormvariate(2.5, 0.8))))
+    return " ".join(rng.choice(MOTS) for _ in range(n))
+
+
+def percentiles(valeurs: Sequence[float]) -> Dict[str, float]:
+    if not valeurs:
+        return {}
+    triees = sorted(valeurs)
+
+    def p(q):
+        return triees[min(len(triees) - 1, int(round(q * (len(triees) - 1))))]
+
+    return {
+        "moy": statistics.mean(triees), "p50": p(0.50), "p95": p(0.95), "p99": p(0.99),
+        "min": triees[0], "max": triees[-1], "n": len(triees),
+    }
+
+
+def rss_pic_mo() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def mesurer(fonction, repetitions: int, prechauffage: int = 1) -> List[float]:
+    for _ in range(prechauffage):
+        fonction()
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        fonction()
+        durees.append(time.perf_counter() - debut)
+    return durees
+
+
+def ecrire_rapport(chemin: str, nom: str, parametres: dict, resultats: dict):
+    rapport = {
+        "benchmark": nom,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "cpu": os.cpu_count(),
+                    "plateforme": platform.platform()},
+        "parametres": parametres,
+        "resultats": resultats,
+        "rss_pic_mo": rss_pic_mo(),
+    }
+    with open(chemin, "w", encoding="utf-8") as f:
+        json.dump(rapport, f, indent=2, ensure_ascii=False)
+    print(f"Rapport écrit dans {chemin}")
@@ -0,0 +1,76 @@
+"""Micro-benchmark de `generer_image` : latence et taille selon le format, avec et sans cache.
+
+Usage : python -m scripts.bench_images [--repetitions 50] [--json images.json]
+
+La référence reproduit l'ancienne implémentation (police rechargée, image
+allouée et PNG encodé à chaque appel).
+"""
+import argparse
+import io
+import random
+
+from scripts.bench_commun import ecrire_rapport, mesurer, percentiles, prompt_realiste
+
+
+def _reference(prompt_image: str) -> bytes:
+    from PIL import Image, ImageDraw, ImageFont
+
+    img = Image.new('RGB', (512, 512), color=(40, 40, 65))
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.truetype("arial.ttf", 24)
+    except IOError:
+        font = ImageFont.load_default()
+    draw.text((20, 230), f"Simulation :\n{prompt_image[:90]}...", fill=(255, 255, 100), font=font)
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format="PNG")
+    return img_bytes.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repetitions", type=int, default=50)
+    parser.add_argument("--json", help="fichier où écrire le rapport")
+    args = parser.parse_args()
+
+    from ia import images
+
+    rng = random.Random(0)
+    prompts = [prompt_realiste(rng) for _ in range(args.repetitions)]
+    resultats = {}
+
+    tailles = [len(_reference(p)) for p in prompts[:10]]
+    resultats["reference_png"] = {
+        "latence_s": percentiles(mesurer(lambda: _reference(rng.choice(prompts)), args.repetitions)),
+        "octets_moy": sum(tailles) / len(tailles),
+    }
+
+    for format_image in images.FORMATS:
+        iterateur = iter(prompts * 2)
+        images._encoder.cache_clear()
+        froid = mesurer(lambda: images.generer_image(next(iterateur), format_image),
+                        args.repetitions, prechauffage=0)
+        chaud = mesurer(lambda: images.generer_image(prompts[0], format_image), args.repetitions)
+        tailles = [len(images.generer_image(p, format_image).getvalue()) for p in prompts[:10]]
+        resultats[format_image] = {
+            "latence_froide_s": percentiles(froid),
+            "latence_en_cache_s": percentiles(chaud),
+            "octets_moy": sum(tailles) / len(tailles),
+        }
+
+    ref = resultats["reference_png"]
+    print(f"{'variante':<16} {'froid p50 ms':>13} {'cache p50 ms':>13} {'octets':>9} {'gain taille':>12}")
+    print(f"{'référence PNG':<16} {ref['latence_s']['p50'] * 1000:>13.2f} {'–':>13} "
+          f"{ref['octets_moy']:>9.0f} {'':>12}")
+    for format_image in images.FORMATS:
+        r = resultats[format_image]
+        print(f"{format_image:<16} {r['latence_froide_s']['p50'] * 1000:>13.2f} "
+              f"{r['latence_en_cache_s']['p50'] * 1000:>13.3f} {r['octets_moy']:>9.0f} "
+              f"{1 - r['octets_moy'] / ref['octets_moy']:>12.0%}")
+
+    if args.json:
+        ecrire_rapport(args.json, "images", vars(args), resultats)
+
+
+if __name__ == "__main__":
+    main()
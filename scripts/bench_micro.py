@@ -0,0 +1,68 @@
+"""Microbenchmarks : encodage PNG de `generer_image`, construction du contexte, un appel de génération.
+
+Usage : python -m scripts.bench_micro [--modele factice|distilgpt2] [--json micro.json]
+"""
+import argparse
+import os
+import random
+
+from scripts.bench_commun import choisir_modele, ecrire_rapport, mesurer, percentiles, prompt_realiste
+
+
+def _afficher(nom: str, stats: dict):
+    print(f"{nom:<32} moy {stats['moy'] * 1000:8.2f} ms   p50 {stats['p50'] * 1000:8.2f} ms   "
+          f"p95 {stats['p95'] * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modele", default="factice",
+                        help="`factice` (GPT-2 aléatoire hors ligne) ou modèle déjà en cache local")
+    parser.add_argument("--repetitions", type=int, default=20)
+    parser.add_argument("--historique", type=int, default=50, help="messages en mémoire")
+    parser.add_argument("--json", help="fichier où écrire le rapport")
+    args = parser.parse_args()
+
+    os.environ["IA_MODELE"] = choisir_modele(args.modele)
+    from ia import backends, config, contexte
+    from ia.images import generer_image
+
+    rng = random.Random(0)
+    resultats = {}
+
+    resultats["generer_image"] = percentiles(
+        mesurer(lambda: generer_image(prompt_realiste(rng)), args.repetitions)
+    )
+    _afficher("generer_image (PNG)", resultats["generer_image"])
+
+    generator = backends.charger(config.BACKEND, config.NOM_MODELE, config.DOSSIER_ONNX)
+    tokenizer = generator.tokenizer
+    memoire = [prompt_realiste(rng) for _ in range(args.historique)]
+    budget = contexte.budget(
+        generator, config.BUDGET_CONTEXTE_TOKENS, config.PARAMS_GENERATION["max_new_tokens"]
+    )
+
+    def contexte_froid():
+        contexte.construire(tokenizer, memoire, prompt_realiste(rng), budget, {})
+
+    cache_ids = {}
+    resultats["contexte_froid"] = percentiles(mesurer(contexte_froid, args.repetitions))
+    resultats["contexte_chaud"] = percentiles(mesurer(
+        lambda: contexte.construire(tokenizer, memoire, memoire[-1], budget, cache_ids),
+        args.repetitions,
+    ))
+    _afficher("contexte (tokenisation froide)", resultats["contexte_froid"])
+    _afficher("contexte (IDs en cache)", resultats["contexte_chaud"])
+
+    params = dict(config.PARAMS_GENERATION, pad_token_id=tokenizer.eos_token_id)
+    durees = mesurer(lambda: generator(prompt_realiste(rng), **params), max(3, args.repetitions // 4))
+    resultats["generation"] = percentiles(durees)
+    resultats["generation"]["max_new_tokens"] = params["max_new_tokens"]
+    _afficher("génération (un appel)", resultats["generation"])
+
+    if args.json:
+        ecrire_rapport(args.json, "micro", vars(args), resultats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Compare les backends CPU : temps de chargement, latence, mémoire (RSS) et accord des sorties.
+
+Usage : python -m scripts.comparer_backends [--backends fp32 int8 onnx] [--json rapport.json]
+
+Chaque backend est mesuré dans un processus séparé pour que le RSS ne cumule
+pas les modèles précédents. Le décodage est glouton pour que l'accord avec la
+référence FP32 soit significatif.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import statistics
+import time
+
+from ia import config
+
+PROMPTS = [
+    "Bonjour, comment allez-vous ?",
+    "Écris une fonction Python qui trie une liste.",
+    "The weather today is",
+    "Explique-moi ce qu'est un réseau de neurones.",
+    "Once upon a time",
+]
+
+
+def _rss_mo() -> float:
+    with open("/proc/self/status") as f:
+        for ligne in f:
+            if ligne.startswith("VmRSS:"):
+                return int(ligne.split()[1]) / 1024
+    return 0.0
+
+
+def _mesurer(backend: str, nom_modele: str, repetitions: int, file: "mp.Queue"):
+    from ia import backends
+
+    try:
+        debut = time.perf_counter()
+        generator = backends.charger(backend, nom_modele, config.DOSSIER_ONNX)
+        chargement = time.perf_counter() - debut
+        params = {"max_new_tokens": config.PARAMS_GENERATION["max_new_tokens"], "do_sample": False}
+
+        generator(PROMPTS[0], **params)  # préchauffage
+        latences, sorties = [], []
+        for prompt in PROMPTS:
+            for _ in range(repetitions):
+                t0 = time.perf_counter()
+                texte = generator(prompt, pad_token_id=generator.tokenizer.eos_token_id,
+                                  **params)[0]["generated_text"]
+                latences.append(time.perf_counter() - t0)
+            sorties.append(generator.tokenizer(texte)["input_ids"])
+        file.put({
+            "backend": backend,
+            "chargement_s": chargement,
+            "latence_moy_s": statistics.mean(latences),
+            "latence_p50_s": statistics.median(latences),
+            "rss_mo": _rss_mo(),
+            "rss_pic_mo": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "sorties": sorties,
+        })
+    except Exception as e:
+        file.put({"backend": backend, "erreur": repr(e)})
+
+
+def _accord(reference, sorties) -> dict:
+    """Part de sorties identiques et proportion moyenne de tokens communs en tête."""
+    identiques, prefixes = 0, []
+    for ref, autre in zip(reference, sorties):
+        identiques += ref == autre
+        commun = 0
+        for a, b in zip(ref, autre):
+            if a != b:
+                break
+            commun += 1
+        prefixes.append(commun / max(len(ref), 1))
+    return {"identiques": identiques / len(reference), "prefixe_commun": statistics.mean(prefixes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["fp32", "int8", "onnx"])
+    parser.add_argument("--modele", default=config.NOM_MODELE)
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--json", help="fichier où écrire le rapport complet")
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    resultats = []
+    for backend in args.backends:
+        file = ctx.Queue()
+        proc = ctx.Process(target=_mesurer, args=(backend, args.modele, args.repetitions, file))
+        proc.start()
+        resultats.append(file.get())
+        proc.join()
+
+    reference = next((r for r in resultats if r["backend"] == "fp32" and "erreur" not in r), None)
+    print(f"{'backend':<8} {'charg. s':>9} {'moy. s':>8} {'p50 s':>8} {'RSS Mo':>8} "
+          f"{'pic Mo':>8} {'identiques':>10} {'préfixe':>8}")
+    for r in resultats:
+        if "erreur" in r:
+            print(f"{r['backend']:<8} erreur : {r['erreur']}")
+            continue
+        if reference is not None:
+            r["accord"] = _accord(reference["sorties"], r["sorties"])
+        accord = r.get("accord", {})
+        print(f"{r['backend']:<8} {r['chargement_s']:>9.2f} {r['latence_moy_s']:>8.3f} "
+              f"{r['latence_p50_s']:>8.3f} {r['rss_mo']:>8.0f} {r['rss_pic_mo']:>8.0f} "
+              f"{accord.get('identiques', float('nan')):>10.0%} "
+              f"{accord.get('prefixe_commun', float('nan')):>8.0%}")
+
+    if args.json:
+        for r in resultats:
+            r.pop("sorties", None)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultats, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()